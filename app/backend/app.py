@@ -1,13 +1,14 @@
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware import Middleware
-from fastapi import File, UploadFile
+from fastapi import File, Request, UploadFile
 
 from fastapi import FastAPI
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.websockets import WebSocketState
 from app.backend.authentication import AuthenticationMiddleware
@@ -19,16 +20,40 @@ from fastapi.staticfiles import StaticFiles
 import askyourdocs.utils as utl
 from askyourdocs.settings import SETTINGS as settings
 from askyourdocs.pipeline.pipeline import QueryPipeline, IngestionPipeline, RemovalPipeline, SearchPipeline, FeedbackPipeline
+from askyourdocs.pipeline.jobs import IngestionJobManager, JobQueueFull
+from askyourdocs.pipeline.executor import QueryExecutor, QueryQueueFull, get_torch_threads
+from askyourdocs.pipeline.startup import Startup
+from askyourdocs.modelling.llm import set_torch_threads
+from askyourdocs.modelling.registry import get_model_registry
 
+from contextlib import aclosing
+from hashlib import sha256
+import json
 import logging
 import os
+from pathlib import Path
+from typing import Tuple
+import uuid
 
+# Only light-weight objects are created at import, the heavy startup phases run in the background (see `Startup`)
+_STARTUP = Startup()
 environment = utl.load_environment()
-_INGESTION_PIPELINE = IngestionPipeline(environment=environment, settings=settings)
-_QUERY_PIPELINE = QueryPipeline(environment=environment, settings=settings)
-_REMOVAL_PIPELINE = RemovalPipeline(environment=environment, settings=settings)
-_SEARCH_PIPELINE = SearchPipeline(environment=environment, settings=settings)
-_FEEDBACK_PIPELINE = FeedbackPipeline(environment=environment, settings=settings)
+with _STARTUP.phase('pipelines'):
+    _INGESTION_PIPELINE = IngestionPipeline(environment=environment, settings=settings)
+    _QUERY_PIPELINE = QueryPipeline(environment=environment, settings=settings)
+    _REMOVAL_PIPELINE = RemovalPipeline(environment=environment, settings=settings)
+    _SEARCH_PIPELINE = SearchPipeline(environment=environment, settings=settings)
+    _FEEDBACK_PIPELINE = FeedbackPipeline(environment=environment, settings=settings)
+    _INGESTION_JOBS = IngestionJobManager.from_settings(pipeline=_INGESTION_PIPELINE, settings=settings)
+_READ_YOUR_WRITES = settings['solr']['commit']['read_your_writes']
+
+# Queries run in a bounded pool of workers (not on the event loop), each with its share of the cpus for torch
+_QUERY_EXECUTOR = QueryExecutor.from_settings(settings=settings)
+_STREAMING = settings['query']['streaming']['enabled']
+set_torch_threads(get_torch_threads(nworkers=settings['query']['executor']['nworkers'],
+                                    torch_threads=settings['query']['executor']['torch_threads'],
+                                    batching=settings['modelling']['generation_batching']['enabled'],
+                                    streaming=_STREAMING))
 
 def middleware():
     return [
@@ -45,9 +70,45 @@ def middleware():
 app = FastAPI(title="AYD", middleware=middleware())
 app.add_middleware(GZipMiddleware, minimum_size=500)
 
+_UPLOAD_OVERHEAD_BYTES = 64 * 1024  # multipart boundaries and part headers
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject uploads by their Content-Length before the body is received (and spooled to disk by Starlette)."""
+    if request.url.path == '/api/ingest' and (length := request.headers.get('content-length', '')).isdigit():
+        max_bytes = settings['app']['uploads']['max_bytes']
+        if int(length) > max_bytes + _UPLOAD_OVERHEAD_BYTES:
+            return JSONResponse({"detail": f'file exceeds the upload limit of {max_bytes} bytes'}, status_code=413)
+    return await call_next(request)
+
 solr_client = _SEARCH_PIPELINE.solr_client
-for name in utl.get_solr_collection_names():
-    solr_client.create_collection(name=name)
+
+
+def _create_collections():
+    for name in utl.get_solr_collection_names():
+        solr_client.create_collection(name=name)
+
+
+def _load_vector_index():
+    # Switching to the local retrieval backend on an existing corpus starts with an empty index
+    _INGESTION_PIPELINE.rebuild_vector_index(only_if_empty=True)
+
+
+_STARTUP.add_phase('collections', _create_collections)
+if settings['retrieval']['backend'] == 'local':
+    _STARTUP.add_phase('vector_index', _load_vector_index)
+if settings['app']['startup']['warm_up']:
+    _STARTUP.add_phase('warm_up', _QUERY_PIPELINE.warm_up)
+
+
+@app.on_event("startup")
+async def start_background_startup():
+    _STARTUP.start()
+
+
+_STARTING_ANSWER = [{"answer": "The service is starting, please try again in a moment.",
+                     "doc_ids": [], "indexes": [], "texts": [], "names": []}]
 
 
 class Text(BaseModel):
@@ -67,6 +128,11 @@ class Feedback(BaseModel):
 class DataList(BaseModel):
     data: list[dict] = []
 
+class IngestionJobCreated(BaseModel):
+    data: list | str
+    job_id: str | None = None
+    status: str | None = None
+
 app.mount("/app", StaticFiles(directory="/app/static"), name="static")
 app.mount("/public", StaticFiles(directory="/app/public"), name="public")
 
@@ -81,14 +147,53 @@ async def read_root():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _get_streaming_query(data: str) -> str | None:
+    """Return the question of a client that opted in to token streaming by sending `{"data": ..., "stream": true}`."""
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return None
+    if isinstance(message, dict) and message.get('stream') is True and isinstance(message.get('data'), str):
+        return message['data']
+    return None
+
+
+async def _stream_answer(websocket: WebSocket, text: str):
+    """Send the answer as token messages while it is generated, followed by a final message with its sources."""
+    async with aclosing(_QUERY_EXECUTOR.iterate(_QUERY_PIPELINE.stream, text=text)) as messages:
+        async for message in messages:
+            await websocket.send_json(message)
+
+
 @app.websocket("/ws/query")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     try:
         while True:
             data = await websocket.receive_text()
-            answer = _QUERY_PIPELINE.apply(text=data, answer_only=False)
-            await websocket.send_json(answer)
+            text = _get_streaming_query(data)
+            if text is not None and not _STREAMING:
+                # Streaming is disabled, the question is answered with a single message
+                data, text = text, None
+            if not _STARTUP.is_ready:
+                logging.warning(f'reject query during startup: {_STARTUP}')
+                await websocket.send_json({"type": "error", "data": "service is starting"} if text is not None
+                                          else _STARTING_ANSWER)
+                continue
+            try:
+                if text is not None:
+                    await _stream_answer(websocket=websocket, text=text)
+                else:
+                    answer = await _QUERY_EXECUTOR.run(_QUERY_PIPELINE.apply, text=data, answer_only=False)
+                    await websocket.send_json(answer)
+            except QueryQueueFull as e:
+                logging.warning(f'reject query: {e}')
+                if text is not None:
+                    await websocket.send_json({"type": "error", "data": str(e)})
+                else:
+                    await websocket.send_json([{"answer": "Too many questions are being answered right now, please "
+                                                          "try again in a moment.",
+                                                "doc_ids": [], "indexes": [], "texts": [], "names": []}])
     except WebSocketDisconnect:
         pass
     finally:
@@ -101,7 +206,7 @@ async def get_documents():
     query = f'*'
     collection = settings['solr']['collections']['map']['docs']
     params={'fl':'name,id'}
-    response = _SEARCH_PIPELINE.apply(query=query, collection=collection, params = params)
+    response = await run_in_threadpool(_SEARCH_PIPELINE.apply, query=query, collection=collection, params=params)
 
     return {
         "data":response
@@ -112,7 +217,7 @@ async def get_documents(id: str):
     query = f'id:{id}'
     collection = settings['solr']['collections']['map']['docs']
     params={'fl':'name,id,source'}
-    response = _SEARCH_PIPELINE.apply(query=query, collection=collection, params = params)
+    response = await run_in_threadpool(_SEARCH_PIPELINE.apply, query=query, collection=collection, params=params)
     return {
         "data":response
     }
@@ -120,26 +225,125 @@ async def get_documents(id: str):
 @app.delete("/api/delete_document", response_model=Text)
 async def delete_document(id: str):
     logging.info(f"deleting doc {id} in SOLR")
-    _REMOVAL_PIPELINE.apply(id_=id, commit=True)
+    await run_in_threadpool(_REMOVAL_PIPELINE.apply, id_=id, commit=_READ_YOUR_WRITES)
     return {
         "data": "successfully deleted."
     }
 
-@app.post("/api/ingest", response_model=ListText)
+async def _store_upload(file: UploadFile, filepath: Path) -> Tuple[Path, str]:
+    """Write an upload in chunks next to `filepath` and return the partial file and its sha256."""
+    upload_settings = settings['app']['uploads']
+    max_bytes, chunk_size = upload_settings['max_bytes'], upload_settings['chunk_size']
+    hash_, nbytes = sha256(), 0
+    # Unique per upload, such that concurrent uploads of the same filename do not write to the same file
+    partpath = filepath.with_name(f'{filepath.name}.{uuid.uuid4().hex}.part')
+
+    def _write(f, chunk: bytes):
+        hash_.update(chunk)
+        f.write(chunk)
+
+    try:
+        with open(partpath, "wb") as f:
+            while chunk := await file.read(chunk_size):
+                nbytes += len(chunk)
+                if nbytes > max_bytes:
+                    raise HTTPException(status_code=413, detail=f'file exceeds the upload limit of {max_bytes} bytes')
+                await run_in_threadpool(_write, f, chunk)
+    except BaseException:
+        partpath.unlink(missing_ok=True)
+        raise
+    logging.info(f'received upload "{filepath.name}" ({nbytes} bytes)')
+    return partpath, hash_.hexdigest()
+
+
+def _replace_upload(partpath: Path, filepath: Path):
+    """Move an accepted upload to its final path, where the document of a previous upload of the file is removed."""
+    if filepath.exists():
+        doc_id = _INGESTION_PIPELINE.get_document_id(str(filepath))
+        logging.info(f'remove document {doc_id} of the previous upload of "{filepath.name}"')
+        _REMOVAL_PIPELINE.apply(id_=doc_id, commit=_READ_YOUR_WRITES)
+    os.replace(partpath, filepath)
+
+
+# Filenames of the uploads between their storage and the submission of their ingestion job
+_UPLOADS_IN_PROGRESS = set()
+
+
+@app.post("/api/ingest", response_model=IngestionJobCreated)
 async def upload_file(file: UploadFile = File(...)):
+    if not _STARTUP.is_ready:
+        raise HTTPException(status_code=503, detail='service is starting')
     if file and file.filename:
         logging.info(f'uploading file  {file.filename}')
-        filepath = f"./app/backend/uploads/{file.filename}"
-        with open(filepath, "wb") as f:
-            f.write(file.file.read())
-        doc = _INGESTION_PIPELINE.apply(source=filepath, commit=True)
-        logging.info(doc)
-        return {"data": doc}
+        filepath = Path("./app/backend/uploads") / Path(file.filename).name
+        partpath, content_hash = await _store_upload(file=file, filepath=filepath)
+
+        try:
+            if settings['app']['uploads']['dedup']:
+                doc_id = await run_in_threadpool(_INGESTION_PIPELINE.get_document_id_by_hash,
+                                                 content_hash=content_hash)
+                if doc_id is not None:
+                    logging.info(f'"{file.filename}" is already ingested as {doc_id}, skip ingestion')
+                    return {"data": [doc_id], "job_id": None, "status": "duplicate"}
+
+            # The file of a pending ingestion must not be replaced
+            if filepath.name in _UPLOADS_IN_PROGRESS or _INGESTION_JOBS.get_pending(str(filepath)) is not None:
+                raise HTTPException(status_code=409, detail=f'"{filepath.name}" is still being ingested')
+            if _INGESTION_JOBS.is_full:
+                raise HTTPException(status_code=429, detail='too many ingestion jobs are pending')
+            _UPLOADS_IN_PROGRESS.add(filepath.name)
+            try:
+                await run_in_threadpool(_replace_upload, partpath=partpath, filepath=filepath)
+                job = _INGESTION_JOBS.submit(filename=str(filepath), commit=_READ_YOUR_WRITES,
+                                             content_hash=content_hash)
+            except JobQueueFull as e:
+                raise HTTPException(status_code=429, detail=str(e))
+            finally:
+                _UPLOADS_IN_PROGRESS.discard(filepath.name)
+        finally:
+            partpath.unlink(missing_ok=True)
+        return {"data": [job.doc_id], "job_id": job.id, "status": job.status}
     else:
         return {"data": "No file provided"}
 
 
+@app.get("/api/ingest/jobs", response_model=DataList)
+async def get_ingestion_jobs():
+    return {"data": [job.to_dict() for job in _INGESTION_JOBS.list()]}
+
+
+@app.get("/api/ingest/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    if (job := _INGESTION_JOBS.get(job_id)) is None:
+        raise HTTPException(status_code=404, detail=f'unknown ingestion job {job_id}')
+    return {"data": job.to_dict()}
+
+
+@app.get("/api/health/live")
+async def get_liveness():
+    """The process serves requests (and its startup did not fail)."""
+    return JSONResponse({"data": _STARTUP.to_dict()}, status_code=200 if _STARTUP.is_live else 503)
+
+
+@app.get("/api/health/ready")
+async def get_readiness():
+    """The collections exist and the models are loaded and warmed up, i.e. queries and ingestions are served."""
+    return JSONResponse({"data": _STARTUP.to_dict()}, status_code=200 if _STARTUP.is_ready else 503)
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    answer_cache = _QUERY_PIPELINE.answer_cache
+    return {"data": {"answer_cache": answer_cache.to_dict() if answer_cache is not None else None,
+                     "query": _QUERY_PIPELINE.metrics,
+                     "query_executor": _QUERY_EXECUTOR.to_dict(),
+                     "models": get_model_registry().to_dict(),
+                     "startup": _STARTUP.to_dict()}}
+
+
 @app.post("/api/ingest_feedback", response_model=Text)
 async def upload_feedback(feedback: Feedback):
-    doc = _FEEDBACK_PIPELINE.apply(feedback_type = feedback.feedbackType, feedback_text=feedback.feedbackText, feedback_to=feedback.feedbackTo, email=feedback.email, commit=True)
+    doc = await run_in_threadpool(_FEEDBACK_PIPELINE.apply, feedback_type=feedback.feedbackType,
+                                  feedback_text=feedback.feedbackText, feedback_to=feedback.feedbackTo,
+                                  email=feedback.email, commit=False)
     return {"data": doc}
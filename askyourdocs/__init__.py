@@ -1,2 +1,3 @@
 from askyourdocs.base import Environment, Service
-from askyourdocs.base import Document, DocumentList, DocumentListEncoder, TextDocument, TextEntity, EmbeddingEntity, FeedbackDocument
\ No newline at end of file
+from askyourdocs.base import Document, DocumentList, DocumentListEncoder, TextDocument, TextEntity, EmbeddingEntity, FeedbackDocument, Passage
+from askyourdocs.base import dumps_documents, loads_response
\ No newline at end of file
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, fields
 from datetime import datetime
 from hashlib import sha256
 import json
@@ -7,6 +7,10 @@ import reprlib
 from typing import Any, List
 
 import numpy as np
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 class Environment:
@@ -31,6 +35,13 @@ class Environment:
         self.collection: str | None = kwargs.get('collection')
         self.query: str | None = kwargs.get('query')
         self.commit: bool | None = kwargs.get('commit')
+        self.replace: bool | None = kwargs.get('replace')
+
+        # Pipeline arguments
+        self.pipelined: bool | None = kwargs.get('pipelined')
+        self.nworkers: int | None = kwargs.get('nworkers')
+        self.sync: bool | None = kwargs.get('sync')
+        self.manifest: str | None = kwargs.get('manifest')
 
         # LLM arguments
         self.text: str | None = kwargs.get('text')
@@ -70,7 +81,8 @@ class Document(ABC):
             self.id = self._id_prefix + sha256(self.id.encode()).hexdigest()
 
     def to_dict(self) -> dict:
-        return asdict(self)
+        """Shallow dictionary of all fields (in particular, vectors are not copied)."""
+        return {f.name: getattr(self, f.name) for f in fields(self)}
 
 
 @dataclass(eq=False)
@@ -79,27 +91,55 @@ class TextEntity(Document):
     text: str
     index: int | None = None
     doc_id: str | None = None
+    overlap: int | None = None
+    ntokens: int | None = None
+    passage_id: str | None = None
 
     @property
     def _id_prefix(self) -> str:
         return 'txt_ent_'
 
 
+@dataclass(eq=False)
+class Passage(Document):
+    """Token-bounded window of consecutive text entities, used as ready-made context block."""
+
+    text: str
+    doc_id: str | None = None
+    name: str | None = None
+    index: int | None = None
+    start: int | None = None
+    end: int | None = None
+    ntokens: int | None = None
+
+    @property
+    def _id_prefix(self) -> str:
+        return 'psg_'
+
+
 @dataclass(eq=False)
 class EmbeddingEntity(Document):
 
-    vector: List[float]
+    vector: np.ndarray
     doc_id: str | None = None
     txt_ent_id: str | None = None
+    passage_id: str | None = None
+    index: int | None = None
+
+    _norm_tolerance = 1e-4
 
     @property
     def _id_prefix(self) -> str:
         return 'emb_ent_'
 
     def __post_init__(self):
+        """Keep the vector as contiguous float32 array and only normalize it if the model did not already do so."""
         super().__post_init__()
-        vector = np.array(self.vector)
-        self.vector = list(vector / np.linalg.norm(vector))
+        vector = np.ascontiguousarray(self.vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if abs(norm - 1) > self._norm_tolerance:
+            vector = vector / norm
+        self.vector = vector
 
 
 @dataclass(eq=False)
@@ -108,6 +148,7 @@ class TextDocument(Document):
     name: str
     source: str
     text: str | None
+    content_hash: str | None = None
 
     def __repr__(self):
         cls_name = self.__class__.__name__
@@ -150,13 +191,39 @@ class DocumentListEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Document):
             return obj.to_dict()
-        if isinstance(obj, np.float32):
-            return str(obj)
-        if isinstance(obj, np.int64):
-            return str(obj)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.integer):
+            return int(obj)
         if isinstance(obj, datetime):
             return obj.isoformat()
         return super().default(obj)
 
 
 DocumentList = List[Document]
+
+
+def _orjson_default(obj):
+    if isinstance(obj, Document):
+        return obj.to_dict()
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    raise TypeError
+
+
+def dumps_documents(documents: DocumentList) -> bytes:
+    """Serialize documents to a JSON body for solr (with `orjson` if available)."""
+    if orjson is not None:
+        return orjson.dumps(documents, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(documents, cls=DocumentListEncoder).encode()
+
+
+def loads_response(content: bytes) -> Any:
+    """Parse a JSON response body (with `orjson` if available)."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
@@ -0,0 +1,130 @@
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Type, TypeVar
+
+
+class DiskCache:
+    """Persistent, size-bounded key-value store (sqlite) with least-recently-used eviction."""
+
+    _nvars_max = 500
+    _evict_fraction = 0.9
+
+    def __init__(self, path: str | Path, max_bytes: int):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                           '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self._conn.commit()
+        self._nbytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+        self.nhits = 0
+        self.nmisses = 0
+
+    def __repr__(self):
+        cls_name = type(self).__name__
+        return f'{cls_name}(path={str(self._path)!r}, max_bytes={self._max_bytes})'
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @classmethod
+    def _chunks(cls, keys: List[str]) -> Iterable[List[str]]:
+        for i in range(0, len(keys), cls._nvars_max):
+            yield keys[i:i + cls._nvars_max]
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """Return the values of all cached keys (missing keys are not part of the result)."""
+        keys = list(dict.fromkeys(keys))
+        values: Dict[str, bytes] = {}
+        with self._lock:
+            for chunk in self._chunks(keys):
+                marks = ','.join('?' * len(chunk))
+                rows = self._conn.execute(f'SELECT key, value FROM entries WHERE key IN ({marks})', chunk)
+                values.update(rows.fetchall())
+            if values:
+                now = time.time()
+                self._conn.executemany('UPDATE entries SET accessed = ? WHERE key = ?', ((now, k) for k in values))
+                self._conn.commit()
+            self.nhits += len(values)
+            self.nmisses += len(keys) - len(values)
+        return values
+
+    def get(self, key: str) -> bytes | None:
+        return self.get_many(keys=[key]).get(key)
+
+    def put_many(self, items: Dict[str, bytes]):
+        """Store the given values and evict the least recently used entries if the cache gets too large."""
+        if not items:
+            return
+        with self._lock:
+            keys = list(items.keys())
+            for chunk in self._chunks(keys):
+                marks = ','.join('?' * len(chunk))
+                rows = self._conn.execute(f'SELECT size FROM entries WHERE key IN ({marks})', chunk)
+                self._nbytes -= sum(r[0] for r in rows.fetchall())
+
+            now = time.time()
+            self._conn.executemany('INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                                   ((k, v, len(v), now) for k, v in items.items()))
+            self._nbytes += sum(len(v) for v in items.values())
+            if self._nbytes > self._max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def put(self, key: str, value: bytes):
+        self.put_many(items={key: value})
+
+    def _evict(self):
+        target = int(self._max_bytes * self._evict_fraction)
+        rows = self._conn.execute('SELECT key, size FROM entries ORDER BY accessed ASC')
+        evicted = []
+        while self._nbytes > target and (row := rows.fetchone()) is not None:
+            evicted.append(row[0])
+            self._nbytes -= row[1]
+        rows.close()
+        for chunk in self._chunks(evicted):
+            marks = ','.join('?' * len(chunk))
+            self._conn.execute(f'DELETE FROM entries WHERE key IN ({marks})', chunk)
+        logging.info(f'evicted {len(evicted)} entries from {self}')
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries')
+            self._conn.commit()
+            self._nbytes = 0
+
+    def stats(self) -> dict:
+        nrequests = self.nhits + self.nmisses
+        return {
+            'hits': self.nhits,
+            'misses': self.nmisses,
+            'hit_rate': self.nhits / nrequests if nrequests else 0.0,
+            'nbytes': self._nbytes,
+            'max_bytes': self._max_bytes,
+        }
+
+
+_Cache = TypeVar('_Cache', bound=DiskCache)
+_SHARED_CACHES: Dict[Path, DiskCache] = {}
+_SHARED_CACHES_LOCK = threading.Lock()
+
+
+def get_shared_cache(cls: Type[_Cache], path: str | Path, max_bytes: int) -> _Cache:
+    """Return the process-wide instance of the cache stored at `path`."""
+    path = Path(path)
+    with _SHARED_CACHES_LOCK:
+        if path not in _SHARED_CACHES:
+            logging.info(f'open {cls.__name__} "{path}"')
+            _SHARED_CACHES[path] = cls(path=path, max_bytes=max_bytes)
+        return _SHARED_CACHES[path]
@@ -1,7 +1,9 @@
 import logging
 
 from askyourdocs import Environment, Service, EmbeddingEntity
-from askyourdocs.modelling.llm import TextEmbedder, TextTokenizer
+from askyourdocs.modelling.cache import get_embedding_cache
+from askyourdocs.modelling.chunking import get_chunker
+from askyourdocs.modelling.llm import TextEmbedder, TextTokenizer, TextTokenCounter
 
 
 class ModellingService(Service):
@@ -20,11 +22,14 @@ class ModellingService(Service):
                 logging.info(f'start text embedding')
                 model_name = self._settings['modelling']['model_name']
                 cache_folder = self._settings['paths']['models']
-                model = TextEmbedder(model_name=model_name, cache_folder=cache_folder)
+                embedding_cache = get_embedding_cache(settings=self._settings)
+                backend = self._settings['modelling']['inference']['embedder']
+                model = TextEmbedder(model_name=model_name, cache_folder=cache_folder, cache=embedding_cache,
+                                     backend=backend)
 
                 text = self._environment.text
                 vector = model.apply(texts=text)
-                embedding = EmbeddingEntity(id=text, vector=list(vector))
+                embedding = EmbeddingEntity(id=text, vector=vector)
                 logging.info(f'vector has length{len(embedding.vector)}')
 
             case 'tokenization':
@@ -35,3 +40,18 @@ class ModellingService(Service):
                 text = self._environment.text
                 text_entities = tokenizer.get_text_entities(text=text)
                 logging.info(f'tokenized into {len(text_entities)} text entities')
+
+            case 'chunking':
+                logging.info(f'start text chunking')
+                model_name = self._settings['modelling']['model_name']
+                token_counter = TextTokenCounter(model_name=model_name)
+
+                text = self._environment.text
+                for strategy in ['sentence', 'sliding_window']:
+                    for splitter in ['punkt', 'regex']:
+                        chunker = get_chunker(settings=self._settings, token_counter=token_counter,
+                                              strategy=strategy, splitter=splitter)
+                        chunks = chunker.apply(text=text)
+                        ntokens = sum(c.ntokens for c in chunks)
+                        logging.info(f'strategy "{strategy}" with splitter "{splitter}": {len(chunks)} text entities '
+                                     f'with {ntokens} tokens in total')
@@ -0,0 +1,239 @@
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import logging
+from queue import Empty, Queue
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from askyourdocs.modelling.llm import Summarizer, TextEmbedder
+
+
+class EmbeddingBatchError(Exception):
+    """Raised if the texts of some owners could not be embedded, carries the failed and the completed owners."""
+
+    def __init__(self, owners: List[Any], cause: Exception, completed: List[Tuple[Any, np.ndarray]] | None = None):
+        super().__init__(f'embedding of {len(owners)} owner(s) failed: {cause!r}')
+        self.owners = owners
+        self.completed = completed or []
+
+
+@dataclass
+class _Owner:
+    obj: Any
+    vectors: List[np.ndarray | None]
+    nmissing: int
+
+
+@dataclass
+class EmbeddingBatcherStats:
+    ntexts: int = 0
+    nbatches: int = 0
+    seconds: float = 0.0
+    batch_sizes: List[int] = field(default_factory=list)
+
+    @property
+    def texts_per_second(self) -> float:
+        return self.ntexts / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f'embedded {self.ntexts} texts in {self.nbatches} batches within {self.seconds:.2f}s '
+                f'-> {self.texts_per_second:.1f} texts/s')
+
+
+class EmbeddingBatcher:
+    """Gathers the texts of several owners into length-sorted embedding batches and routes the vectors back."""
+
+    def __init__(self, embedder: TextEmbedder, batch_size: int = 32, nbatches: int = 8, normalize_embeddings: bool = True):
+        self._embedder = embedder
+        self._batch_size = batch_size
+        self._window_size = batch_size * nbatches
+        self._normalize_embeddings = normalize_embeddings
+
+        self._owners: Dict[int, _Owner] = {}
+        self._pending: List[Tuple[int, int, str]] = []
+        self._next_owner_id = 0
+        self.stats = EmbeddingBatcherStats()
+
+    def add(self, owner: Any, texts: List[str]) -> List[Tuple[Any, np.ndarray]]:
+        """Add the texts of an owner and return all owners (with their vectors) whose texts are completely embedded."""
+        owner_id = self._next_owner_id
+        self._next_owner_id += 1
+        self._owners[owner_id] = _Owner(obj=owner, vectors=[None] * len(texts), nmissing=len(texts))
+        self._pending.extend((owner_id, pos, text) for pos, text in enumerate(texts))
+
+        return self._process_windows(min_pending=self._window_size)
+
+    def flush(self) -> List[Tuple[Any, np.ndarray]]:
+        """Embed all pending texts and return the remaining owners."""
+        return self._process_windows(min_pending=1)
+
+    def _process_windows(self, min_pending: int) -> List[Tuple[Any, np.ndarray]]:
+        completed = self._pop_completed()
+        failed: Dict[int, Exception] = {}
+        while len(self._pending) >= min_pending:
+            failed.update(self._process_window())
+            completed.extend(self._pop_completed())
+
+        if failed:
+            owners = [self._owners.pop(owner_id).obj for owner_id in failed]
+            cause = next(iter(failed.values()))
+            raise EmbeddingBatchError(owners=owners, cause=cause, completed=completed) from cause
+        return completed
+
+    def _embed(self, batch: List[Tuple[int, int, str]]):
+        start = time.perf_counter()
+        vectors = self._embedder.apply(texts=[text for _, _, text in batch], batch_size=self._batch_size,
+                                       normalize_embeddings=self._normalize_embeddings)
+        self.stats.seconds += time.perf_counter() - start
+        self.stats.ntexts += len(batch)
+        self.stats.nbatches += 1
+        self.stats.batch_sizes.append(len(batch))
+        for (owner_id, pos, _), vector in zip(batch, vectors):
+            owner = self._owners[owner_id]
+            owner.vectors[pos] = vector
+            owner.nmissing -= 1
+
+    def _process_window(self) -> Dict[int, Exception]:
+        """Embed the next window and return the owners whose texts failed (their pending texts are dropped)."""
+        window, self._pending = self._pending[:self._window_size], self._pending[self._window_size:]
+        window.sort(key=lambda p: len(p[2]))
+        failed: Dict[int, Exception] = {}
+        for i in range(0, len(window), self._batch_size):
+            batch = [p for p in window[i:i + self._batch_size] if p[0] not in failed]
+            if not batch:
+                continue
+            try:
+                self._embed(batch=batch)
+            except Exception as exc:
+                logging.warning(f'embedding of a batch of {len(batch)} texts failed ({exc!r}), retry per owner')
+                for owner_id in dict.fromkeys(owner_id for owner_id, _, _ in batch):
+                    try:
+                        self._embed(batch=[p for p in batch if p[0] == owner_id])
+                    except Exception as owner_exc:
+                        failed[owner_id] = owner_exc
+
+        if failed:
+            self._pending = [p for p in self._pending if p[0] not in failed]
+        logging.debug(f'embedded window of {len(window)} texts, {len(self._pending)} texts pending')
+        return failed
+
+    def _pop_completed(self) -> List[Tuple[Any, np.ndarray]]:
+        completed = [owner_id for owner_id, owner in self._owners.items() if owner.nmissing == 0]
+        result = []
+        for owner_id in completed:
+            owner = self._owners.pop(owner_id)
+            vectors = np.stack(owner.vectors) if owner.vectors else np.empty((0, 0), dtype=np.float32)
+            result.append((owner.obj, vectors))
+        return result
+
+
+_STOP = object()
+
+
+@dataclass
+class _GenerationRequest:
+    query: str
+    context: str
+    future: Future = field(default_factory=Future)
+
+
+@dataclass
+class GenerationBatcherStats:
+    nanswers: int = 0
+    nbatches: int = 0
+    seconds: float = 0.0
+    max_batch_size: int = 0
+
+    @property
+    def answers_per_second(self) -> float:
+        return self.nanswers / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.nanswers / self.nbatches if self.nbatches else 0.0
+
+    def to_dict(self) -> dict:
+        return {'answers': self.nanswers, 'batches': self.nbatches, 'mean_batch_size': self.mean_batch_size,
+                'max_batch_size': self.max_batch_size, 'answers_per_second': self.answers_per_second}
+
+    def __str__(self):
+        return (f'generated {self.nanswers} answers in {self.nbatches} batches within {self.seconds:.2f}s '
+                f'-> {self.answers_per_second:.2f} answers/s')
+
+
+class GenerationBatcher:
+    """Gathers concurrent questions into padded batches for the generation of the answers."""
+
+    def __init__(self, summarizer: Summarizer, max_batch_size: int = 8, max_wait: float = 0.01):
+        self._summarizer = summarizer
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._queue: Queue = Queue()
+        self._lock = threading.Lock()
+        self.stats = GenerationBatcherStats()
+        self._thread = threading.Thread(target=self._run, name='ayd-generation-batcher', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_settings(cls, summarizer: Summarizer, settings: dict) -> 'GenerationBatcher | None':
+        batching = settings['modelling']['generation_batching']
+        if not batching['enabled']:
+            return None
+        if (nworkers := settings['query']['executor']['nworkers']) < batching['max_batch_size']:
+            logging.warning(f'generation batches hold at most {nworkers} questions (query executor nworkers) instead '
+                            f'of max_batch_size={batching["max_batch_size"]}')
+        return cls(summarizer=summarizer, max_batch_size=batching['max_batch_size'],
+                   max_wait=batching['max_wait_ms'] / 1000)
+
+    def get_answer(self, query: str, context: str) -> str:
+        request = _GenerationRequest(query=query, context=context)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _collect(self) -> Tuple[List[_GenerationRequest], bool]:
+        """Return the next batch of requests and whether the batcher is stopped."""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, stopped = self._collect()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                answers = self._summarizer.get_answers(queries=[r.query for r in batch],
+                                                       contexts=[r.context for r in batch])
+            except Exception as exc:
+                for request in batch:
+                    request.future.set_exception(exc)
+                continue
+
+            with self._lock:
+                self.stats.seconds += time.perf_counter() - start
+                self.stats.nanswers += len(batch)
+                self.stats.nbatches += 1
+                self.stats.max_batch_size = max(self.stats.max_batch_size, len(batch))
+            logging.debug(f'generated batch of {len(batch)} answers')
+            for request, answer in zip(batch, answers):
+                request.future.set_result(answer)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
@@ -0,0 +1,33 @@
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from askyourdocs.cache import DiskCache, get_shared_cache
+
+
+class EmbeddingCache(DiskCache):
+    """Persistent cache of text embeddings keyed by the model name and the hash of the text."""
+
+    _dtype = np.float32
+
+    @staticmethod
+    def get_key(model_name: str, text: str, normalize_embeddings: bool = True) -> str:
+        return sha256(f'{model_name}\x00{int(normalize_embeddings)}\x00{text}'.encode()).hexdigest()
+
+    def get_vectors(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        return {k: np.frombuffer(v, dtype=self._dtype) for k, v in self.get_many(keys=keys).items()}
+
+    def put_vectors(self, vectors: Dict[str, np.ndarray]):
+        self.put_many(items={k: np.asarray(v, dtype=self._dtype).tobytes() for k, v in vectors.items()})
+
+
+def get_embedding_cache(settings: dict) -> EmbeddingCache | None:
+    """Return the (process-wide shared) embedding cache if it is enabled in the settings."""
+    cache_settings = settings['modelling']['embedding_cache']
+    if not cache_settings['enabled']:
+        return None
+
+    path = Path(settings['paths']['cache']) / cache_settings['filename']
+    return get_shared_cache(cls=EmbeddingCache, path=path, max_bytes=cache_settings['max_bytes'])
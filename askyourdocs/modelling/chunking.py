@@ -0,0 +1,206 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import logging
+import re
+from typing import Callable, List, Tuple
+
+import nltk
+
+from askyourdocs.modelling.llm import TextTokenizer
+
+
+TokenCounter = Callable[[List[str]], List[int]]
+
+
+@dataclass
+class Chunk:
+    """A piece of text with its number of tokens and the number of leading characters repeating the previous chunk."""
+
+    text: str
+    ntokens: int
+    overlap: int = 0
+
+
+class SentenceSplitter(ABC):
+    """Splits a text into sentences."""
+
+    name: str
+
+    @abstractmethod
+    def apply(self, text: str) -> List[str]:
+        pass
+
+
+class PunktSplitter(SentenceSplitter):
+    """Accurate sentence splitting using the nltk punkt tokenizer."""
+
+    name = 'punkt'
+
+    def __init__(self, package: str = 'punkt'):
+        TextTokenizer(package=package)
+
+    def apply(self, text: str) -> List[str]:
+        return nltk.sent_tokenize(text=text)
+
+
+class RegexSplitter(SentenceSplitter):
+    """Fast sentence splitting on sentence punctuation and blank lines, meant for very large texts."""
+
+    name = 'regex'
+    _pattern = re.compile(r'(?<=[.!?])\s+(?=["\'(\[]?[A-Z0-9])|\n\s*\n')
+
+    def apply(self, text: str) -> List[str]:
+        return [s for s in (s.strip() for s in self._pattern.split(text)) if s]
+
+
+class AutoSplitter(SentenceSplitter):
+    """Uses punkt for regular texts and the regex splitter for texts longer than `nchar_max` characters."""
+
+    name = 'auto'
+
+    def __init__(self, package: str = 'punkt', nchar_max: int = 1_000_000):
+        self._punkt = PunktSplitter(package=package)
+        self._regex = RegexSplitter()
+        self._nchar_max = nchar_max
+
+    def apply(self, text: str) -> List[str]:
+        if len(text) > self._nchar_max:
+            logging.info(f'text with {len(text)} characters is split by {self._regex.name} splitter')
+            return self._regex.apply(text=text)
+        return self._punkt.apply(text=text)
+
+
+class Chunker(ABC):
+    """Splits a text into chunks, which are stored and embedded as text entities."""
+
+    name: str
+
+    def __init__(self, splitter: SentenceSplitter):
+        self._splitter = splitter
+        self.ntexts = 0
+        self.nchunks = 0
+
+    @abstractmethod
+    def _chunk(self, sentences: List[str]) -> List[Chunk]:
+        pass
+
+    def apply(self, text: str) -> List[Chunk]:
+        sentences = self._splitter.apply(text=text)
+        chunks = self._chunk(sentences=sentences)
+        self.ntexts += 1
+        self.nchunks += len(chunks)
+        logging.info(f'chunking strategy "{self.name}" ({self._splitter.name}) produced {len(chunks)} text entities '
+                     f'from {len(sentences)} sentences')
+        return chunks
+
+
+class SentenceChunker(Chunker):
+    """One chunk per sentence."""
+
+    name = 'sentence'
+
+    def __init__(self, splitter: SentenceSplitter, token_counter: TokenCounter | None = None):
+        super().__init__(splitter=splitter)
+        self._token_counter = token_counter
+
+    def _chunk(self, sentences: List[str]) -> List[Chunk]:
+        ntokens = self._token_counter(sentences) if self._token_counter is not None else [0] * len(sentences)
+        return [Chunk(text=s, ntokens=n) for s, n in zip(sentences, ntokens)]
+
+
+class SlidingWindowChunker(Chunker):
+    """Packs consecutive sentences into chunks of at most `chunk_size` tokens with `chunk_overlap` tokens of overlap."""
+
+    name = 'sliding_window'
+    _sep = ' '
+
+    def __init__(self, splitter: SentenceSplitter, token_counter: TokenCounter, chunk_size: int = 96,
+                 chunk_overlap: int = 24):
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f'chunk_overlap={chunk_overlap} must be smaller than chunk_size={chunk_size}')
+        super().__init__(splitter=splitter)
+        self._token_counter = token_counter
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+
+    def _split_long_sentence(self, sentence: str, n: int) -> List[Tuple[str, int]]:
+        """Halve a sentence (by words or characters) until all parts fit into a chunk."""
+        if n <= self._chunk_size or len(sentence) <= 1:
+            return [(sentence, n)]
+        words = sentence.split()
+        if len(words) > 1:
+            mid = len(words) // 2
+            halves = [self._sep.join(words[:mid]), self._sep.join(words[mid:])]
+        else:
+            mid = len(sentence) // 2
+            halves = [sentence[:mid], sentence[mid:]]
+        parts = []
+        for half, nh in zip(halves, self._token_counter(halves)):
+            parts.extend(self._split_long_sentence(sentence=half, n=nh))
+        return parts
+
+    def _split_long_sentences(self, sentences: List[str], ntokens: List[int]) -> Tuple[List[str], List[int]]:
+        pieces, npieces = [], []
+        for sentence, n in zip(sentences, ntokens):
+            for piece, nt in self._split_long_sentence(sentence=sentence, n=n):
+                pieces.append(piece)
+                npieces.append(nt)
+        return pieces, npieces
+
+    def _chunk(self, sentences: List[str]) -> List[Chunk]:
+        if not sentences:
+            return []
+        sentences, ntokens = self._split_long_sentences(sentences=sentences, ntokens=self._token_counter(sentences))
+
+        chunks = []
+        start, overlap_start = 0, 0
+        while start < len(sentences):
+            end, total = start, 0
+            while end < len(sentences) and (end == start or total + ntokens[end] <= self._chunk_size):
+                total += ntokens[end]
+                end += 1
+
+            # The first sentences up to `overlap_start` were already part of the previous chunk
+            overlap = len(self._sep.join(sentences[start:overlap_start])) + len(self._sep) if overlap_start > start else 0
+            chunks.append(Chunk(text=self._sep.join(sentences[start:end]), ntokens=total, overlap=overlap))
+            if end == len(sentences):
+                break
+
+            # Start the next chunk with the trailing sentences fitting into the overlap (always make progress)
+            next_start, noverlap = end, 0
+            while next_start - 1 > start and noverlap + ntokens[next_start - 1] <= self._chunk_overlap and \
+                    noverlap + ntokens[next_start - 1] + ntokens[end] <= self._chunk_size:
+                next_start -= 1
+                noverlap += ntokens[next_start]
+            start, overlap_start = next_start, end
+        return chunks
+
+
+def get_chunker(settings: dict, token_counter: TokenCounter | None = None, strategy: str | None = None,
+                splitter: str | None = None) -> Chunker:
+    """Create the chunker defined in `SETTINGS['modelling']['chunking']` (or the given strategy and splitter)."""
+    chunking = settings['modelling']['chunking']
+    strategy = strategy or chunking['strategy']
+    splitter = splitter or chunking['splitter']
+    package = settings['modelling']['tokenizer_package']
+
+    match splitter:
+        case 'punkt':
+            sentence_splitter = PunktSplitter(package=package)
+        case 'regex':
+            sentence_splitter = RegexSplitter()
+        case 'auto':
+            sentence_splitter = AutoSplitter(package=package, nchar_max=chunking['regex_nchar_min'])
+        case _:
+            raise ValueError(f'unknown sentence splitter "{splitter}"')
+
+    match strategy:
+        case 'sentence':
+            return SentenceChunker(splitter=sentence_splitter, token_counter=token_counter)
+        case 'sliding_window':
+            if token_counter is None:
+                raise ValueError(f'chunking strategy "{strategy}" requires a token counter')
+            return SlidingWindowChunker(splitter=sentence_splitter, token_counter=token_counter,
+                                        chunk_size=chunking['chunk_size'], chunk_overlap=chunking['chunk_overlap'])
+        case _:
+            raise ValueError(f'unknown chunking strategy "{strategy}"')
@@ -12,3 +12,4 @@ def add_parser(parser: argparse.ArgumentParser):
 
     mdl_subprs.add_parser('embedding', help='Text embedding by llm', parents=[mdl_txt_parser()])
     mdl_subprs.add_parser('tokenization', help='Text tokenization', parents=[mdl_txt_parser()])
+    mdl_subprs.add_parser('chunking', help='Compare the text chunking strategies', parents=[mdl_txt_parser()])
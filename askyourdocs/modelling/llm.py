@@ -1,30 +1,132 @@
 import logging
-from typing import List
+from pathlib import Path
+import threading
+from typing import Iterator, List
 
 import torch.cuda
 import nltk.data
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, T5ForConditionalGeneration
+from transformers import (AutoTokenizer, StoppingCriteria, StoppingCriteriaList, T5ForConditionalGeneration,
+                          TextIteratorStreamer)
+try:
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+except ImportError:  # pragma: no cover
+    ORTModelForSeq2SeqLM = None
+
+from askyourdocs.modelling.cache import EmbeddingCache
+from askyourdocs.modelling.registry import get_model_registry
+
+
+def set_torch_threads(nthreads: int):
+    """Set the number of intra-op threads torch uses for a forward pass (e.g. one share of the cpus per query worker)."""
+    logging.info(f'set torch intra-op threads to {nthreads}')
+    torch.set_num_threads(nthreads)
+
+
+def get_tokenizer(model_name: str):
+    """Tokenizer of a model, shared by the token counters and the summarizer of a process."""
+    return get_model_registry().get(name=model_name, role='tokenizer',
+                                    loader=lambda: AutoTokenizer.from_pretrained(model_name))
+
+
+def quantize_dynamic(model: torch.nn.Module) -> torch.nn.Module:
+    """int8 dynamic quantization of the linear layers (int8 weights, activations quantized on the fly), cpu only."""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class StopOnEvent(StoppingCriteria):
+    """Stops a generation once the event is set (e.g. the consumer of a streamed answer is gone)."""
+
+    def __init__(self, event: threading.Event):
+        self._event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self._event.is_set()
 
 
 class TextEmbedder:
+    """Computes the embeddings of texts with the 'fp32' or 'int8' backend."""
 
-    def __init__(self, model_name: str, cache_folder: str):
+    def __init__(self, model_name: str, cache_folder: str, cache: EmbeddingCache | None = None, backend: str = 'fp32'):
         self._model_name = model_name
         self._cache_folder = cache_folder
+        self._cache = cache
         self._device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self._model = SentenceTransformer(model_name, cache_folder=cache_folder, device=self._device)
 
-    def apply(self, texts: str | List[str], show_progress_bar: bool = None, normalize_embeddings: bool = True) -> np.ndarray:
-        embeddings = self._model.encode(
+        match backend:
+            case 'fp32':
+                pass
+            case 'int8' if self._device == 'cpu':
+                pass
+            case 'int8':
+                logging.warning(f'int8 quantization is only available on cpu, use fp32 embedding model on {self._device}')
+                backend = 'fp32'
+            case _:
+                raise ValueError(f'unknown embedding backend "{backend}"')
+        self._backend = backend
+        # Vectors of quantized models are cached separately
+        self._cache_model_name = model_name if backend == 'fp32' else f'{model_name}/{backend}'
+
+    def _load_model(self) -> SentenceTransformer:
+        model = SentenceTransformer(self._model_name, cache_folder=self._cache_folder, device=self._device)
+        if self._backend == 'int8':
+            logging.info(f'quantize embedding model {self._model_name} to int8')
+            model = quantize_dynamic(model)
+        return model
+
+    @property
+    def model(self) -> SentenceTransformer:
+        return get_model_registry().get(name=self._model_name, role=f'embedder/{self._backend}', loader=self._load_model)
+
+    @property
+    def cache(self) -> EmbeddingCache | None:
+        return self._cache
+
+    def warm_up(self):
+        """Load the model and run a dummy pass (bypassing the cache), such that the first real request is not slow."""
+        self._encode(texts=['warm-up'])
+
+    def _encode(self, texts: str | List[str], show_progress_bar: bool = None, normalize_embeddings: bool = True,
+                batch_size: int = 32) -> np.ndarray:
+        embeddings = self.model.encode(
             sentences=texts,
+            batch_size=batch_size,
             show_progress_bar=show_progress_bar,
             device=self._device,
             normalize_embeddings=normalize_embeddings,
         )
         return embeddings
 
+    def _apply_cached(self, texts: List[str], show_progress_bar: bool = None, normalize_embeddings: bool = True,
+                      batch_size: int = 32) -> np.ndarray:
+        """Look up all texts in the cache and only pass the (unique) misses to the model."""
+        keys = [self._cache.get_key(model_name=self._cache_model_name, text=t, normalize_embeddings=normalize_embeddings)
+                for t in texts]
+        vectors = self._cache.get_vectors(keys=keys)
+
+        missing = {k: t for k, t in zip(keys, texts) if k not in vectors}
+        logging.debug(f'embedding cache: {len(texts) - len(missing)} hits and {len(missing)} misses')
+        if missing:
+            embeddings = self._encode(texts=list(missing.values()), show_progress_bar=show_progress_bar,
+                                      normalize_embeddings=normalize_embeddings, batch_size=batch_size)
+            computed = dict(zip(missing.keys(), embeddings))
+            self._cache.put_vectors(vectors=computed)
+            vectors.update(computed)
+
+        return np.stack([vectors[k] for k in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def apply(self, texts: str | List[str], show_progress_bar: bool = None, normalize_embeddings: bool = True,
+              batch_size: int = 32) -> np.ndarray:
+        if self._cache is None:
+            return self._encode(texts=texts, show_progress_bar=show_progress_bar, normalize_embeddings=normalize_embeddings,
+                                batch_size=batch_size)
+
+        if isinstance(texts, str):
+            return self._apply_cached(texts=[texts], normalize_embeddings=normalize_embeddings)[0]
+        return self._apply_cached(texts=texts, show_progress_bar=show_progress_bar, normalize_embeddings=normalize_embeddings,
+                                  batch_size=batch_size)
+
 
 class TextTokenizer:
 
@@ -49,29 +151,161 @@ class TextTokenizer:
                 logging.error(f'unknown token entity {entity}')
 
 
+class TextTokenCounter:
+    """Counts the number of model tokens of texts."""
+
+    def __init__(self, model_name: str):
+        self._model_name = model_name
+
+    @property
+    def tokenizer(self):
+        return get_tokenizer(model_name=self._model_name)
+
+    def __call__(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        input_ids = self.tokenizer(texts, add_special_tokens=False, padding=False, truncation=False,
+                                   verbose=False)['input_ids']
+        return [len(ids) for ids in input_ids]
+
+
 class Summarizer:
+    """Generates answers from a context with the 'fp32', 'int8', or 'onnx' backend."""
 
     _task = """I want you to act like a most rational person that only give answers for which he has strong evidence. 
     Therefore, I don't want you to give me any information that is not contained in the provided context. 
     Please just summarize the context with respect to the asked question in simple words. If there is no 
     related information in the context please inform me accordingly."""
+    _backends = ('fp32', 'int8', 'onnx')
 
     def __init__(self, settings: dict):
         self._settings = settings
-        model_name = settings['modelling']['model_name']
-        cache_folder = settings['paths']['models']
+        self._model_name = settings['modelling']['model_name']
+        self._cache_folder = settings['paths']['models']
+        self._backend = settings['modelling']['inference']['summarizer']
+        if self._backend not in self._backends:
+            raise ValueError(f'unknown generation backend "{self._backend}"')
+
+        assisted = settings['modelling']['assisted_generation']
+        self._draft_model_name = assisted['draft_model_name'] if assisted['enabled'] else None
+        if self._draft_model_name is not None and self._backend == 'onnx':
+            logging.warning('assisted generation is not available with the onnx backend and is disabled')
+            self._draft_model_name = None
+        self._num_assistant_tokens = assisted['num_assistant_tokens']
 
-        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
-        # TODO do not use T5ForConditionalGeneration but rather a generic model
-        self._model = T5ForConditionalGeneration.from_pretrained(model_name, cache_dir=cache_folder)
         self._ntok_max = settings['modelling']['ntok_max']
         self._no_repeat_ngram_size = settings['modelling']['no_repeat_ngram_size']
 
+    @property
+    def tokenizer(self):
+        return get_tokenizer(model_name=self._model_name)
+
+    @property
+    def model(self):
+        return get_model_registry().get(name=self._model_name, role=f'generator/{self._backend}',
+                                        loader=self._load_model)
+
+    @property
+    def draft_model(self):
+        if self._draft_model_name is None:
+            return None
+        return get_model_registry().get(name=self._draft_model_name, role=f'draft/{self._backend}',
+                                        loader=self._load_draft_model)
+
+    def _load_model(self):
+        model_name, cache_folder = self._model_name, self._cache_folder
+        match self._backend:
+            case 'fp32':
+                # TODO do not use T5ForConditionalGeneration but rather a generic model
+                return T5ForConditionalGeneration.from_pretrained(model_name, cache_dir=cache_folder)
+
+            case 'int8':
+                logging.info(f'quantize generation model {model_name} to int8')
+                model = T5ForConditionalGeneration.from_pretrained(model_name, cache_dir=cache_folder)
+                return quantize_dynamic(model)
+
+            case _:
+                if ORTModelForSeq2SeqLM is None:
+                    raise ImportError('the onnx backend requires optimum[onnxruntime]')
+                onnx_dir = Path(cache_folder) / 'onnx' / model_name.replace('/', '--')
+                if onnx_dir.exists():
+                    return ORTModelForSeq2SeqLM.from_pretrained(onnx_dir)
+                logging.info(f'export generation model {model_name} to onnx in "{onnx_dir}"')
+                model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, cache_dir=cache_folder)
+                model.save_pretrained(onnx_dir)
+                return model
+
+
+    def _load_draft_model(self):
+        logging.info(f'load draft model {self._draft_model_name} for assisted generation')
+        draft_model = T5ForConditionalGeneration.from_pretrained(self._draft_model_name, cache_dir=self._cache_folder)
+        if self._backend == 'int8':
+            draft_model = quantize_dynamic(draft_model)
+        # Initial number of proposed tokens (`max_assistant_tokens` before transformers 4.35)
+        draft_model.generation_config.num_assistant_tokens = self._num_assistant_tokens
+        draft_model.max_assistant_tokens = self._num_assistant_tokens
+        return draft_model
+
+    def _get_generate_kwargs(self, batch_size: int = 1) -> dict:
+        kwargs = {'max_length': self._ntok_max, 'no_repeat_ngram_size': self._no_repeat_ngram_size}
+        if self._draft_model_name is not None and batch_size == 1:
+            kwargs['assistant_model'] = self.draft_model
+        return kwargs
+
+    def warm_up(self):
+        """Load the models and run a dummy generation, such that the first real question is not slow."""
+        self.get_answer(query='warm-up', context='warm-up')
+
+    def _get_prompt(self, query: str, context: str) -> str:
+        return (f'{self._task} Context: {context}\n\n. Briefly summarize the above context with respect to the'
+                f'following question: {query}')
+
+    def _encode(self, prompts: str | List[str]) -> dict:
+        # Batches are padded afterwards, such that the state of the shared tokenizer never changes (see `get_tokenizer`)
+        if isinstance(prompts, str):
+            return self.tokenizer(prompts, padding=False, truncation=False, return_tensors='pt')
+        encodings = self.tokenizer(prompts, padding=False, truncation=False)
+        return self.tokenizer.pad(encodings, return_tensors='pt')
+
     def get_answer(self, query: str, context: str) -> str:
-        prompt = (f'{self._task} Context: {context}\n\n. Briefly summarize the above context with respect to the'
-                  f'following question: {query}')
-        inputs = self._tokenizer.encode(prompt, return_tensors='pt')
+        prompt = self._get_prompt(query=query, context=context)
+        inputs = self._encode(prompt)['input_ids']
 
-        outputs = self._model.generate(inputs, max_length=self._ntok_max, no_repeat_ngram_size=self._no_repeat_ngram_size)
-        answer = self._tokenizer.decode(outputs[0], skip_special_tokens=True)
+        outputs = self.model.generate(inputs, **self._get_generate_kwargs())
+        answer = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
         return answer
+
+    def get_answers(self, queries: List[str], contexts: List[str]) -> List[str]:
+        """Answer several questions with a single (padded) batch."""
+        prompts = [self._get_prompt(query=q, context=c) for q, c in zip(queries, contexts)]
+        inputs = self._encode(prompts)
+
+        outputs = self.model.generate(**inputs, **self._get_generate_kwargs(batch_size=len(prompts)))
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def stream_answer(self, query: str, context: str) -> Iterator[str]:
+        """Generate the answer in a background thread and yield the decoded text as tokens are produced."""
+        prompt = self._get_prompt(query=query, context=context)
+        inputs = self._encode(prompt)['input_ids']
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancelled = threading.Event()
+        stopping_criteria = StoppingCriteriaList([StopOnEvent(event=cancelled)])
+        errors = []
+
+        def _generate():
+            try:
+                self.model.generate(inputs, streamer=streamer, stopping_criteria=stopping_criteria,
+                                    **self._get_generate_kwargs())
+            except Exception as exc:
+                errors.append(exc)
+                streamer.end()
+
+        thread = threading.Thread(target=_generate, name='ayd-generate', daemon=True)
+        thread.start()
+        try:
+            yield from streamer
+        finally:
+            cancelled.set()
+            thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+import torch
+
+
+_Key = Tuple[str, str]
+
+
+def get_rss_bytes() -> int | None:
+    """Resident memory of the current process (linux only)."""
+    try:
+        with open('/proc/self/statm') as sfile:
+            return int(sfile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def get_nbytes(model: Any) -> int | None:
+    """Bytes of the weights and buffers of a torch model (tied or shared tensors are counted once)."""
+    if not isinstance(model, torch.nn.Module):
+        return None
+    nbytes = {}
+    for value in model.state_dict().values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if torch.is_tensor(tensor):
+                nbytes[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sum(nbytes.values())
+
+
+@dataclass
+class _Entry:
+    lock: threading.Lock
+    model: Any = None
+    loaded: bool = False
+    seconds: float | None = None
+    nbytes: int | None = None
+    rss_bytes: int | None = None
+
+
+class ModelRegistry:
+    """Process-wide registry of models and tokenizers, each loaded once on first request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[_Key, _Entry] = {}
+
+    def __contains__(self, key: _Key) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.loaded
+
+    def get(self, name: str, role: str, loader: Callable[[], Any]) -> Any:
+        """Return the model of `name` in `role`, loaded by `loader` if it is requested for the first time."""
+        key = (name, role)
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry(lock=threading.Lock()))
+        if entry.loaded:
+            return entry.model
+
+        with entry.lock:
+            if not entry.loaded:
+                logging.info(f'load {role} {name}')
+                rss_start, start = get_rss_bytes(), time.perf_counter()
+                entry.model = loader()
+                entry.seconds = time.perf_counter() - start
+                entry.nbytes = get_nbytes(entry.model)
+                if rss_start is not None and (rss_end := get_rss_bytes()) is not None:
+                    entry.rss_bytes = rss_end - rss_start
+                entry.loaded = True
+                logging.info(f'loaded {role} {name} in {entry.seconds:.1f}s ({self._format(entry)})')
+        return entry.model
+
+    @staticmethod
+    def _format(entry: _Entry) -> str:
+        nbytes = f'{entry.nbytes / 1024 ** 2:.0f} MB weights' if entry.nbytes is not None else 'weights unknown'
+        rss = f'{entry.rss_bytes / 1024 ** 2:+.0f} MB rss' if entry.rss_bytes is not None else 'rss unknown'
+        return f'{nbytes}, {rss}'
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Memory per loaded model: bytes of the weights and growth of the resident memory at loading."""
+        with self._lock:
+            entries = [(k, e) for k, e in self._entries.items() if e.loaded]
+        models = [{'name': name, 'role': role, 'load_seconds': e.seconds, 'weights_bytes': e.nbytes,
+                   'rss_bytes': e.rss_bytes} for (name, role), e in entries]
+        return {'models': models, 'rss_bytes': get_rss_bytes()}
+
+
+_REGISTRY = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Return the process-wide model registry."""
+    return _REGISTRY
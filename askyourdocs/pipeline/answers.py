@@ -0,0 +1,284 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from hashlib import sha256
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+import unicodedata
+import uuid
+
+import numpy as np
+
+
+_SUBSCRIBERS: List[Callable[[List[str]], None]] = []
+_SUBSCRIBERS_LOCK = threading.Lock()
+
+
+def subscribe(callback: Callable[[List[str]], None]):
+    """Register a callback which is called with the ids of documents that were ingested or removed."""
+    with _SUBSCRIBERS_LOCK:
+        _SUBSCRIBERS.append(callback)
+
+
+class _DelayedNotifications:
+    """Notifies the subscribers once more when the changes of documents became visible."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: Dict[str, float] = {}
+        self._thread: threading.Thread | None = None
+
+    def add(self, doc_ids: List[str], delay: float):
+        deadline = time.monotonic() + delay
+        with self._cond:
+            for doc_id in doc_ids:
+                self._pending[doc_id] = deadline
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ayd-notify', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [doc_id for doc_id, deadline in self._pending.items() if deadline <= now]
+                if not due:
+                    self._cond.wait(timeout=min(self._pending.values()) - now)
+                    continue
+                for doc_id in due:
+                    del self._pending[doc_id]
+            notify_documents_changed(doc_ids=due)
+
+
+_DELAYED = _DelayedNotifications()
+
+
+class CorpusVersion:
+    """Last change of the documents in a file, such that answer caches of other processes see it as well."""
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> 'CorpusVersion':
+        return cls(path=Path(settings['paths']['cache']) / settings['query']['answer_cache']['version_filename'])
+
+    def _read(self) -> dict | None:
+        try:
+            return json.loads(self._path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def bump(self, delay: float | None = None):
+        """Record a change of the documents, which becomes visible after `delay` seconds."""
+        visible = time.time() + (delay or 0.0)
+        if (state := self._read()) is not None:
+            # A pending change of another process stays pending
+            visible = max(visible, state['visible'])
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_name(f'{self._path.name}.{uuid.uuid4().hex}.tmp')
+        tmp_path.write_text(json.dumps({'token': uuid.uuid4().hex, 'visible': visible}))
+        os.replace(tmp_path, self._path)
+
+    def get(self) -> Tuple[str, bool] | None:
+        """Token of the last change and whether it is visible already, `None` if the documents never changed."""
+        if (state := self._read()) is None:
+            return None
+        return state['token'], state['visible'] <= time.time()
+
+
+def notify_documents_changed(doc_ids: Iterable[str], delay: float | None = None,
+                             corpus_version: CorpusVersion | None = None):
+    """Notify all subscribers (e.g. answer caches) that the given documents were ingested or removed."""
+    doc_ids = list(doc_ids)
+    if corpus_version is not None:
+        corpus_version.bump(delay=delay)
+    with _SUBSCRIBERS_LOCK:
+        subscribers = list(_SUBSCRIBERS)
+    for callback in subscribers:
+        callback(doc_ids)
+    if delay is not None and doc_ids:
+        _DELAYED.add(doc_ids=doc_ids, delay=delay)
+
+
+def get_context_fingerprint(context: str) -> str:
+    return sha256(context.encode()).hexdigest()
+
+
+@dataclass
+class AnswerCacheEntry:
+    question: str
+    vector: np.ndarray
+    fingerprint: str
+    doc_ids: Set[str]
+    result: dict
+    version: int
+    created: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class AnswerCacheStats:
+    exact: int = 0
+    similar: int = 0
+    revalidated: int = 0
+    misses: int = 0
+    expired: int = 0
+    invalidated: int = 0
+    evicted: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.exact + self.similar + self.revalidated
+
+    @property
+    def hit_rate(self) -> float:
+        nrequests = self.hits + self.misses
+        return self.hits / nrequests if nrequests else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'exact': self.exact,
+            'similar': self.similar,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'expired': self.expired,
+            'invalidated': self.invalidated,
+            'evicted': self.evicted,
+        }
+
+
+class AnswerCache:
+    """In-memory cache of answers for repeated and near-duplicate questions, revalidated after document changes."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, similarity_threshold: float = 0.97,
+                 corpus_version: CorpusVersion | None = None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[str, AnswerCacheEntry] = OrderedDict()
+        self._matrix: np.ndarray | None = None
+        self._matrix_keys: List[str] = []
+        self._version = 0
+        self._corpus_version = corpus_version
+        self._corpus_state = corpus_version.get() if corpus_version is not None else None
+        self._lock = threading.Lock()
+        self.stats = AnswerCacheStats()
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> 'AnswerCache | None':
+        cache_settings = settings['query']['answer_cache']
+        if not cache_settings['enabled']:
+            return None
+        return cls(max_entries=cache_settings['max_entries'], ttl=cache_settings['ttl'],
+                   similarity_threshold=cache_settings['similarity_threshold'],
+                   corpus_version=CorpusVersion.from_settings(settings=settings))
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        question = unicodedata.normalize('NFKC', question).casefold()
+        question = re.sub(r'\s+', ' ', question).strip()
+        return question.rstrip('?!. ')
+
+    def _drop(self, key: str):
+        del self._entries[key]
+        self._matrix = None
+
+    def _find_similar(self, vector: np.ndarray, fingerprint: str) -> str | None:
+        """Most similar entry above the similarity threshold with the given context fingerprint."""
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[k].vector for k in self._matrix_keys])
+        similarities = self._matrix @ vector
+        for i in np.argsort(-similarities):
+            if similarities[i] < self._similarity_threshold:
+                break
+            if self._entries[key := self._matrix_keys[i]].fingerprint == fingerprint:
+                return key
+        return None
+
+    def _sync_corpus_version(self):
+        """Documents changed by another process (e.g. the cli): entries of earlier versions have to be revalidated."""
+        if self._corpus_version is None:
+            return
+        if (state := self._corpus_version.get()) != self._corpus_state:
+            self._corpus_state = state
+            self._version += 1
+
+    def get(self, question: str, vector: np.ndarray | None = None, fingerprint: str | None = None) -> dict | None:
+        """Return the cached result of the question or of a near-duplicate with the same context `fingerprint`."""
+        key = self.normalize(question)
+        with self._lock:
+            self._sync_corpus_version()
+            kind = 'exact'
+            if key not in self._entries:
+                if vector is None or fingerprint is None:
+                    return None
+                if (key := self._find_similar(vector=vector, fingerprint=fingerprint)) is None:
+                    return None
+                kind = 'similar'
+
+            entry = self._entries[key]
+            if time.monotonic() - entry.created > self._ttl:
+                self._drop(key)
+                self.stats.expired += 1
+                return None
+
+            if entry.version != self._version:
+                if fingerprint is None or fingerprint != entry.fingerprint:
+                    return None
+                entry.version = self._version
+                kind = 'revalidated'
+
+            self._entries.move_to_end(key)
+            setattr(self.stats, kind, getattr(self.stats, kind) + 1)
+            logging.info(f'answer cache hit ({kind}) for "{question}"')
+            return dict(entry.result)
+
+    def put(self, question: str, vector: np.ndarray, fingerprint: str, doc_ids: Iterable[str], result: dict):
+        key = self.normalize(question)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self.stats.misses += 1
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = AnswerCacheEntry(question=key, vector=vector, fingerprint=fingerprint,
+                                                  doc_ids=set(doc_ids), result=dict(result), version=self._version)
+            self._matrix = None
+            while len(self._entries) > self._max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats.evicted += 1
+
+    def invalidate(self, doc_ids: List[str]):
+        """Documents changed: drop the entries referencing them and require the others to be revalidated."""
+        changed = set(doc_ids)
+        with self._lock:
+            self._version += 1
+            stale = [k for k, e in self._entries.items() if e.doc_ids & changed]
+            for key in stale:
+                self._drop(key)
+            self.stats.invalidated += len(stale)
+        logging.debug(f'answer cache version {self._version}: {len(stale)} entries invalidated')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def to_dict(self) -> Dict[str, float | int]:
+        return {'entries': len(self), 'max_entries': self._max_entries, 'version': self._version,
+                **self.stats.to_dict()}
@@ -22,10 +22,24 @@ class PipelineService(Service):
 
                 source = self._environment.source
                 commit = self._environment.commit
-                ingestion_pipeline.apply(source=source, commit=commit)
+                nworkers = None
+                # --nworkers only applies to (and therefore implies) the pipelined ingestion
+                if self._environment.pipelined or self._environment.nworkers is not None:
+                    nworkers = self._environment.nworkers or self._settings['ingestion']['nworkers']
+                if self._environment.sync:
+                    manifest = self._environment.manifest
+                    ingestion_pipeline.sync(source=source, manifest_path=manifest, commit=commit, nworkers=nworkers)
+                else:
+                    ingestion_pipeline.apply(source=source, commit=commit, nworkers=nworkers)
 
             case 'query':
                 logging.info('start query pipeline')
                 query_pipeline = QueryPipeline(environment=self._environment, settings=self._settings)
                 text = self._environment.text
                 query_pipeline.apply(text=text)
+
+            case 'reindex':
+                logging.info('start rebuild of the local vector index')
+                ingestion_pipeline = IngestionPipeline(environment=self._environment, settings=self._settings)
+                nvectors = ingestion_pipeline.rebuild_vector_index()
+                logging.info(f'local vector index holds {nvectors} vectors')
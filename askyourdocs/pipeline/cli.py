@@ -4,10 +4,24 @@ from askyourdocs.storage.cli import strg_url_parser, strge_solr_parser, strge_sc
 from askyourdocs.modelling.cli import mdl_txt_parser
 
 
+def ppln_ingest_parser():
+    parser = argparse.ArgumentParser(add_help=False)
+
+    group = parser.add_argument_group('Ingestion options')
+    group.add_argument('--pipelined', dest='pipelined', action='store_true',
+                       help='Run extraction, chunking, embedding, and indexing as overlapping stages')
+    group.add_argument('--nworkers', '-n', dest='nworkers', type=int, help='Number of extraction/indexing workers (implies --pipelined)')
+    group.add_argument('--sync', dest='sync', action='store_true',
+                       help='Incremental sync: skip unchanged files, re-ingest changed files, and purge deleted files')
+    group.add_argument('--manifest', dest='manifest', help='Path of the sync manifest (default: within the cache folder)')
+    return parser
+
+
 def add_parser(parser: argparse.ArgumentParser):
 
     ppln_subprs = parser.add_subparsers(help="Pipeline services", dest="pipeline", required=True)
 
-    ppln_subprs.add_parser('ingest', help='Ingest documents', parents=[strg_url_parser(), strge_solr_parser(), strge_scrp_parser()])
+    ppln_subprs.add_parser('ingest', help='Ingest documents', parents=[strg_url_parser(), strge_solr_parser(), strge_scrp_parser(), ppln_ingest_parser()])
     ppln_subprs.add_parser('query', help='Query documents', parents=[strg_url_parser(), mdl_txt_parser()])
+    ppln_subprs.add_parser('reindex', help='Load the vecs collection into the local vector index', parents=[strg_url_parser()])
 
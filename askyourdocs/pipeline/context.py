@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+import logging
+from typing import Dict, List, Tuple
+
+from askyourdocs import Passage, TextDocument, TextEntity
+from askyourdocs.modelling.chunking import TokenCounter
+from askyourdocs.storage.client import SolrClient
+
+
+_Key = Tuple[str, int]
+
+
+def join_texts(texts: List[str], overlaps: List[int], consecutive: List[bool], sep: str = ' ') -> str:
+    """Concatenate texts, where the leading `overlap` characters of texts consecutive to their predecessor are skipped."""
+    return sep.join(t[o:] if c else t for t, o, c in zip(texts, overlaps, consecutive))
+
+
+@dataclass
+class ContextEntity:
+    """A text entity considered for the context, with its token count and overlap with its predecessor."""
+
+    text: str
+    ntokens: int | None = None
+    overlap: int = 0
+
+
+class ContextBuilder:
+    """Assembles the context of an answer from the text entities around the kNN hits within a token budget."""
+
+    _fields = 'doc_id,index,text,ntokens,overlap'
+
+    def __init__(self, solr_client: SolrClient, collection: str, token_counter: TokenCounter, ntok_context: int,
+                 nte_max: int = 100, sep: str = ' '):
+        self._solr_client = solr_client
+        self._collection = collection
+        self._token_counter = token_counter
+        self._ntok_context = ntok_context
+        self._nte_max = nte_max
+        self._sep = sep
+
+    def _get_windows(self, hits: List[dict]) -> Dict[str, List[Tuple[int, int]]]:
+        """Return the (merged) index ranges of the neighbour windows per document."""
+        ranges: Dict[str, List[Tuple[int, int]]] = {}
+        for hit in hits:
+            start = max(0, hit['index'] - self._nte_max // 2)
+            ranges.setdefault(hit['doc_id'], []).append((start, start + self._nte_max - 1))
+
+        windows = {}
+        for doc_id, doc_ranges in ranges.items():
+            doc_ranges.sort()
+            merged = [doc_ranges[0]]
+            for start, end in doc_ranges[1:]:
+                if start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            windows[doc_id] = merged
+        return windows
+
+    def _get_entities(self, hits: List[dict]) -> Dict[_Key, ContextEntity]:
+        """Fetch the neighbour windows of all hits with one request."""
+        windows = self._get_windows(hits=hits)
+        clauses = [f'(doc_id:{doc_id} AND index:[{start} TO {end}])'
+                   for doc_id, doc_ranges in windows.items() for start, end in doc_ranges]
+        nrows = sum(end - start + 1 for doc_ranges in windows.values() for start, end in doc_ranges)
+        params = {'fl': self._fields, 'rows': nrows}
+        response = self._solr_client.search(query=' OR '.join(clauses), collection=self._collection, params=params)
+
+        entities = {(d['doc_id'], d['index']): ContextEntity(text=d['text'], ntokens=d.get('ntokens'),
+                                                             overlap=d.get('overlap') or 0)
+                    for d in response['docs']}
+
+        uncounted = [e for e in entities.values() if e.ntokens is None]
+        if uncounted:
+            logging.info(f'count tokens of {len(uncounted)} text entities stored without token count')
+            for entity, ntokens in zip(uncounted, self._token_counter([e.text for e in uncounted])):
+                entity.ntokens = ntokens
+        return entities
+
+    def _select(self, hits: List[dict], entities: Dict[_Key, ContextEntity]) -> Tuple[List[_Key], int]:
+        """Select the hits in rank order, then grow the context around them while it fits into the budget."""
+        selected, ntokens = set(), 0
+        hit_keys = [k for k in dict.fromkeys((h['doc_id'], h['index']) for h in hits) if k in entities]
+        for key in hit_keys:
+            if ntokens + entities[key].ntokens <= self._ntok_context:
+                selected.add(key)
+                ntokens += entities[key].ntokens
+
+        # Frontiers of the selected hits (in rank order), a direction ends at the first neighbour that does not fit
+        fronts = [(doc_id, index, step) for doc_id, index in hit_keys if (doc_id, index) in selected for step in (-1, 1)]
+        while fronts:
+            grown = []
+            for doc_id, index, step in fronts:
+                key = (doc_id, index + step)
+                if key not in entities:
+                    continue
+                if key not in selected:
+                    if ntokens + entities[key].ntokens > self._ntok_context:
+                        continue
+                    selected.add(key)
+                    ntokens += entities[key].ntokens
+                grown.append((doc_id, index + step, step))
+            fronts = grown
+        return sorted(selected), ntokens
+
+    def _join(self, keys: List[_Key], entities: Dict[_Key, ContextEntity]) -> str:
+        """Concatenate the texts in document order, without repeating the overlap of consecutive text entities."""
+        consecutive = [i > 0 and keys[i - 1] == (k[0], k[1] - 1) for i, k in enumerate(keys)]
+        return join_texts(texts=[entities[k].text for k in keys], overlaps=[entities[k].overlap for k in keys],
+                          consecutive=consecutive, sep=self._sep)
+
+    def apply(self, hits: List[dict]) -> str:
+        if not hits:
+            return ''
+        entities = self._get_entities(hits=hits)
+        keys, ntokens = self._select(hits=hits, entities=entities)
+        logging.info(f'context of {len(keys)} text entities with {ntokens} tokens (budget {self._ntok_context}) '
+                     f'from {len(entities)} candidates')
+        return self._join(keys=keys, entities=entities)
+
+
+class PassageBuilder:
+    """Groups the text entities of a document into passages of at most `ntok_max` tokens."""
+
+    def __init__(self, token_counter: TokenCounter, ntok_max: int, sep: str = ' '):
+        self._token_counter = token_counter
+        self._ntok_max = ntok_max
+        self._sep = sep
+
+    def _group(self, text_entities: List[TextEntity]) -> List[List[TextEntity]]:
+        groups, ntokens = [], 0
+        for te in text_entities:
+            if groups and ntokens + (te.ntokens or 0) <= self._ntok_max:
+                groups[-1].append(te)
+                ntokens += te.ntokens or 0
+            else:
+                groups.append([te])
+                ntokens = te.ntokens or 0
+        return groups
+
+    def apply(self, document: TextDocument, text_entities: List[TextEntity]) -> List[Passage]:
+        groups = self._group(text_entities=sorted(text_entities, key=lambda te: te.index))
+        texts = [join_texts(texts=[te.text for te in g], overlaps=[te.overlap or 0 for te in g],
+                            consecutive=[i > 0 for i in range(len(g))], sep=self._sep)
+                 for g in groups]
+        ntokens = self._token_counter(texts)
+
+        passages = []
+        for i, (group, text, n) in enumerate(zip(groups, texts, ntokens)):
+            passage = Passage(id=f'{document.id}{i}', text=text, doc_id=document.id, name=document.name, index=i,
+                              start=group[0].index, end=group[-1].index, ntokens=n)
+            for te in group:
+                te.passage_id = passage.id
+            passages.append(passage)
+        return passages
@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Callable, Iterator
+
+
+_END = object()
+
+
+class QueryQueueFull(Exception):
+    """Raised if the maximal number of pending queries is reached."""
+
+
+def get_torch_threads(nworkers: int, torch_threads: int | None = None, batching: bool = False,
+                      streaming: bool = True) -> int:
+    """Number of torch intra-op threads (process-wide), such that concurrent queries do not oversubscribe the cpus."""
+    if torch_threads is not None:
+        return torch_threads
+    # Streamed answers bypass the generation batcher, every worker may then generate on its own
+    if batching and not streaming:
+        return os.cpu_count() or 1
+    return max(1, (os.cpu_count() or 1) // nworkers)
+
+
+class QueryExecutor:
+    """Runs blocking query pipeline calls in a bounded pool of worker threads."""
+
+    def __init__(self, nworkers: int = 2, max_pending: int = 8):
+        self._nworkers = nworkers
+        self._max_pending = max(max_pending, nworkers)
+        self._executor = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='ayd-query')
+        self._slots = threading.BoundedSemaphore(self._max_pending)
+        self._lock = threading.Lock()
+        self._npending = 0
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> 'QueryExecutor':
+        executor = settings['query']['executor']
+        return cls(nworkers=executor['nworkers'], max_pending=executor['max_pending'])
+
+    def __repr__(self):
+        return f'{type(self).__name__}(nworkers={self._nworkers}, max_pending={self._max_pending})'
+
+    @property
+    def npending(self) -> int:
+        return self._npending
+
+    def _release(self, _: Future | None = None):
+        with self._lock:
+            self._npending -= 1
+        self._slots.release()
+
+    def _submit(self, func: Callable[..., Any], *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise QueryQueueFull(f'{self._max_pending} queries are already pending')
+        with self._lock:
+            self._npending += 1
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `func` in a worker and return its result."""
+        return await asyncio.wrap_future(self._submit(func, *args, **kwargs))
+
+    async def iterate(self, func: Callable[..., Iterator], *args, **kwargs) -> AsyncIterator:
+        """Consume the iterator returned by `func` in a worker and yield its items on the event loop."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def _produce():
+            if stopped.is_set():
+                return
+            iterator = func(*args, **kwargs)
+            try:
+                for item in iterator:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as exc:
+                loop.call_soon_threadsafe(queue.put_nowait, (_END, exc))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (_END, None))
+            finally:
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+
+        self._submit(_produce)
+        try:
+            while True:
+                item, exc = await queue.get()
+                if exc is not None:
+                    raise exc
+                if item is _END:
+                    return
+                yield item
+        finally:
+            stopped.set()
+
+    def to_dict(self) -> dict:
+        return {'nworkers': self._nworkers, 'max_pending': self._max_pending, 'npending': self.npending}
+
+    def shutdown(self, wait: bool = True):
+        logging.info(f'shut down {self}')
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+from typing import Dict, List
+import uuid
+
+from askyourdocs.pipeline.pipeline import IngestionPipeline
+
+
+class JobQueueFull(Exception):
+    """Raised if the maximal number of pending ingestion jobs is reached."""
+
+
+@dataclass
+class IngestionJob:
+    """State, per-stage progress, and timings of a background ingestion of a single file."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id: str
+    filename: str
+    doc_id: str
+    status: str = QUEUED
+    stage: str | None = None
+    info: Dict[str, int] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    _stage_start: float | None = field(default=None, repr=False)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    def _close_stage(self):
+        if self.stage is not None and self._stage_start is not None:
+            self.timings[self.stage] = time.perf_counter() - self._stage_start
+
+    def enter_stage(self, stage: str, **info):
+        self._close_stage()
+        self.stage = stage
+        self.info.update(info)
+        self._stage_start = time.perf_counter()
+
+    def start(self):
+        self.status = self.RUNNING
+        self.started = time.time()
+
+    def finish(self, error: str | None = None):
+        self._close_stage()
+        self.stage = None
+        self.status = self.FAILED if error else self.DONE
+        self.error = error
+        self.finished = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'doc_id': self.doc_id,
+            'status': self.status,
+            'stage': self.stage,
+            'info': dict(self.info),
+            'timings': dict(self.timings),
+            'queued_seconds': (self.started or time.time()) - self.created,
+            'total_seconds': (self.finished or time.time()) - self.started if self.started else None,
+            'error': self.error,
+        }
+
+
+class IngestionJobManager:
+    """Runs ingestions in a bounded pool of background threads."""
+
+    def __init__(self, pipeline: IngestionPipeline, nworkers: int = 1, max_pending: int = 16, max_history: int = 1000):
+        self._pipeline = pipeline
+        self._max_pending = max_pending
+        self._max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='ingestion-job')
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, IngestionJob] = {}
+
+    @classmethod
+    def from_settings(cls, pipeline: IngestionPipeline, settings: dict) -> 'IngestionJobManager':
+        jobs = settings['ingestion']['jobs']
+        return cls(pipeline=pipeline, nworkers=jobs['nworkers'], max_pending=jobs['max_pending'],
+                   max_history=jobs['max_history'])
+
+    @property
+    def npending(self) -> int:
+        return sum(1 for j in self._jobs.values() if not j.is_finished)
+
+    @property
+    def is_full(self) -> bool:
+        return self.npending >= self._max_pending
+
+    def _forget_finished(self):
+        finished = [j for j in self._jobs.values() if j.is_finished]
+        for job in sorted(finished, key=lambda j: j.finished)[:max(len(finished) - self._max_history, 0)]:
+            del self._jobs[job.id]
+
+    def submit(self, filename: str, commit: bool = False, content_hash: str | None = None) -> IngestionJob:
+        with self._lock:
+            if self.is_full:
+                raise JobQueueFull(f'{self._max_pending} ingestion jobs are already pending')
+            job = IngestionJob(id=uuid.uuid4().hex, filename=filename, doc_id=self._pipeline.get_document_id(filename))
+            self._jobs[job.id] = job
+            self._forget_finished()
+
+        logging.info(f'queued ingestion job {job.id} for "{filename}"')
+        self._executor.submit(self._run, job=job, commit=commit, content_hash=content_hash)
+        return job
+
+    def _run(self, job: IngestionJob, commit: bool, content_hash: str | None = None):
+        job.start()
+        try:
+            self._pipeline.apply(source=job.filename, commit=commit, on_stage=job.enter_stage,
+                                 content_hash=content_hash)
+        except Exception as exc:
+            logging.exception(f'ingestion job {job.id} for "{job.filename}" failed')
+            job.finish(error=repr(exc))
+        else:
+            job.finish()
+            logging.info(f'ingestion job {job.id} done with stage timings {job.timings}')
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        return self._jobs.get(job_id)
+
+    def get_pending(self, filename: str) -> IngestionJob | None:
+        """Return the queued or running job of a given file, if any."""
+        with self._lock:
+            return next((j for j in self._jobs.values() if j.filename == filename and not j.is_finished), None)
+
+    def list(self) -> List[IngestionJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created)
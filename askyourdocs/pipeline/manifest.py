@@ -0,0 +1,96 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterator, List
+
+
+@dataclass
+class ManifestEntry:
+    """Ingestion record of a single file."""
+
+    filename: str
+    content_hash: str
+    size: int
+    mtime: float
+    doc_id: str | None = None
+    status: str = 'pending'
+
+    def is_unchanged(self, size: int, mtime: float) -> bool:
+        """Cheap check (without hashing) if a successfully ingested file is still the same."""
+        return self.status == 'done' and self.size == size and self.mtime == mtime
+
+
+class Manifest:
+    """Persisted record of the files of an ingestion source with their content hashes and status."""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, ManifestEntry] = {}
+        self._batched = False
+        self._dirty = False
+        if self._path.is_file():
+            with open(self._path, 'r', encoding='utf-8') as mfile:
+                self._entries = {e['filename']: ManifestEntry(**e) for e in json.load(mfile)['entries']}
+            logging.info(f'loaded manifest "{self._path}" with {len(self._entries)} entries')
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def filenames(self) -> List[str]:
+        return list(self._entries.keys())
+
+    def get(self, filename: str) -> ManifestEntry | None:
+        return self._entries.get(filename)
+
+    @contextmanager
+    def batch(self) -> Iterator['Manifest']:
+        """Defer writing the manifest to a single save at the end of the block (e.g. for planning a sync)."""
+        with self._lock:
+            self._batched = True
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batched = False
+                if self._dirty:
+                    self._save()
+
+    def set(self, entry: ManifestEntry):
+        with self._lock:
+            self._entries[entry.filename] = entry
+            self._save()
+
+    def set_status(self, filename: str, status: str, doc_id: str | None = None):
+        with self._lock:
+            entry = self._entries[filename]
+            entry.status = status
+            if doc_id is not None:
+                entry.doc_id = doc_id
+            self._save()
+
+    def remove(self, filename: str):
+        with self._lock:
+            self._entries.pop(filename, None)
+            self._save()
+
+    def _save(self):
+        """Write the manifest atomically, such that a crash never leaves a corrupt file behind."""
+        if self._batched:
+            self._dirty = True
+            return
+        self._dirty = False
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_suffix(self._path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as mfile:
+            json.dump({'entries': [asdict(e) for e in self._entries.values()]}, mfile)
+        os.replace(tmp_path, self._path)
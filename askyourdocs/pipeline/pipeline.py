@@ -1,16 +1,30 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
 import logging
 from pathlib import Path
-from typing import Any, List
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
 import numpy as np
-import pandas as pd
-from transformers import AutoTokenizer
 
-from askyourdocs import Environment, TextDocument, TextEntity, EmbeddingEntity, FeedbackDocument
+from askyourdocs import Environment, TextDocument, TextEntity, EmbeddingEntity, FeedbackDocument, Passage
+from askyourdocs import utils as utl
 from askyourdocs.storage.scraping import TikaExtractor
 from askyourdocs.storage.client import SolrClient
-from askyourdocs.modelling.llm import TextEmbedder, TextTokenizer, Summarizer
+from askyourdocs.storage.indexing import BulkIndexer, BulkIndexingError
+from askyourdocs.storage.vectors import get_vector_index
+from askyourdocs.modelling.batching import EmbeddingBatcher, EmbeddingBatchError, GenerationBatcher
+from askyourdocs.modelling.cache import get_embedding_cache
+from askyourdocs.modelling.chunking import get_chunker
+from askyourdocs.modelling.llm import TextEmbedder, TextTokenCounter, Summarizer
+from askyourdocs.pipeline.answers import (AnswerCache, CorpusVersion, get_context_fingerprint, notify_documents_changed,
+                                         subscribe)
+from askyourdocs.pipeline.context import ContextBuilder, PassageBuilder
+from askyourdocs.pipeline.manifest import Manifest, ManifestEntry
+from askyourdocs.pipeline.retrieval import reciprocal_rank_fusion
+from askyourdocs.pipeline.staging import LatencyStats, Stage, StagedExecutor, StageTimings
 
 
 class Pipeline(ABC):
@@ -24,6 +38,37 @@ class Pipeline(ABC):
         pass
 
 
+@dataclass
+class IngestionItem:
+    """A single file on its way through the stages of the ingestion pipeline."""
+
+    filename: str
+    content_hash: str | None = None
+    document: TextDocument | None = None
+    text_entities: List[TextEntity] = field(default_factory=list)
+    passages: List[Passage] = field(default_factory=list)
+    embedding_entities: List[EmbeddingEntity] = field(default_factory=list)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(filename={self.filename!r})'
+
+
+@dataclass
+class QueryItem:
+    """A question on its way through the stages of the query pipeline (`result` is set by a hit of the answer cache)."""
+
+    text: str
+    vector: np.ndarray | None = None
+    context: str = ''
+    fingerprint: str | None = None
+    text_entities: List[dict] = field(default_factory=list)
+    doc_id_to_name: Dict[str, str] = field(default_factory=dict)
+    result: dict | None = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(text={self.text!r})'
+
+
 class IngestionPipeline(Pipeline):
 
     def __init__(self, environment: Environment, settings: dict):
@@ -31,22 +76,51 @@ class IngestionPipeline(Pipeline):
 
         # Solr database interaction client
         self._solr_client = SolrClient(environment=environment, settings=settings)
+        self._bulk_indexer = BulkIndexer.from_settings(solr_client=self._solr_client, settings=settings)
+        self._corpus_version = CorpusVersion.from_settings(settings=settings)
 
         # Document text extraction service
         self._tika_extractor = TikaExtractor(environment=environment, settings=settings)
 
-        # Text tokenizer service
-        package = settings['modelling']['tokenizer_package']
-        self._text_tokenizer = TextTokenizer(package=package)
+        # Text chunking service
+        model_name = settings['modelling']['model_name']
+        token_counter = TextTokenCounter(model_name=model_name)
+        self._text_chunker = get_chunker(settings=settings, token_counter=token_counter)
+
+        # Passages (context blocks) of neighbouring text entities
+        self._passage_builder = None
+        if (passages := settings['modelling']['passages'])['enabled']:
+            self._passage_builder = PassageBuilder(token_counter=token_counter, ntok_max=passages['ntok_max'])
 
         # Text embedding service
-        model_name = settings['modelling']['model_name']
         cache_folder = settings['paths']['models']
-        self._text_embedder = TextEmbedder(model_name=model_name, cache_folder=cache_folder)
+        embedding_cache = get_embedding_cache(settings=settings)
+        backend = settings['modelling']['inference']['embedder']
+        self._text_embedder = TextEmbedder(model_name=model_name, cache_folder=cache_folder, cache=embedding_cache,
+                                           backend=backend)
+
+        # In-process vector index (if it is the retrieval backend), kept in sync with the vecs collection
+        self._vector_index = get_vector_index(settings=settings)
+
+        # Removal of outdated documents (incremental sync)
+        self._removal_pipeline = RemovalPipeline(environment=environment, settings=settings)
+
+    @staticmethod
+    def get_document_id(filename: str) -> str:
+        """Return the id under which the document of a given file is stored (see `TikaExtractor`)."""
+        return TextDocument(id=str(Path(filename)), name='', source='', text=None).id
 
-    def _get_document_from_file(self, filename: str) -> TextDocument:
+    def get_document_id_by_hash(self, content_hash: str) -> str | None:
+        """Return the id of an already ingested document with the same content (if any)."""
+        collection = self._settings['solr']['collections']['map']['docs']
+        response = self._solr_client.search(query=f'content_hash:{content_hash}', collection=collection,
+                                            params={'fl': 'id', 'rows': 1})
+        docs = response['docs']
+        return docs[0]['id'] if docs else None
+
+    def _get_document_from_file(self, filename: str, content_hash: str | None = None) -> TextDocument:
         """Extract the text from a given file."""
-        document = self._tika_extractor.apply(filename=filename)
+        document = self._tika_extractor.apply(filename=filename, content_hash=content_hash)
         return document
 
     def _get_text_entities_from_document(self, document: TextDocument) -> List[TextEntity]:
@@ -55,9 +129,16 @@ class IngestionPipeline(Pipeline):
         if text is None:
             logging.error("OCR not yet implemented, empty PDF...")
             text = ""
-        text_entities = self._text_tokenizer.get_text_entities(text=text)
-        return [TextEntity(id=f'{document.id}{i}{te}', text=te, doc_id=document.id, index=i)
-                for i, te in enumerate(text_entities)]
+        chunks = self._text_chunker.apply(text=text)
+        return [TextEntity(id=f'{document.id}{i}{c.text}', text=c.text, doc_id=document.id, index=i, overlap=c.overlap,
+                           ntokens=c.ntokens)
+                for i, c in enumerate(chunks)]
+
+    def _get_passages_from_text_entities(self, document: TextDocument, text_entities: List[TextEntity]) -> List[Passage]:
+        """Group the text entities into passages (and assign their `passage_id`) if passages are enabled."""
+        if self._passage_builder is None:
+            return []
+        return self._passage_builder.apply(document=document, text_entities=text_entities)
 
     def _get_embedding_entities_from_text_entities(self,
                                                    text_entities: List[TextEntity],
@@ -68,33 +149,156 @@ class IngestionPipeline(Pipeline):
         vectors = self._text_embedder.apply(texts=texts,
                                             show_progress_bar=show_progress_bar,
                                             normalize_embeddings=normalize_embeddings)
-        embedding_entities = [EmbeddingEntity(id=te.text, vector=v, doc_id=te.doc_id, txt_ent_id=te.id)
-                              for te, v in zip(text_entities, vectors)]
-        return embedding_entities
+        return self._create_embedding_entities(text_entities=text_entities, vectors=vectors)
+
+    @staticmethod
+    def _create_embedding_entities(text_entities: List[TextEntity], vectors: np.ndarray) -> List[EmbeddingEntity]:
+        return [EmbeddingEntity(id=te.text, vector=v, doc_id=te.doc_id, txt_ent_id=te.id, passage_id=te.passage_id,
+                                index=te.index)
+                for te, v in zip(text_entities, vectors)]
+
+    def _store_document(self, document: TextDocument, text_entities: List[TextEntity],
+                        embedding_entities: List[EmbeddingEntity], passages: List[Passage]) -> str:
+        """Store the document with its passages, text entities, and embeddings to solr (see `flush`)."""
+        collection = self._settings['solr']['collections']['map']['passages']
+        report = self._bulk_indexer.apply(documents=passages, collection=collection)
+        if not report.ok:
+            raise BulkIndexingError(report=report)
+        collection = self._settings['solr']['collections']['map']['texts']
+        report = self._bulk_indexer.apply(documents=text_entities, collection=collection)
+        if not report.ok:
+            raise BulkIndexingError(report=report)
+        collection = self._settings['solr']['collections']['map']['vecs']
+        report = self._bulk_indexer.apply(documents=embedding_entities, collection=collection)
+        if not report.ok:
+            raise BulkIndexingError(report=report)
+        if self._vector_index is not None:
+            self._vector_index.add(entities=embedding_entities)
+        collection = self._settings['solr']['collections']['map']['docs']
+        doc_id = self._solr_client.add_document(document=document, collection=collection)
+        # Once more when the document is searchable, answers cached before are stale (or a flush commits earlier)
+        notify_documents_changed(doc_ids=[doc_id], delay=self._solr_client.visibility_delay,
+                                 corpus_version=self._corpus_version)
+        return doc_id
+
+    def flush(self):
+        """Make all ingested (and removed) documents visible at once."""
+        collections = self._settings['solr']['collections']['map']
+        self._solr_client.flush(collections=[collections['passages'], collections['texts'], collections['vecs'],
+                                             collections['docs']])
+        # Answers cached before the changes became visible have to be revalidated
+        notify_documents_changed(doc_ids=[], corpus_version=self._corpus_version)
+
+    def _add_document(self, filename: str, on_stage: Callable[..., None] | None = None,
+                      content_hash: str | None = None):
+        """Ingest a single file, where `on_stage(stage, **info)` is called at the beginning of every stage."""
+        on_stage = on_stage or (lambda stage, **info: None)
 
-    def _add_document(self, filename: str, commit: bool = False):
         logging.info(f'extract text from file "{filename}"')
-        document = self._get_document_from_file(filename=filename)
+        on_stage('extraction')
+        document = self._get_document_from_file(filename=filename, content_hash=content_hash)
 
         logging.info('split text into overlapping text entities')
+        on_stage('chunking', nchars=len(document.text or ''))
         text_entities = self._get_text_entities_from_document(document=document)
+        passages = self._get_passages_from_text_entities(document=document, text_entities=text_entities)
 
         logging.info(f'generate text embeddings for {len(text_entities)} text entities')
+        on_stage('embedding', ntext_entities=len(text_entities))
         embedding_entities = self._get_embedding_entities_from_text_entities(text_entities=text_entities, show_progress_bar=True)
 
         logging.info(f'store document, texts, and embeddings to solr')
-        collection = self._settings['solr']['collections']['map']['docs']
-        doc_id = self._solr_client.add_document(document=document, collection=collection, commit=commit)
-        collection = self._settings['solr']['collections']['map']['texts']
-        self._solr_client.add_documents(documents=text_entities, collection=collection, commit=commit)
-        collection = self._settings['solr']['collections']['map']['vecs']
-        self._solr_client.add_documents(documents=embedding_entities, collection=collection, commit=commit)
+        on_stage('indexing')
+        doc_id = self._store_document(document=document, text_entities=text_entities,
+                                      embedding_entities=embedding_entities, passages=passages)
 
         logging.info("from pipeline")
         logging.info(doc_id)
         return doc_id
 
-    def apply(self, source: str, commit: bool = False):
+    def _save_vector_index(self):
+        if self._vector_index is not None:
+            self._vector_index.save()
+
+    def _log_cache_stats(self):
+        if (cache := self._text_embedder.cache) is not None:
+            logging.info(f'embedding cache: {cache.stats()}')
+
+    def _extraction_stage(self, item: IngestionItem) -> IngestionItem:
+        item.document = self._get_document_from_file(filename=item.filename, content_hash=item.content_hash)
+        return item
+
+    def _chunking_stage(self, item: IngestionItem) -> IngestionItem:
+        item.text_entities = self._get_text_entities_from_document(document=item.document)
+        item.passages = self._get_passages_from_text_entities(document=item.document, text_entities=item.text_entities)
+        return item
+
+    def _add_documents_pipelined(self, files: List[str], nworkers: int,
+                                 content_hashes: Dict[str, str] | None = None,
+                                 on_done: Callable[[str, str], None] | None = None,
+                                 on_failed: Callable[[str], None] | None = None) -> List[str]:
+        """Ingest files with overlapping extraction, chunking, embedding, and indexing stages."""
+        content_hashes = content_hashes or {}
+        batch_size = self._settings['ingestion']['embedding_batch_size']
+        nbatches = self._settings['ingestion']['embedding_nbatches']
+        batcher = EmbeddingBatcher(embedder=self._text_embedder, batch_size=batch_size, nbatches=nbatches)
+
+        def _release(completed: List[Tuple[IngestionItem, np.ndarray]]) -> List[IngestionItem]:
+            for item, vectors in completed:
+                item.embedding_entities = self._create_embedding_entities(text_entities=item.text_entities, vectors=vectors)
+            return [item for item, _ in completed]
+
+        def _fail(exc: EmbeddingBatchError) -> List[IngestionItem]:
+            logging.error(f'embedding failed for {exc.owners}: {exc.__cause__!r}')
+            if on_failed is not None:
+                for item in exc.owners:
+                    on_failed(item.filename)
+            return _release(exc.completed)
+
+        def _embedding_stage(item: IngestionItem) -> List[IngestionItem]:
+            try:
+                return _release(batcher.add(owner=item, texts=[te.text for te in item.text_entities]))
+            except EmbeddingBatchError as exc:
+                return _fail(exc)
+
+        def _embedding_flush() -> List[IngestionItem]:
+            try:
+                return _release(batcher.flush())
+            except EmbeddingBatchError as exc:
+                return _fail(exc)
+
+        def _indexing_stage(item: IngestionItem) -> str:
+            doc_id = self._store_document(document=item.document, text_entities=item.text_entities,
+                                          embedding_entities=item.embedding_entities, passages=item.passages)
+            logging.info(f'ingested "{item.filename}" as {doc_id}')
+            if on_done is not None:
+                on_done(item.filename, doc_id)
+            return doc_id
+
+        def _on_error(stage: str, item: IngestionItem, exc: Exception):
+            if on_failed is not None:
+                on_failed(item.filename)
+
+        stages = [
+            Stage(name='extraction', func=self._extraction_stage, nworkers=nworkers),
+            Stage(name='chunking', func=self._chunking_stage, nworkers=1),
+            Stage(name='embedding', func=_embedding_stage, nworkers=1, flush=_embedding_flush),
+            Stage(name='indexing', func=_indexing_stage, nworkers=nworkers),
+        ]
+        queue_size = self._settings['ingestion']['queue_size']
+        executor = StagedExecutor(stages=stages, queue_size=queue_size)
+
+        logging.info(f'start pipelined ingestion of {len(files)} files with {nworkers} worker(s)')
+        doc_ids = executor.apply(items=(IngestionItem(filename=f, content_hash=content_hashes.get(f)) for f in files),
+                                 on_error=_on_error)
+        for stats in executor.stats:
+            logging.info(str(stats))
+        logging.info(str(batcher.stats))
+        self._log_cache_stats()
+        return doc_ids
+
+    @staticmethod
+    def _get_files(source: str) -> List[str]:
         path = Path(source)
         if path.is_dir():
             files = [str(f) for f in path.iterdir() if f.is_file()]
@@ -104,10 +308,111 @@ class IngestionPipeline(Pipeline):
         else:
             files = []
             logging.error(f'{path} os not a file or a directory')
+        return files
+
+    def rebuild_vector_index(self, only_if_empty: bool = False) -> int:
+        """Load the embeddings of the vecs collection into the local vector index."""
+        if self._vector_index is None:
+            logging.info('the local vector index is not the retrieval backend, nothing to rebuild')
+            return 0
+        if only_if_empty and len(self._vector_index):
+            return len(self._vector_index)
+        collection = self._settings['solr']['collections']['map']['vecs']
+        self._vector_index.rebuild_from_solr(solr_client=self._solr_client, collection=collection)
+        return len(self._vector_index)
+
+    def sync(self, source: str, manifest_path: str | Path | None = None, commit: bool = False,
+             nworkers: int | None = None) -> List[str]:
+        """Incrementally synchronize a source with solr based on a persisted manifest of the ingested files."""
+        if manifest_path is None:
+            manifest_path = utl.get_manifest_path(source=source)
+        manifest = Manifest(path=manifest_path)
+        files = self._get_files(source=source)
+
+        # The manifest is saved once after planning, and then once per finished document
+        with manifest.batch():
+            deleted = set(manifest.filenames) - set(files)
+            for filename in deleted:
+                entry = manifest.get(filename)
+                doc_id = entry.doc_id or self.get_document_id(filename=filename)
+                logging.info(f'purge deleted file "{filename}" ({doc_id})')
+                self._removal_pipeline.apply(id_=doc_id)
+                manifest.remove(filename)
+
+            to_ingest, nunchanged = [], 0
+            for filename in files:
+                stat = Path(filename).stat()
+                entry = manifest.get(filename)
+                if entry is not None and entry.is_unchanged(size=stat.st_size, mtime=stat.st_mtime):
+                    nunchanged += 1
+                    continue
+
+                content_hash = utl.get_file_hash(filename=filename)
+                if entry is not None and entry.status == Manifest.DONE and entry.content_hash == content_hash:
+                    nunchanged += 1
+                    entry.size, entry.mtime = stat.st_size, stat.st_mtime
+                    manifest.set(entry)
+                    continue
+
+                if entry is not None:
+                    # Changed, failed, or interrupted: remove whatever might already be stored
+                    doc_id = entry.doc_id or self.get_document_id(filename=filename)
+                    logging.info(f'remove outdated document of file "{filename}" ({entry.status}) ({doc_id})')
+                    self._removal_pipeline.apply(id_=doc_id)
+
+                manifest.set(ManifestEntry(filename=filename, content_hash=content_hash, size=stat.st_size,
+                                           mtime=stat.st_mtime, status=Manifest.PENDING))
+                to_ingest.append(filename)
+
+        logging.info(f'sync "{source}": {len(to_ingest)} new or changed, {nunchanged} unchanged, {len(deleted)} deleted')
+
+        def _on_done(filename: str, doc_id: str):
+            manifest.set_status(filename=filename, status=Manifest.DONE, doc_id=doc_id)
+
+        def _on_failed(filename: str):
+            manifest.set_status(filename=filename, status=Manifest.FAILED)
+
+        if nworkers is not None:
+            content_hashes = {f: manifest.get(f).content_hash for f in to_ingest}
+            doc_ids = self._add_documents_pipelined(files=to_ingest, nworkers=nworkers, content_hashes=content_hashes,
+                                                    on_done=_on_done, on_failed=_on_failed)
+        else:
+            doc_ids = []
+            for f in to_ingest:
+                try:
+                    doc_id = self._add_document(filename=f, content_hash=manifest.get(f).content_hash)
+                except Exception:
+                    logging.exception(f'ingestion of "{f}" failed')
+                    _on_failed(filename=f)
+                else:
+                    _on_done(filename=f, doc_id=doc_id)
+                    doc_ids.append(doc_id)
+            self._log_cache_stats()
+
+        self._save_vector_index()
+        if commit:
+            self.flush()
+        return doc_ids
 
-        doc_ids = []
-        for f in files:
-            doc_ids.append(self._add_document(filename=f, commit=commit))
+    def apply(self, source: str, commit: bool = False, nworkers: int | None = None,
+              on_stage: Callable[..., None] | None = None, content_hash: str | None = None):
+        """Ingest a file or all files of a directory (`content_hash` may be given if `source` is a single file)."""
+        files = self._get_files(source=source)
+        if len(files) != 1:
+            content_hash = None
+
+        if nworkers is not None:
+            content_hashes = {files[0]: content_hash} if content_hash is not None else None
+            doc_ids = self._add_documents_pipelined(files=files, nworkers=nworkers, content_hashes=content_hashes)
+        else:
+            doc_ids = []
+            for f in files:
+                doc_ids.append(self._add_document(filename=f, on_stage=on_stage, content_hash=content_hash))
+            self._log_cache_stats()
+
+        self._save_vector_index()
+        if commit:
+            self.flush()
         return doc_ids
 
 
@@ -115,6 +420,8 @@ class QueryPipeline(Pipeline):
 
     _txt_sep = ' '
     _nte_max = 100
+    _knn_fields = 'id,score,doc_id,txt_ent_id,passage_id,index'
+    _lexical_fields = 'id,score,doc_id,passage_id,text,index'
 
     def __init__(self, environment: Environment, settings: dict):
         super().__init__(environment=environment, settings=settings)
@@ -124,114 +431,269 @@ class QueryPipeline(Pipeline):
         # Text embedding service
         model_name = settings['modelling']['model_name']
         cache_folder = settings['paths']['models']
-        self._text_embedder = TextEmbedder(model_name=model_name, cache_folder=cache_folder)
+        embedding_cache = get_embedding_cache(settings=settings)
+        backend = settings['modelling']['inference']['embedder']
+        self._text_embedder = TextEmbedder(model_name=model_name, cache_folder=cache_folder, cache=embedding_cache,
+                                           backend=backend)
 
         self._ntok_max = settings['modelling']['ntok_max']
         self._ntok_context_fraction = settings['modelling']['ntok_context_fraction']
         self._ntok_context = int(self._ntok_max * self._ntok_context_fraction)
 
         self._summarizer = Summarizer(settings=settings)
-        self._tokenizer = AutoTokenizer.from_pretrained(settings['modelling']['model_name'])
+        self._generation_batcher = GenerationBatcher.from_settings(summarizer=self._summarizer, settings=settings)
+        self._token_counter = TextTokenCounter(model_name=model_name)
+        self._context_builder = ContextBuilder(solr_client=self._solr_client, collection=self._texts_collection,
+                                               token_counter=self._token_counter,
+                                               ntok_context=self._ntok_context, nte_max=self._nte_max,
+                                               sep=self._txt_sep)
+
+        # Answers of repeated questions, invalidated by ingestions and removals
+        self._answer_cache = AnswerCache.from_settings(settings=settings)
+        if self._answer_cache is not None:
+            subscribe(self._answer_cache.invalidate)
+
+        # In-process vector index (`None` for the Solr kNN backend)
+        self._vector_index = get_vector_index(settings=settings)
+
+        # Latencies of the recent queries
+        self._latencies = {'time_to_first_token': LatencyStats(), 'query': LatencyStats()}
+
+        # Retrieval by kNN only or by BM25 and kNN in parallel (fused by reciprocal rank)
+        self._retrieval_mode = settings['retrieval']['mode']
+        if self._retrieval_mode not in ('knn', 'hybrid'):
+            raise ValueError(f'unknown retrieval mode "{self._retrieval_mode}"')
+        self._hybrid_settings = settings['retrieval']['hybrid']
+        self._retrieval_executor = None
+        if self._retrieval_mode == 'hybrid':
+            self._retrieval_executor = ThreadPoolExecutor(max_workers=settings['solr'].get('pool_size', 10),
+                                                          thread_name_prefix='ayd-bm25')
 
     @staticmethod
-    def _add_similarity_values(vector: np.ndarray, knn_embedding_entities: List[dict]):
-        for ent in knn_embedding_entities:
-            ent['score'] = np.dot(vector, ent['vector'])
+    def _add_similarity_values(knn_embedding_entities: List[dict]) -> List[dict]:
+        """Convert Solr's scores of the `dot_product` similarity, i.e. (1 + dot) / 2, back to the dot products."""
+        scores = np.fromiter((ent['score'] for ent in knn_embedding_entities), dtype=np.float32,
+                             count=len(knn_embedding_entities))
+        for ent, score in zip(knn_embedding_entities, (2 * scores - 1).tolist()):
+            ent['score'] = score
         return knn_embedding_entities
 
-    def _get_knn_vecs_from_text(self, text: str, show_progress_bar: bool = True, normalize_embeddings: bool = True) -> List[dict]:
-        vector = self._text_embedder.apply(texts=text, show_progress_bar=show_progress_bar, normalize_embeddings=normalize_embeddings)
-        top_k = self._settings['solr']['top_k']
-        vec_str = '[' + ', '.join(str(v) for v in vector) + ']'
-        query = f'{{!knn f=vector topK={top_k}}}{vec_str}'
+    def _get_vector_from_text(self, text: str, show_progress_bar: bool = True, normalize_embeddings: bool = True) -> np.ndarray:
+        return self._text_embedder.apply(texts=text, show_progress_bar=show_progress_bar, normalize_embeddings=normalize_embeddings)
+
+    def _get_knn_vecs_from_vector(self, vector: np.ndarray, top_k: int | None = None) -> List[dict]:
+        top_k = top_k or self._settings['solr']['top_k']
+        if self._vector_index is not None:
+            return self._vector_index.search(queries=vector, top_k=top_k)[0]
 
         collection = self._settings['solr']['collections']['map']['vecs']
-        response = self._solr_client.search(query=query, collection=collection)
-        knn_embedding_entities = self._add_similarity_values(vector=vector, knn_embedding_entities=response['docs'])
-        return knn_embedding_entities
+        knn_embedding_entities = self._solr_client.knn_search(vector=vector, collection=collection, top_k=top_k,
+                                                              fl=self._knn_fields)
+        return self._add_similarity_values(knn_embedding_entities=knn_embedding_entities)
+
+    def _get_lexical_hits_from_text(self, text: str, top_k: int) -> List[dict]:
+        """BM25 search of the text entities, the hits carry the same fields as the kNN hits."""
+        hits = self._solr_client.lexical_search(text=text, collection=self._texts_collection, top_k=top_k,
+                                                fl=self._lexical_fields)
+        for hit in hits:
+            hit['txt_ent_id'] = hit.pop('id')
+        return hits
+
+    def _get_hybrid_hits(self, text: str, vector: np.ndarray) -> List[dict]:
+        """Run the BM25 and the kNN search in parallel and fuse their rankings into `top_k` text entity hits."""
+        lexical_hits = self._retrieval_executor.submit(self._get_lexical_hits_from_text, text=text,
+                                                       top_k=self._hybrid_settings['top_k_lexical'])
+        knn_vecs = self._get_knn_vecs_from_vector(vector=vector, top_k=self._hybrid_settings['top_k_knn'])
+        lexical_hits = lexical_hits.result()
+        hits = reciprocal_rank_fusion(rankings=[knn_vecs, lexical_hits], key='txt_ent_id',
+                                      k=self._hybrid_settings['rrf_k'], top_k=self._settings['solr']['top_k'])
+        logging.info(f'fused {len(knn_vecs)} knn and {len(lexical_hits)} bm25 hits into {len(hits)} hits')
+        return hits
 
     def _get_text_entities_from_knn_vecs(self, knn_vecs: List[dict]) -> List[dict]:
-        te_ids = list(set(v['txt_ent_id'] for v in knn_vecs))
+        """Fetch the text entities of the hits, ordered by their best hit (highest score first)."""
+        knn_vecs = sorted(knn_vecs, key=lambda v: v.get('score', 0.0), reverse=True)
+        te_ids = list(dict.fromkeys(v['txt_ent_id'] for v in knn_vecs))
         query = f'id:({" OR ".join(te_ids)})'
         collection = self._settings['solr']['collections']['map']['texts']
-        response = self._solr_client.search(query=query, collection=collection)
-        return response['docs']
+        params = {'fl': 'id,doc_id,index,text', 'rows': len(te_ids)}
+        response = self._solr_client.search(query=query, collection=collection, params=params)
+        text_entities = {te['id']: te for te in response['docs']}
+        return [text_entities[i] for i in te_ids if i in text_entities]
 
     def _get_context_from_text_entities(self, text_entities: List[dict]) -> str:
+        return self._context_builder.apply(hits=text_entities)
+
+    def _get_passages_from_knn_vecs(self, knn_vecs: List[dict]) -> List[dict]:
+        """Fetch the passages of the hits, ordered by their best hit."""
+        passage_ids = list(dict.fromkeys(v['passage_id'] for v in knn_vecs))
+        query = f'id:({" OR ".join(passage_ids)})'
+        collection = self._settings['solr']['collections']['map']['passages']
+        params = {'fl': 'id,doc_id,name,text,ntokens', 'rows': len(passage_ids)}
+        response = self._solr_client.search(query=query, collection=collection, params=params)
+        passages = {p['id']: p for p in response['docs']}
+        return [passages[i] for i in passage_ids if i in passages]
+
+    def _get_context_from_passages(self, passages: List[dict]) -> str:
+        """Concatenate the most relevant passages within the token budget (the best passage is always part of it)."""
+        texts, ntokens = [], 0
+        for passage in passages:
+            if texts and ntokens + passage['ntokens'] > self._ntok_context:
+                break
+            texts.append(passage['text'])
+            ntokens += passage['ntokens']
+        logging.info(f'context of {len(texts)} passages with {ntokens} tokens (budget {self._ntok_context})')
+        return self._txt_sep.join(texts)
+
+    def _get_names(self, doc_ids: List[str]) -> Dict[str, str]:
+        """Perform a Solr lookup to get the names associated with doc_ids."""
+        collection = self._settings['solr']['collections']['map']['docs']
+        query = " OR ".join([f'id:{doc_id}' for doc_id in doc_ids])
+        params = {"fl": "id,name"}  # Assuming the name field in your Solr collection is named "name"
+        response = self._solr_client.search(query=query, collection=collection, params=params)
+        return {doc['id']: doc['name'] for doc in response['docs']}
 
-        def _concatenate_texts_from_series(cntxt: pd.Series) -> str:
-            return self._txt_sep.join(cntxt.sort_index())
-
-        def _is_below_ntok_max(cntxt: pd.Series) -> bool:
-            text = _concatenate_texts_from_series(cntxt=cntxt)
-            ntoks = len(self._tokenizer.tokenize(text))
-            return ntoks <= self._ntok_context
-
-        multi_index = pd.MultiIndex.from_arrays([[], []], names=['doc_id', 'txt_ind'])
-        doc_texts = pd.Series([], index=multi_index)
-        for te in text_entities:
-            start = max(0, te['index'] - self._nte_max // 2)
-            rows = self._nte_max
-            query = f'doc_id:{te["doc_id"]}'
-            params = {'start': start, 'rows': rows, "sort": "index asc"}
-            response = self._solr_client.search(query=query, collection=self._texts_collection, params=params)
-            for _te in response['docs']:
-                doc_texts[(_te['doc_id'], _te['index'])] = _te['text']
-
-        candidates = [(te['doc_id'], te['index']) for te in text_entities]
-        context_texts = pd.Series([], index=multi_index)
-        while len(candidates):
-            doc_id, index = candidates.pop()
-            if (doc_id, index) not in context_texts:
-                context_texts[(doc_id, index)] = doc_texts[(doc_id, index)]
-
-                if not _is_below_ntok_max(context_texts):
-                    context_texts.drop((doc_id, index), inplace=True)
-                    break
-
-                if (doc_id, index - 1) in doc_texts:
-                    candidates.append((doc_id, index - 1))
-                if (doc_id, index + 1) in doc_texts:
-                    candidates.append((doc_id, index + 1))
-
-        return _concatenate_texts_from_series(context_texts)
+    def _prepare(self, text: str, timings: StageTimings) -> QueryItem:
+        """All stages before the generation of the answer: embedding, retrieval, and context."""
+        if self._answer_cache is not None and (result := self._answer_cache.get(question=text)) is not None:
+            return QueryItem(text=text, result=result)
 
-    def apply(self, text: str, answer_only: bool = True) -> List[dict]:
         logging.info(f'generate text embeddings for text "{text}"')
+        with timings.measure('embedding'):
+            vector = self._get_vector_from_text(text=text)
+        item = QueryItem(text=text, vector=vector)
+
+        if self._retrieval_mode == 'hybrid':
+            logging.info(f'search text entities by bm25 and k-nearest-neighbors')
+            with timings.measure('hybrid'):
+                knn_vecs = self._get_hybrid_hits(text=text, vector=vector)
+        else:
+            logging.info(f'search k-nearest-neighbors for text')
+            with timings.measure('knn'):
+                knn_vecs = self._get_knn_vecs_from_vector(vector=vector)
+
+        if not knn_vecs:
+            # Empty corpus (or a local vector index which was not yet loaded, see `rebuild_vector_index`)
+            logging.warning(f'no hits for "{text}", answer without context')
+
+        elif all(v.get('passage_id') for v in knn_vecs):
+            # Documents ingested with passages: the hits map straight to context blocks
+            logging.info(f'search passages')
+            with timings.measure('passages'):
+                passages = self._get_passages_from_knn_vecs(knn_vecs=knn_vecs)
+                item.context = self._get_context_from_passages(passages=passages)
+            # The texts of the sources are stored in the texts collection only
+            with timings.measure('texts'):
+                item.text_entities = self._get_text_entities_from_knn_vecs(knn_vecs=knn_vecs)
+            item.doc_id_to_name = {p['doc_id']: p['name'] for p in passages}
 
-        logging.info(f'search k-nearest-neighbors for text')
-        knn_vecs = self._get_knn_vecs_from_text(text=text)
+        else:
+            logging.info(f'search text entities')
+            with timings.measure('texts'):
+                item.text_entities = self._get_text_entities_from_knn_vecs(knn_vecs=knn_vecs)
 
-        logging.info(f'search text entities')
-        text_entities = self._get_text_entities_from_knn_vecs(knn_vecs=knn_vecs)
+            logging.info(f'extract context from documents')
+            with timings.measure('context'):
+                item.context = self._get_context_from_text_entities(text_entities=item.text_entities)
 
-        logging.info(f'extract context from documents')
-        context = self._get_context_from_text_entities(text_entities=text_entities)
+            with timings.measure('names'):
+                item.doc_id_to_name = self._get_names(doc_ids=[te.get('doc_id') for te in item.text_entities])
 
-        logging.info(f'generate answer to "{text}" based on context "{context[:200]}..."')
-        answer = self._summarizer.get_answer(query=text, context=context)
+        item.fingerprint = get_context_fingerprint(context=item.context)
+        if self._answer_cache is not None:
+            item.result = self._answer_cache.get(question=text, vector=vector, fingerprint=item.fingerprint)
+        return item
 
+    def _complete(self, item: QueryItem, answer: str) -> dict:
+        """Assemble the result of a generated answer (with its sources) and add it to the answer cache."""
         logging.info(f'answer: {answer}')
 
-        doc_ids = [doc.get('doc_id') for doc in text_entities]
-        indexes = [doc.get('index') for doc in text_entities]
-        texts = [doc.get('text') for doc in text_entities]
-        
+        doc_ids = [doc.get('doc_id') for doc in item.text_entities]
+        indexes = [doc.get('index') for doc in item.text_entities]
+        texts = [doc.get('text') for doc in item.text_entities]
+        names = [item.doc_id_to_name.get(doc_id, '') for doc_id in doc_ids]
+        result = {"answer": answer, "doc_ids" : doc_ids, "indexes" : indexes, "texts": texts, "names": names}
+
+        if self._answer_cache is not None:
+            self._answer_cache.put(question=item.text, vector=item.vector, fingerprint=item.fingerprint,
+                                   doc_ids=set(doc_ids) | set(item.doc_id_to_name), result=result)
+        return result
+
+    def _get_answer(self, text: str, context: str) -> str:
+        """Generate the answer, in a batch with concurrent questions if generation batching is enabled."""
+        if self._generation_batcher is not None:
+            return self._generation_batcher.get_answer(query=text, context=context)
+        return self._summarizer.get_answer(query=text, context=context)
+
+    def _get_result(self, text: str, timings: StageTimings) -> dict:
+        item = self._prepare(text=text, timings=timings)
+        if item.result is not None:
+            return item.result
+
+        logging.info(f'generate answer to "{text}" based on context "{item.context[:200]}..."')
+        with timings.measure('answer'):
+            answer = self._get_answer(text=text, context=item.context)
+        return self._complete(item=item, answer=answer)
+
+    @property
+    def answer_cache(self) -> AnswerCache | None:
+        return self._answer_cache
+
+    @property
+    def metrics(self) -> Dict[str, dict]:
+        """Latencies of the recent queries and statistics of the generation batches."""
+        metrics = {name: stats.to_dict() for name, stats in self._latencies.items()}
+        if self._generation_batcher is not None:
+            metrics['generation_batching'] = self._generation_batcher.stats.to_dict()
+        return metrics
+
+    def warm_up(self):
+        """Load the models and run dummy embedding and generation passes."""
+        self._token_counter(['warm-up'])
+        self._text_embedder.warm_up()
+        self._summarizer.warm_up()
+
+    def stream(self, text: str) -> Iterator[dict]:
+        """Yield token messages while the answer is generated, followed by a final message with the result."""
+        timings = StageTimings()
+        start = time.perf_counter()
+        item = self._prepare(text=text, timings=timings)
+
+        if (result := item.result) is None:
+            logging.info(f'stream answer to "{text}" based on context "{item.context[:200]}..."')
+            chunks = []
+            # Closed explicitly, such that an abandoned stream stops (and joins) its generation in this thread
+            stream = self._summarizer.stream_answer(query=text, context=item.context)
+            with timings.measure('answer'), closing(stream):
+                for chunk in stream:
+                    if not chunk:
+                        continue
+                    if not chunks:
+                        self._latencies['time_to_first_token'].observe(time.perf_counter() - start)
+                    chunks.append(chunk)
+                    yield {"type": "token", "data": chunk}
+            result = self._complete(item=item, answer=''.join(chunks).strip())
+        else:
+            self._latencies['time_to_first_token'].observe(time.perf_counter() - start)
+            yield {"type": "token", "data": result["answer"]}
 
-        # Perform a Solr lookup to get the names associated with doc_ids
-        collection = self._settings['solr']['collections']['map']['docs']
-        query = " OR ".join([f'id:{doc_id}' for doc_id in doc_ids])
-        params = {"fl": "id,name"}  # Assuming the name field in your Solr collection is named "name"
-        response = self._solr_client.search(query=query, collection=collection, params=params)
+        self._latencies['query'].observe(time.perf_counter() - start)
+        logging.info(f'query stage timings: {timings}')
+        yield {"type": "final", "data": [result]}
 
-        # Extract the names from the Solr response and create the names list
-        doc_id_to_name = {doc['id']: doc['name'] for doc in response['docs']}
-        names = [doc_id_to_name.get(doc_id, '') for doc_id in doc_ids]
+    def apply(self, text: str, answer_only: bool = True) -> List[dict]:
+        timings = StageTimings()
+        start = time.perf_counter()
+        result = self._get_result(text=text, timings=timings)
+        seconds = time.perf_counter() - start
+        self._latencies['time_to_first_token'].observe(seconds)
+        self._latencies['query'].observe(seconds)
+        logging.info(f'query stage timings: {timings}')
 
         if answer_only:
-            return [{"answer" : answer}]
+            return [{"answer" : result["answer"]}]
         else:
-            return [{"answer": answer, "doc_ids" : doc_ids, "indexes" : indexes, "texts": texts, "names": names}]
+            return [result]
 
 
 class RemovalPipeline(Pipeline):
@@ -239,14 +701,25 @@ class RemovalPipeline(Pipeline):
     def __init__(self, environment: Environment, settings: dict):
         super().__init__(environment=environment, settings=settings)
         self._solr_client = SolrClient(environment=environment, settings=settings)
+        self._vector_index = get_vector_index(settings=settings)
+        self._corpus_version = CorpusVersion.from_settings(settings=settings)
 
     def apply(self, id_: str, commit: bool = False):
-        collection = self._settings['solr']['collections']['map']['docs']
-        self._solr_client.delete_document(by=f"id:{id_}", collection=collection, commit=commit)
-        collection = self._settings['solr']['collections']['map']['texts']
-        self._solr_client.delete_document(by=f"doc_id:{id_}", collection=collection, commit=commit)
-        collection = self._settings['solr']['collections']['map']['vecs']
-        self._solr_client.delete_document(by=f"doc_id:{id_}", collection=collection, commit=commit)
+        """Remove a document with its passages, text entities, and embeddings, where `commit` flushes all collections."""
+        collections = self._settings['solr']['collections']['map']
+        names = [collections['docs'], collections['passages'], collections['texts'], collections['vecs']]
+        self._solr_client.delete_document(by=f"id:{id_}", collection=collections['docs'])
+        for name in names[1:]:
+            self._solr_client.delete_document(by=f"doc_id:{id_}", collection=name)
+        if self._vector_index is not None:
+            self._vector_index.remove(doc_id=id_)
+        notify_documents_changed(doc_ids=[id_], delay=None if commit else self._solr_client.visibility_delay,
+                                 corpus_version=self._corpus_version)
+        if commit:
+            self._solr_client.flush(collections=names)
+            if self._vector_index is not None:
+                self._vector_index.save()
+            notify_documents_changed(doc_ids=[], corpus_version=self._corpus_version)
 
 
 class SearchPipeline(Pipeline):
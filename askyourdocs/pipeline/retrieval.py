@@ -0,0 +1,17 @@
+from typing import List
+
+
+def reciprocal_rank_fusion(rankings: List[List[dict]], key: str = 'txt_ent_id', k: int = 60,
+                           top_k: int | None = None) -> List[dict]:
+    """Fuse ranked lists of hits by reciprocal rank and return the `top_k` best hits."""
+    fused = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            entry = fused.setdefault(hit[key], {'score': 0.0})
+            for name, value in hit.items():
+                if name != 'score' and entry.get(name) is None:
+                    entry[name] = value
+            entry['score'] += 1 / (k + rank)
+
+    hits = sorted(fused.values(), key=lambda h: h['score'], reverse=True)
+    return hits if top_k is None else hits[:top_k]
@@ -0,0 +1,219 @@
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+import logging
+from queue import Queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List
+
+
+_SENTINEL = object()
+
+
+@dataclass
+class Stage:
+    """A single processing step of a staged pipeline, executed by `nworkers` threads."""
+
+    name: str
+    func: Callable[[Any], Any]
+    nworkers: int = 1
+    flush: Callable[[], Iterable[Any]] | None = None
+
+
+@dataclass
+class StageStats:
+    """Throughput statistics of a single stage."""
+
+    name: str
+    nworkers: int
+    nitems: int = 0
+    nfailed: int = 0
+    busy: float = 0.0
+    start: float | None = None
+    end: float | None = None
+
+    @property
+    def wall(self) -> float:
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    @property
+    def throughput(self) -> float:
+        return self.nitems / self.wall if self.wall > 0 else 0.0
+
+    @property
+    def utilization(self) -> float:
+        return self.busy / (self.wall * self.nworkers) if self.wall > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'nworkers': self.nworkers,
+            'nitems': self.nitems,
+            'nfailed': self.nfailed,
+            'wall': self.wall,
+            'busy': self.busy,
+            'throughput': self.throughput,
+            'utilization': self.utilization,
+        }
+
+    def __str__(self):
+        return (f'stage "{self.name}" ({self.nworkers} worker(s)): {self.nitems} items ({self.nfailed} failed) '
+                f'in {self.wall:.2f}s -> {self.throughput:.2f} items/s, utilization {self.utilization:.0%}')
+
+
+class StagedExecutor:
+    """Runs items through a sequence of stages connected by bounded queues."""
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8):
+        self._stages = stages
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self.stats: List[StageStats] = []
+
+    def _run_worker(self, stage: Stage, stats: StageStats, queue_in: Queue, queue_out: Queue, nrunning: List[int],
+                    nworkers_next: int, on_error: Callable[[str, Any, Exception], None] | None):
+        while (item := queue_in.get()) is not _SENTINEL:
+            start = time.perf_counter()
+            with self._lock:
+                if stats.start is None:
+                    stats.start = start
+            try:
+                result = stage.func(item)
+            except Exception as exc:
+                logging.exception(f'stage "{stage.name}" failed for {item}')
+                result = None
+                with self._lock:
+                    stats.nfailed += 1
+                if on_error is not None:
+                    on_error(stage.name, item, exc)
+            else:
+                with self._lock:
+                    stats.nitems += 1
+            with self._lock:
+                stats.busy += time.perf_counter() - start
+            self._put_results(stage=stage, result=result, queue_out=queue_out)
+
+        with self._lock:
+            nrunning[0] -= 1
+            last = nrunning[0] == 0
+        if last:
+            if stage.flush is not None:
+                self._flush(stage=stage, stats=stats, queue_out=queue_out)
+            with self._lock:
+                if stats.start is not None:
+                    stats.end = time.perf_counter()
+            for _ in range(nworkers_next):
+                queue_out.put(_SENTINEL)
+
+    @staticmethod
+    def _put_results(stage: Stage, result: Any, queue_out: Queue):
+        if result is None:
+            return
+        if stage.flush is None:
+            queue_out.put(result)
+        else:
+            for res in result:
+                queue_out.put(res)
+
+    def _flush(self, stage: Stage, stats: StageStats, queue_out: Queue):
+        start = time.perf_counter()
+        try:
+            result = stage.flush()
+        except Exception:
+            logging.exception(f'flushing stage "{stage.name}" failed')
+            result = None
+        with self._lock:
+            stats.busy += time.perf_counter() - start
+        self._put_results(stage=stage, result=result, queue_out=queue_out)
+
+    @staticmethod
+    def _feed(items: Iterable, queue: Queue, nworkers: int):
+        for item in items:
+            queue.put(item)
+        for _ in range(nworkers):
+            queue.put(_SENTINEL)
+
+    def apply(self, items: Iterable, on_error: Callable[[str, Any, Exception], None] | None = None) -> List[Any]:
+        """Process all items and return the results of the last stage (in order of completion)."""
+        queues = [Queue(maxsize=self._queue_size) for _ in self._stages] + [Queue()]
+        self.stats = [StageStats(name=s.name, nworkers=s.nworkers) for s in self._stages]
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], self._stages[0].nworkers), daemon=True)]
+        for i, (stage, stats) in enumerate(zip(self._stages, self.stats)):
+            nworkers_next = self._stages[i + 1].nworkers if i + 1 < len(self._stages) else 1
+            nrunning = [stage.nworkers]
+            for j in range(stage.nworkers):
+                args = (stage, stats, queues[i], queues[i + 1], nrunning, nworkers_next, on_error)
+                threads.append(threading.Thread(target=self._run_worker, args=args, name=f'{stage.name}-{j}', daemon=True))
+
+        for t in threads:
+            t.start()
+
+        results = []
+        while (result := queues[-1].get()) is not _SENTINEL:
+            results.append(result)
+
+        for t in threads:
+            t.join()
+        return results
+
+
+class StageTimings:
+    """Wall time per named stage of a single run (e.g. of one query)."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+
+    @property
+    def total(self) -> float:
+        return sum(self.seconds.values())
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(self.seconds)
+
+    def __str__(self):
+        stages = ', '.join(f'{name}={s * 1000:.1f}ms' for name, s in self.seconds.items())
+        return f'{stages} (total={self.total * 1000:.1f}ms)'
+
+
+class LatencyStats:
+    """Latencies of the most recent `window` observations (e.g. the time to the first token of an answer)."""
+
+    def __init__(self, window: int = 1000):
+        self._seconds = deque(maxlen=window)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._seconds.append(seconds)
+            self._count += 1
+
+    @staticmethod
+    def _percentile(ordered: List[float], q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> Dict[str, float | int | None]:
+        with self._lock:
+            ordered = sorted(self._seconds)
+            count = self._count
+        if not ordered:
+            return {'count': count, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+        return {
+            'count': count,
+            'mean_ms': 1000 * sum(ordered) / len(ordered),
+            'p50_ms': 1000 * self._percentile(ordered, 0.5),
+            'p95_ms': 1000 * self._percentile(ordered, 0.95),
+            'max_ms': 1000 * ordered[-1],
+        }
@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+class Startup:
+    """Timed startup phases of a service, where the heavy ones run in a background thread."""
+
+    STARTING = 'starting'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self._created = time.time()
+        self._phases: List[Tuple[str, Callable[[], None]]] = []
+        self._timings: Dict[str, float] = {}
+        self._status = self.STARTING
+        self._phase: str | None = None
+        self._error: str | None = None
+        self._finished: float | None = None
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(status={self._status!r}, phase={self._phase!r})'
+
+    @property
+    def is_live(self) -> bool:
+        return self._status != self.FAILED
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Record the duration of a startup phase which runs in the caller's thread (e.g. at import)."""
+        logging.info(f'startup phase "{name}"')
+        self._phase, start = name, time.perf_counter()
+        try:
+            yield
+        finally:
+            self._timings[name] = time.perf_counter() - start
+            self._phase = None
+            logging.info(f'startup phase "{name}" took {self._timings[name]:.1f}s')
+
+    def add_phase(self, name: str, func: Callable[[], None]):
+        """Add a phase to the background startup, phases run in the order they were added."""
+        self._phases.append((name, func))
+
+    def _run(self):
+        name = None
+        try:
+            for name, func in self._phases:
+                with self.phase(name):
+                    func()
+        except Exception as exc:
+            logging.exception(f'startup phase "{name}" failed: {exc}')
+            self._error = f'{name}: {exc}'
+            self._status = self.FAILED
+        else:
+            self._status = self.READY
+            self._ready.set()
+        finally:
+            self._finished = time.time()
+            logging.info(f'startup {self._status} after {self._finished - self._created:.1f}s')
+
+    def start(self):
+        """Run the phases in a background thread (once)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ayd-startup', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the service is ready (or the timeout expired) and return if it is ready."""
+        return self._ready.wait(timeout=timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            'status': self._status,
+            'phase': self._phase,
+            'timings': dict(self._timings),
+            'seconds': (self._finished or time.time()) - self._created,
+            'error': self._error,
+        }
@@ -10,6 +10,7 @@ MODEL_NTOKENS = 512
 DOCS_COLLECTION = 'ayd_docs'
 TEXTS_COLLECTION = 'ayd_texts'
 VECS_COLLECTION = 'ayd_vecs'
+PASSAGES_COLLECTION = 'ayd_passages'
 FEEDBACK_COLLECTION = 'ayd_feedback'
 
 CORS_ALLOWED_STR = os.getenv('CORS_ALLOWED', 'http://localhost:8000,http://localhost:3000')
@@ -20,6 +21,7 @@ SETTINGS = {
     'paths': {
         'root': _root_path,
         'models': _root_path / 'models',
+        'cache': _root_path / 'cache',
     },
     'cors_origins': CORS_ALLOWED_LIST,
 
@@ -28,11 +30,25 @@ SETTINGS = {
         'nshards': 1,
         'datetime_format': "%Y-%m-%dT%H:%M:%S.%fZ",
         'top_k': 5,
+        'pool_size': 10,
+        'commit': {
+            'within_ms': 1000,          # commitWithin of updates without explicit commit
+            'soft': True,               # explicit commits are soft commits
+            'read_your_writes': True,   # web api: commit uploads and deletions
+        },
+        'bulk': {
+            'batch_size': 500,
+            'nworkers': 4,
+            'max_retries': 3,
+            'backoff': 0.5,
+            'timeout': 60.0,
+        },
         'collections': {
             'map': {
                 'docs': DOCS_COLLECTION,
                 'texts': TEXTS_COLLECTION,
                 'vecs': VECS_COLLECTION,
+                'passages': PASSAGES_COLLECTION,
                 'feedback': FEEDBACK_COLLECTION,
             },
             DOCS_COLLECTION: {
@@ -59,6 +75,13 @@ SETTINGS = {
                         'stored': 'true',
                         'multiValued': 'false'
                     },
+                    {
+                        'name': 'content_hash',
+                        'type': 'string',
+                        'indexed': 'true',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
                 ]
             },
             TEXTS_COLLECTION: {
@@ -85,6 +108,27 @@ SETTINGS = {
                         'stored': 'true',
                         'multiValued': 'false'
                     },
+                    {
+                        'name': 'overlap',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'ntokens',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'passage_id',
+                        'type': 'string',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
                 ],
             },
             VECS_COLLECTION: {
@@ -108,6 +152,20 @@ SETTINGS = {
                         'indexed': 'false',
                         'stored': 'true',
                     },
+                    {
+                        'name': 'passage_id',
+                        'type': 'string',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'index',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
                 ],
                 'field_types': [
                     {
@@ -118,6 +176,60 @@ SETTINGS = {
                     },
                 ],
             },
+            PASSAGES_COLLECTION: {
+                'config_files': 'resources/solr/conf',
+                'fields': [
+                    {
+                        'name': 'text',
+                        'type': 'text_general',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'doc_id',
+                        'type': 'string',
+                        'indexed': 'true',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'name',
+                        'type': 'string',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'index',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'start',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'end',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                    {
+                        'name': 'ntokens',
+                        'type': 'pint',
+                        'indexed': 'false',
+                        'stored': 'true',
+                        'multiValued': 'false'
+                    },
+                ]
+            },
             FEEDBACK_COLLECTION: {
                 'config_files': 'resources/solr/conf',
                 'fields': [
@@ -157,6 +269,72 @@ SETTINGS = {
         }
     },
 
+    # Tika Settings
+    'tika': {
+        'max_concurrency': 4,
+        'pool_size': 8,
+        'timeout': 300.0,
+        'health_interval': 30.0,
+        'local_pdf': True,
+        'local_pdf_min_chars_per_page': 200,
+        'cache': {
+            'enabled': False,
+            'filename': 'extractions.sqlite',
+            'max_bytes': 5 * 1024 ** 3,
+        },
+    },
+
+    # Ingestion
+    'ingestion': {
+        'nworkers': 4,
+        'queue_size': 4,
+        'embedding_batch_size': 32,
+        'embedding_nbatches': 8,
+        'jobs': {
+            'nworkers': 1,
+            'max_pending': 16,
+            'max_history': 1000,
+        },
+    },
+
+    # Retrieval
+    'retrieval': {
+        'backend': 'solr',              # 'solr' or 'local'
+        'mode': 'knn',                  # 'knn' or 'hybrid'
+        'hybrid': {
+            'top_k_knn': 10,
+            'top_k_lexical': 10,
+            'rrf_k': 60,
+        },
+        'local': {
+            'dirname': 'vectors',
+            'capacity': 1024,
+            'ann': False,               # approximate search with hnswlib
+            'ann_ef_construction': 200,
+            'ann_m': 16,
+            'ann_ef': 64,
+        },
+    },
+
+    # Query
+    'query': {
+        'answer_cache': {
+            'enabled': True,
+            'max_entries': 1024,
+            'ttl': 3600.0,
+            'similarity_threshold': 0.97,
+            'version_filename': 'corpus_version.json',
+        },
+        'executor': {
+            'nworkers': 4,                  # at least the generation max_batch_size
+            'max_pending': 16,              # queries running or waiting
+            'torch_threads': None,          # default: cpus // nworkers
+        },
+        'streaming': {
+            'enabled': True,                # streamed answers are not batched
+        },
+    },
+
     # Modeling
     'modelling': {
         'model_name': MODEL_NAME,
@@ -165,6 +343,36 @@ SETTINGS = {
         'ntok_max': MODEL_NTOKENS,
         'no_repeat_ngram_size': 4,
         'ntok_context_fraction': 0.5,
+        'chunking': {
+            'strategy': 'sliding_window',   # 'sliding_window' or 'sentence'
+            'splitter': 'auto',             # 'punkt', 'regex', or 'auto'
+            'chunk_size': 96,
+            'chunk_overlap': 24,
+            'regex_nchar_min': 1_000_000,
+        },
+        'passages': {
+            'enabled': True,
+            'ntok_max': MODEL_NTOKENS // 4,     # passages per context: ntok_context / ntok_max
+        },
+        'embedding_cache': {
+            'enabled': False,
+            'filename': 'embeddings.sqlite',
+            'max_bytes': 2 * 1024 ** 3,
+        },
+        'inference': {
+            'summarizer': 'fp32',           # 'fp32', 'int8', or 'onnx'
+            'embedder': 'fp32',             # 'fp32' or 'int8' (requires a re-ingestion)
+        },
+        'assisted_generation': {
+            'enabled': False,               # greedy decoding of single prompts only
+            'draft_model_name': 'google/flan-t5-small',
+            'num_assistant_tokens': 5,
+        },
+        'generation_batching': {
+            'enabled': True,
+            'max_batch_size': 4,
+            'max_wait_ms': 10,
+        },
     },
 
     # Frontend
@@ -173,5 +381,13 @@ SETTINGS = {
         'keycloak_realm':'ayd',
         'keycloak_client_id':'ayd-backend',
         'keycloak_client_secret':os.environ.get('BACKEND_KEYCLOAK_SECRET','bQwuuesYTIfcJmOxI4t4fltV48OQsAQq'),
+        'uploads': {
+            'max_bytes': 256 * 1024 ** 2,
+            'chunk_size': 1024 ** 2,
+            'dedup': True,
+        },
+        'startup': {
+            'warm_up': True,
+        },
     },
 }
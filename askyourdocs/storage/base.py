@@ -28,7 +28,7 @@ class StorageService(Service):
             case 'creation':
                 logging.info(f'start collection creation')
                 collection = self._environment.collection
-                self._solr_client.create_collection(name=collection)
+                self._solr_client.create_collection(name=collection, replace=bool(self._environment.replace))
 
             case 'extraction':
                 logging.info(f'start text extraction')
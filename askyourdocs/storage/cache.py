@@ -0,0 +1,36 @@
+import json
+from pathlib import Path
+from typing import Tuple
+import zlib
+
+from askyourdocs.cache import DiskCache, get_shared_cache
+
+
+class ExtractionCache(DiskCache):
+    """Persistent cache of extracted texts keyed by the content hash of the file and the extractor version."""
+
+    _compression_level = 6
+
+    @staticmethod
+    def get_key(content_hash: str, extractor_version: str) -> str:
+        return f'{content_hash}:{extractor_version}'
+
+    def get_extraction(self, key: str) -> Tuple[str | None, dict] | None:
+        if (value := self.get(key=key)) is None:
+            return None
+        entry = json.loads(zlib.decompress(value))
+        return entry['text'], entry['metadata']
+
+    def put_extraction(self, key: str, text: str | None, metadata: dict):
+        value = json.dumps({'text': text, 'metadata': metadata}).encode()
+        self.put(key=key, value=zlib.compress(value, self._compression_level))
+
+
+def get_extraction_cache(settings: dict) -> ExtractionCache | None:
+    """Return the (process-wide shared) extraction cache if it is enabled in the settings."""
+    cache_settings = settings['tika']['cache']
+    if not cache_settings['enabled']:
+        return None
+
+    path = Path(settings['paths']['cache']) / cache_settings['filename']
+    return get_shared_cache(cls=ExtractionCache, path=path, max_bytes=cache_settings['max_bytes'])
@@ -38,7 +38,9 @@ def add_parser(parser: argparse.ArgumentParser):
     strge_subprs.add_parser('add', help='Adding a document', parents=[strg_url_parser(), strge_scrp_parser(), strge_solr_parser()])
 
     # Solr service
-    strge_subprs.add_parser('creation', help='Creation of collection', parents=[strg_url_parser(), strge_solr_parser()])
+    strge_crtn_subprs = strge_subprs.add_parser('creation', help='Creation of collection', parents=[strg_url_parser(), strge_solr_parser()])
+    strge_crtn_subprs.add_argument('--replace', dest='replace', action='store_true',
+                                   help='Delete and recreate an existing collection (its documents have to be re-ingested)')
     strge_srch_subprs = strge_subprs.add_parser('search', help='Search inside collection', parents=[strg_url_parser(), strge_solr_parser()])
     strge_srch_subprs.add_argument('--query', '-q', dest='query', help='Search query', required=True)
 
@@ -1,16 +1,21 @@
 import json
 import logging
+import re
+import reprlib
 from pathlib import Path
 from typing import List
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from kazoo.client import KazooClient
 
-from askyourdocs import Document, DocumentList, DocumentListEncoder
+from askyourdocs import Document, DocumentList, dumps_documents, loads_response
 from askyourdocs import Environment, utils as utl
 
 
 class SolrClient:
+    """Client for the Solr collections and schema API as well as for updates and searches."""
     _headers = {'content-type': 'application/json'}
 
     def __init__(self, environment: Environment, settings: dict):
@@ -25,6 +30,12 @@ class SolrClient:
         self._zk_urls = environment.zk_urls
 
         self._nshards = settings.get('solr').get('nshards')
+        self._pool_size = settings.get('solr').get('pool_size', 10)
+        self._session: requests.Session | None = None
+
+        commit_settings = settings.get('solr').get('commit', {})
+        self._commit_within_ms: int | None = commit_settings.get('within_ms')
+        self._commit_soft: bool = commit_settings.get('soft', False)
 
     def __repr__(self):
         cls_name = type(self).__name__
@@ -55,6 +66,39 @@ class SolrClient:
         res.raise_for_status()
         return res.json()
 
+    @property
+    def session(self) -> requests.Session:
+        """HTTP session with a pool of keep-alive connections, shared among threads."""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    @property
+    def visibility_delay(self) -> float | None:
+        """Seconds until updates without commit are visible, `None` if left to the autoCommit."""
+        if self._commit_within_ms is None:
+            return None
+        return 2 * self._commit_within_ms / 1000
+
+    def _get_commit_params(self, commit: bool = False) -> dict:
+        """Return the url parameters of an update request according to the commit policy."""
+        if commit:
+            return {'softCommit': 'true'} if self._commit_soft else {'commit': 'true'}
+        if self._commit_within_ms is not None:
+            return {'commitWithin': self._commit_within_ms}
+        return {}
+
+    def _post_update(self, url: str, data: str | bytes, commit: bool = False, params: dict | None = None,
+                     timeout: float | None = None):
+        params = {**self._get_commit_params(commit=commit), **(params or {})}
+        logging.debug(f'requests.POST with url={url} and params={params}')
+        response = self.session.post(url, headers=self._headers, data=data, params=params, timeout=timeout)
+        response.raise_for_status()
+
     @staticmethod
     def _get_dest_dir(name: str) -> str:
         return f'/configs/{name}'
@@ -165,7 +209,7 @@ class SolrClient:
         """Create a Solr collection"""
         logging.info(f'creating collection "{name}"')
 
-        define_fields = True
+        add_only = False
         if not self.exists_collection(name=name):
             self._create_collection(name=name)
 
@@ -175,70 +219,86 @@ class SolrClient:
             self._create_collection(name=name)
 
         else:
-            logging.info(f'collection "{name}" does already exist and is ignored')
-            define_fields = False
+            logging.info(f'collection "{name}" does already exist, only missing fields are added')
+            add_only = True
 
-        if define_fields:
-            if (field_types := utl.get_solr_field_types_settings(name=name)) is not None:
-                logging.info(f'define collection field types')
-                self.define_collection_field_types(name=name, field_types=field_types)
+        if (field_types := utl.get_solr_field_types_settings(name=name)) is not None:
+            logging.info(f'define collection field types')
+            self.define_collection_field_types(name=name, field_types=field_types, add_only=add_only)
 
-            if (fields := utl.get_solr_fields_settings(name=name)) is not None:
-                logging.info(f'define collection fields')
-                self.define_collection_fields(name=name, fields=fields)
+        if (fields := utl.get_solr_fields_settings(name=name)) is not None:
+            logging.info(f'define collection fields')
+            self.define_collection_fields(name=name, fields=fields, add_only=add_only)
 
         logging.info(f"creation of collection {name} terminated")
 
     def add_document(self, document: Document, collection: str, commit: bool = False) -> str:
         logging.info(f'add {document.id} to collection "{collection}"')
         url = f'{self._url_api_collections}/{collection}/update'
-        if commit:
-            url += '?commit=true'
-
-        response = requests.post(url, headers=self._headers, data=json.dumps(document.to_dict()))
-        response.raise_for_status()
-
+        data = dumps_documents(documents=[document])
+        self._post_update(url=url, data=data, commit=commit)
         return document.id
 
     def add_documents(self, documents: DocumentList, collection: str, commit: bool = False):
         logging.info(f'add {len(documents)} documents to collection "{collection}"')
         url = f'{self._url_api_collections}/{collection}/update'
-        if commit:
-            url += '?commit=true'
-        data = json.dumps(documents, cls=DocumentListEncoder)
-        response = requests.post(url, headers=self._headers, data=data)
-        response.raise_for_status()
+        data = dumps_documents(documents=documents)
+        self._post_update(url=url, data=data, commit=commit)
+
+    def post_update(self, collection: str, data: str | bytes, commit: bool = False, params: dict | None = None,
+                    timeout: float | None = None):
+        """Post a serialized update request (e.g. a list of documents) to a collection."""
+        url = f'{self._url}/solr/{collection}/update'
+        self._post_update(url=url, data=data, commit=commit, params=params, timeout=timeout)
+
+    def commit(self, collection: str, hard: bool = False):
+        """Make all pending updates of a collection visible (and durable if `hard`)."""
+        kind = 'hard' if hard or not self._commit_soft else 'soft'
+        logging.info(f'{kind} commit collection "{collection}"')
+        params = {'commit': 'true'} if hard else self._get_commit_params(commit=True)
+        self.post_update(collection=collection, data='[]', params=params)
+
+    def flush(self, collections: List[str], hard: bool = False):
+        """Explicit flush point (e.g. at the end of a bulk job): commit the pending updates of all given collections."""
+        for collection in dict.fromkeys(collections):
+            self.commit(collection=collection, hard=hard)
 
     def _get_collection_fields(self, name: str):
         url = f'{self._url_api_collections}/{name}/schema/fields'
         return self._get(url=url)['fields']
 
-    def define_collection_fields(self, name: str, fields: List[dict]):
+    def define_collection_fields(self, name: str, fields: List[dict], add_only: bool = False):
+        """Add the fields to the schema, existing fields are replaced (or only checked if `add_only`)"""
         url = f'{self._url_api_collections}/{name}/schema'
-        field_names = [f['name'] for f in self._get_collection_fields(name=name)]
+        existing = {f['name']: f for f in self._get_collection_fields(name=name)}
 
         for data in fields:
-            if data['name'] in field_names:
-                self._post(url=url, data={'replace-field': data})
-            else:
+            if (field := existing.get(data['name'])) is None:
                 self._post(url=url, data={'add-field': data})
+            elif not add_only:
+                self._post(url=url, data={'replace-field': data})
+            elif field.get('type') != data['type'] or \
+                    str(field.get('multiValued', 'false')).lower() != data.get('multiValued', 'false'):
+                logging.warning(f'field "{data["name"]}" of collection "{name}" is defined as {field}, which differs '
+                                f'from the settings; recreate the collection (`ayd storage creation --replace`) and re-ingest the documents')
 
     def _get_collection_field_types(self, name: str):
         url = f'{self._url_api_collections}/{name}/schema/fieldtypes'
         return self._get(url=url)['fieldTypes']
 
-    def define_collection_field_types(self, name: str, field_types: List[dict]):
+    def define_collection_field_types(self, name: str, field_types: List[dict], add_only: bool = False):
+        """Add the field types to the schema, existing field types are replaced (unless `add_only`)"""
         url = f'{self._url_api_collections}/{name}/schema'
         field_type_names = [ft['name'] for ft in self._get_collection_field_types(name=name)]
 
         for data in field_types:
-            if data['name'] in field_type_names:
-                self._post(url=url, data={'replace-field-type': data})
-            else:
+            if data['name'] not in field_type_names:
                 self._post(url=url, data={'add-field-type': data})
+            elif not add_only:
+                self._post(url=url, data={'replace-field-type': data})
 
-    def search(self, query: str, collection: str, params: dict | None = None) -> dict:
-        """Main search interface"""
+    def search_raw(self, query: str, collection: str, params: dict | None = None) -> dict:
+        """Search and return the complete Solr response (e.g. including `nextCursorMark`)."""
         url = f'{self._url}/solr/{collection}/query'
 
         if params is None:
@@ -250,13 +310,36 @@ class SolrClient:
                 **params
             }
         }
-        response = self._post(url=url, data=data)
+        logging.debug(f'requests.POST with url={url} and data={reprlib.repr(data)}')
+        res = self.session.post(url, headers=self._headers, data=json.dumps(data))
+        res.raise_for_status()
+        return loads_response(res.content)
+
+    def search(self, query: str, collection: str, params: dict | None = None) -> dict:
+        """Main search interface"""
+        response = self.search_raw(query=query, collection=collection, params=params)
         return response['response']
 
+    def knn_search(self, vector: np.ndarray, collection: str, top_k: int, fl: str = 'id,score', field: str = 'vector',
+                   params: dict | None = None) -> List[dict]:
+        """kNN search returning only the fields `fl` of the `top_k` nearest documents."""
+        vec_str = '[' + ','.join(str(v) for v in np.asarray(vector, dtype=np.float32)) + ']'
+        query = f'{{!knn f={field} topK={top_k}}}{vec_str}'
+        params = {'fl': fl, 'rows': top_k, 'omitHeader': 'true', **(params or {})}
+        return self.search(query=query, collection=collection, params=params)['docs']
+
+    @staticmethod
+    def escape_query(text: str) -> str:
+        """Escape the special characters of the Solr query syntax, such that user input is searched as plain text."""
+        return re.sub(r'([+\-&|!(){}\[\]^"~*?:\\/])', r'\\\1', text)
+
+    def lexical_search(self, text: str, collection: str, top_k: int, fl: str = 'id,score', field: str = 'text',
+                       params: dict | None = None) -> List[dict]:
+        """BM25 search of plain text in `field`, returning the fields `fl` of the `top_k` best matching documents."""
+        params = {'defType': 'edismax', 'qf': field, 'fl': fl, 'rows': top_k, 'omitHeader': 'true', **(params or {})}
+        return self.search(query=self.escape_query(text), collection=collection, params=params)['docs']
+
     def delete_document(self, by: str, collection: str, commit: bool = False):
         url = f'{self._url}/solr/{collection}/update'
-        if commit:
-            url += '?commit=true'
-
         delete_request = {'delete': {'query': by}}
-        self._post(url=url, data=delete_request)
\ No newline at end of file
+        self._post_update(url=url, data=json.dumps(delete_request), commit=commit)
@@ -0,0 +1,147 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+import logging
+import random
+import threading
+import time
+from typing import Iterable, Iterator, List
+
+import requests
+
+from askyourdocs import Document, dumps_documents
+from askyourdocs.storage.client import SolrClient
+
+
+class BulkIndexingError(Exception):
+    """Raised if at least one batch of a bulk indexing job finally failed."""
+
+    def __init__(self, report: 'BulkReport'):
+        super().__init__(str(report))
+        self.report = report
+
+
+@dataclass
+class BatchReport:
+    index: int
+    ndocs: int
+    nbytes: int = 0
+    seconds: float = 0.0
+    attempts: int = 0
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BulkReport:
+    collection: str
+    batches: List[BatchReport] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def ndocs(self) -> int:
+        return sum(b.ndocs for b in self.batches)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self.batches)
+
+    @property
+    def failed(self) -> List[BatchReport]:
+        return [b for b in self.batches if not b.ok]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def __str__(self):
+        nretries = sum(max(b.attempts - 1, 0) for b in self.batches)
+        return (f'bulk indexing of {self.ndocs} documents ({self.nbytes / 1e6:.1f} MB) into "{self.collection}": '
+                f'{len(self.batches)} batches, {len(self.failed)} failed, {nretries} retries, {self.seconds:.2f}s')
+
+
+class BulkIndexer:
+    """Streams documents to a Solr collection in batches, retrying transient failures."""
+
+    _transient_status = {408, 429, 500, 502, 503, 504}
+
+    def __init__(self, solr_client: SolrClient, batch_size: int = 500, nworkers: int = 4, max_retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 60.0):
+        self._solr_client = solr_client
+        self._batch_size = batch_size
+        self._nworkers = nworkers
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='bulk-indexer')
+
+    @classmethod
+    def from_settings(cls, solr_client: SolrClient, settings: dict) -> 'BulkIndexer':
+        return cls(solr_client=solr_client, **settings['solr']['bulk'])
+
+    def _batches(self, documents: Iterable[Document]) -> Iterator[List[Document]]:
+        documents = iter(documents)
+        while batch := list(islice(documents, self._batch_size)):
+            yield batch
+
+    def _is_transient(self, exc: Exception) -> bool:
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(exc, requests.HTTPError) and exc.response is not None:
+            return exc.response.status_code in self._transient_status
+        return False
+
+    def _send(self, batch: List[Document], report: BatchReport, collection: str):
+        start = time.perf_counter()
+        try:
+            data = dumps_documents(documents=batch)
+        except Exception as exc:
+            report.error = repr(exc)
+            logging.error(f'batch {report.index} to "{collection}" could not be serialized: {exc!r}')
+            return
+        report.nbytes = len(data)
+        while True:
+            report.attempts += 1
+            try:
+                self._solr_client.post_update(collection=collection, data=data, timeout=self._timeout)
+                break
+            except Exception as exc:
+                if report.attempts > self._max_retries or not self._is_transient(exc):
+                    report.error = repr(exc)
+                    logging.error(f'batch {report.index} to "{collection}" failed after {report.attempts} attempt(s): {exc!r}')
+                    break
+                delay = self._backoff * 2 ** (report.attempts - 1) * (1 + random.random())
+                logging.warning(f'batch {report.index} to "{collection}" failed ({exc!r}), retry in {delay:.2f}s')
+                time.sleep(delay)
+        report.seconds = time.perf_counter() - start
+
+    def apply(self, documents: Iterable[Document], collection: str, commit: bool = False) -> BulkReport:
+        """Index all documents and return a report on the batches (failed batches do not raise)."""
+        start = time.perf_counter()
+        report = BulkReport(collection=collection)
+        in_flight = threading.BoundedSemaphore(2 * self._nworkers)
+        futures: List[Future] = []
+
+        for i, batch in enumerate(self._batches(documents)):
+            in_flight.acquire()
+            batch_report = BatchReport(index=i, ndocs=len(batch))
+            report.batches.append(batch_report)
+            future = self._executor.submit(self._send, batch=batch, report=batch_report, collection=collection)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        for future in futures:
+            future.result()
+
+        if commit and report.batches:
+            self._solr_client.commit(collection=collection)
+
+        report.seconds = time.perf_counter() - start
+        logging.info(str(report))
+        for b in report.batches:
+            logging.debug(f'batch {b.index}: {b.ndocs} docs, {b.nbytes} bytes, {b.attempts} attempt(s), '
+                          f'{b.seconds:.3f}s, error={b.error}')
+        return report
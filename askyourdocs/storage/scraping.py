@@ -1,13 +1,25 @@
 from abc import abstractmethod
+from hashlib import sha256
+import itertools
 import logging
 from pathlib import Path
 import re
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from tika import parser
 import validators
+try:
+    import pypdf
+except ImportError:  # pragma: no cover
+    pypdf = None
 
 from askyourdocs import Environment, Service, TextDocument
+from askyourdocs import utils as utl
+from askyourdocs.storage.cache import ExtractionCache, get_extraction_cache
 
 
 class Extractor(Service):
@@ -21,40 +33,224 @@ class Extractor(Service):
         pass
 
 
+class TikaEndpointPool:
+    """Spreads requests over several Tika servers with pooled sessions and health checks."""
+
+    _content_key = 'X-TIKA:content'
+
+    def __init__(self, urls: List[str], pool_size: int = 8, timeout: float = 300.0, health_interval: float = 30.0):
+        self._urls = urls
+        self._timeout = timeout
+        self._health_interval = health_interval
+        self._healthy: Dict[str, bool] = {url: True for url in urls}
+        self._checked: Dict[str, float] = {url: 0.0 for url in urls}
+        self._cycle = itertools.cycle(urls)
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(urls={self._urls})'
+
+    def _check(self, url: str) -> bool:
+        try:
+            response = self.session.get(f'{url}/tika', timeout=5)
+            healthy = response.ok
+        except requests.RequestException:
+            healthy = False
+        self._set_health(url=url, healthy=healthy)
+        return healthy
+
+    def _set_health(self, url: str, healthy: bool):
+        with self._lock:
+            self._checked[url] = time.monotonic()
+            if healthy != self._healthy[url]:
+                logging.info(f'tika endpoint "{url}" is {"healthy" if healthy else "unhealthy"}')
+            self._healthy[url] = healthy
+
+    def _is_due(self, url: str, now: float) -> bool:
+        """Return if an unhealthy endpoint is due for a health check, and if so claim the check for the caller."""
+        with self._lock:
+            if self._healthy[url] or now - self._checked[url] <= self._health_interval:
+                return False
+            self._checked[url] = now
+            return True
+
+    def _candidates(self) -> List[str]:
+        """Return the endpoints in round-robin order, healthy ones (or those due for a health check) first."""
+        with self._lock:
+            start = next(self._cycle)
+        i = self._urls.index(start)
+        ordered = self._urls[i:] + self._urls[:i]
+
+        now = time.monotonic()
+        for url in ordered:
+            if self._is_due(url=url, now=now):
+                self._check(url)
+        with self._lock:
+            healthy = dict(self._healthy)
+        return [u for u in ordered if healthy[u]] + [u for u in ordered if not healthy[u]]
+
+    def parse(self, content: bytes | BinaryIO) -> Tuple[str | None, dict]:
+        """Extract the text and metadata of a document, trying the next endpoint if an endpoint is not reachable."""
+        headers = {'Accept': 'application/json'}
+        error: Exception | None = None
+        for url in self._candidates():
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            try:
+                response = self.session.put(f'{url}/rmeta/text', data=content, headers=headers, timeout=self._timeout)
+                response.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                logging.warning(f'tika endpoint "{url}" failed: {exc!r}')
+                self._set_health(url=url, healthy=False)
+                error = exc
+                continue
+
+            parts = response.json()
+            texts = [p.get(self._content_key) for p in parts if p.get(self._content_key)]
+            metadata = {k: v for k, v in parts[0].items() if k != self._content_key} if parts else {}
+            return ('\n'.join(texts) if texts else None), metadata
+        raise error or RuntimeError('no tika endpoint available')
+
+
+class PdfExtractor(Extractor):
+    """In-process text extraction for pdfs with a text layer (requires `pypdf`)."""
+
+    def __init__(self, environment: Environment, settings: dict):
+        super().__init__(environment=environment, settings=settings)
+        self._min_chars_per_page = settings['tika']['local_pdf_min_chars_per_page']
+
+    @staticmethod
+    def is_available() -> bool:
+        return pypdf is not None
+
+    def extract(self, filename: str) -> str | None:
+        try:
+            reader = pypdf.PdfReader(filename)
+            pages = [page.extract_text() or '' for page in reader.pages]
+        except Exception as exc:
+            logging.info(f'local pdf extraction of "{filename}" failed ({exc!r}), falling back to tika')
+            return None
+
+        nchars = sum(len(p.strip()) for p in pages)
+        if not pages or nchars / len(pages) < self._min_chars_per_page:
+            logging.info(f'"{filename}" has too little text for local pdf extraction, falling back to tika')
+            return None
+        return '\n\n'.join(pages)
+
+    def apply(self, filename: str) -> TextDocument:
+        path = Path(filename)
+        return TextDocument(id=str(path), name=path.name, source=str(path.parent), text=self.extract(filename=filename))
+
+
 class TikaExtractor(Extractor):
     """Text extractors for pdfs using tika."""
 
     _nchar_log_text = 150
     _success_status = 200
+    _version = '1'  # Increase whenever the extraction logic changes such that cached extractions become invalid
 
     def __init__(self, environment: Environment, settings: dict):
         super().__init__(environment=environment, settings=settings)
         self._tika_url = self._environment.tika_url
+        tika_settings = settings['tika']
+        self._timeout = tika_settings['timeout']
+        self._semaphore = threading.BoundedSemaphore(tika_settings['max_concurrency'])
+
+        urls = [u.strip().rstrip('/') for u in (self._tika_url or '').split(',') if u.strip()]
+        self._pool = None
+        if urls:
+            self._pool = TikaEndpointPool(urls=urls, pool_size=tika_settings['pool_size'], timeout=self._timeout,
+                                          health_interval=tika_settings['health_interval'])
+
+        self._pdf_extractor = None
+        if tika_settings['local_pdf']:
+            if PdfExtractor.is_available():
+                self._pdf_extractor = PdfExtractor(environment=environment, settings=settings)
+            else:
+                logging.info('local pdf extraction is disabled as pypdf is not installed')
+
+        self._cache: ExtractionCache | None = get_extraction_cache(settings=settings)
+
+    @property
+    def cache(self) -> ExtractionCache | None:
+        return self._cache
+
+    @property
+    def version(self) -> str:
+        local_pdf = f'pypdf-{pypdf.__version__}' if self._pdf_extractor is not None else 'off'
+        return f'tika-{self._version}/local_pdf-{local_pdf}'
 
     def _get_log_text(self, text: str):
         text = re.sub('\n', ' ', text.strip())
         text = re.sub('\s{2,}', ' ', text)[:self._nchar_log_text]
         return text
 
-    def apply(self, filename: str) -> TextDocument:
-        """Extracting the text from pdfs."""
+    def _parse_file(self, filename: str) -> Tuple[str | None, dict]:
+        if self._pdf_extractor is not None and filename.lower().endswith('.pdf'):
+            if (text := self._pdf_extractor.extract(filename=filename)) is not None:
+                logging.info(f'extracted "{filename}" in-process')
+                return text, {'extractor': 'pypdf'}
+
+        with self._semaphore:
+            if self._pool is None:
+                parsed = parser.from_file(filename, self._tika_url)
+                return parsed['content'], parsed.get('metadata') or {}
+            with open(filename, 'rb') as bfile:
+                return self._pool.parse(content=bfile)
+
+    def _parse_buffer(self, content: bytes) -> Tuple[str | None, dict]:
+        with self._semaphore:
+            if self._pool is None:
+                parsed = parser.from_buffer(content, self._tika_url)
+                return parsed['content'], parsed.get('metadata') or {}
+            return self._pool.parse(content=content)
+
+    def _parse_cached(self, content_hash: str, parse: Callable[[], Tuple[str | None, dict]]) -> str | None:
+        """Look up the extraction in the cache, only parse (and store) it on a miss."""
+        if self._cache is None:
+            return parse()[0]
+
+        key = self._cache.get_key(content_hash=content_hash, extractor_version=self.version)
+        if (cached := self._cache.get_extraction(key=key)) is not None:
+            logging.info(f'extraction cache hit for content hash {content_hash}')
+            return cached[0]
+
+        text, metadata = parse()
+        if text:
+            self._cache.put_extraction(key=key, text=text, metadata=metadata)
+        return text
+
+    def _get(self, url: str) -> requests.Response:
+        if self._pool is None:
+            return requests.get(url, timeout=self._timeout)
+        return self._pool.session.get(url, timeout=self._timeout)
+
+    def apply(self, filename: str, content_hash: str | None = None) -> TextDocument:
+        """Extracting the text from pdfs (`content_hash` of local files is computed if not given)."""
 
         if Path(filename).is_file():
             logging.info(f'parsing local file "{filename}"')
-            parsed = parser.from_file(filename, self._tika_url)
-            text = parsed['content']
+            if content_hash is None:
+                content_hash = utl.get_file_hash(filename=filename)
+            text = self._parse_cached(content_hash=content_hash, parse=lambda: self._parse_file(filename=filename))
 
         elif validators.url(filename):
             logging.info(f'parsing url "{filename}"')
-            response = requests.get(filename)
+            response = self._get(filename)
 
             if not (status := response.status_code) == self._success_status:
                 logging.error(f'pdf request for url="{filename}" exited with status code {status}')
                 text = None
 
             else:
-                parsed = parser.from_buffer(response.content, self._tika_url)
-                text = parsed['content']
+                content = response.content
+                content_hash = sha256(content).hexdigest()
+                text = self._parse_cached(content_hash=content_hash, parse=lambda: self._parse_buffer(content=content))
 
         else:
             logging.error(f'unable to parse document "{filename}"')
@@ -64,4 +260,5 @@ class TikaExtractor(Extractor):
             # Clean newline characters
             logging.info(f'text (len={len(text)}): "{self._get_log_text(text=text)}..."')
         filename = Path(filename)
-        return TextDocument(id=str(filename), name=filename.name, source=str(filename.parent), text=text)
+        return TextDocument(id=str(filename), name=filename.name, source=str(filename.parent), text=text,
+                            content_hash=content_hash)
@@ -0,0 +1,389 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, Iterator, List, Set
+
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+try:
+    import hnswlib
+except ImportError:  # pragma: no cover
+    hnswlib = None
+
+from askyourdocs import EmbeddingEntity
+from askyourdocs.storage.client import SolrClient
+
+
+class _ReadWriteLock:
+    """Shared or exclusive access to an index for the threads and processes (with `fcntl`)."""
+
+    def __init__(self, lock_file):
+        self._lock_file = lock_file
+        self._cond = threading.Condition()
+        self._nreaders = 0
+        self._nwriters_waiting = 0
+        self._writing = False
+
+    def _flock(self, operation: str):
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, getattr(fcntl, operation))
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._cond:
+            # Waiting writers go first, such that a stream of searches does not starve them
+            self._cond.wait_for(lambda: not self._writing and not self._nwriters_waiting)
+            if self._nreaders == 0:
+                self._flock('LOCK_SH')
+            self._nreaders += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._nreaders -= 1
+                if self._nreaders == 0:
+                    self._flock('LOCK_UN')
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._cond:
+            self._nwriters_waiting += 1
+            self._cond.wait_for(lambda: not self._writing and not self._nreaders)
+            self._nwriters_waiting -= 1
+            self._writing = True
+        try:
+            self._flock('LOCK_EX')
+            try:
+                yield
+            finally:
+                self._flock('LOCK_UN')
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class LocalVectorIndex:
+    """In-process kNN index of the embeddings in a memory-mapped float32 matrix, shared by processes."""
+
+    _matrix_filename = 'vectors.f32'
+    _meta_filename = 'meta.json'
+    _journal_filename = 'journal.jsonl'
+    _lock_filename = 'lock'
+    _ann_filename = 'hnsw.bin'
+    _dtype = np.float32
+    _meta_fields = ('id', 'doc_id', 'txt_ent_id', 'passage_id', 'index')
+
+    def __init__(self, path: str | Path, dimension: int, capacity: int = 1024, ann: bool = False,
+                 ann_ef_construction: int = 200, ann_m: int = 16, ann_ef: int = 64):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._dimension = dimension
+        self._lock_file = open(self._path / self._lock_filename, 'a')
+        self._lock = _ReadWriteLock(lock_file=self._lock_file)
+
+        self._ids: List[str | None] = []
+        self._meta: List[dict | None] = []
+        self._rows: Dict[str, int] = {}
+        self._free: Set[int] = set()
+        self._generation: int | None = None
+        self._journal_offset = 0
+        self._journal_key: tuple | None = None
+
+        self._capacity = capacity
+        self._matrix = self._open_matrix(capacity=self._capacity)
+
+        self._ann = None
+        self._ann_enabled = ann and hnswlib is not None
+        if ann and hnswlib is None:
+            logging.info('approximate vector search is disabled as hnswlib is not installed')
+        elif ann:
+            self._ann_params = {'ef_construction': ann_ef_construction, 'M': ann_m}
+            self._ann_ef = ann_ef
+
+        with self._locked():
+            if not (self._path / self._journal_filename).exists():
+                self._load_snapshot()
+                self._reset_journal(generation=self._generation)
+            self._sync()
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> 'LocalVectorIndex':
+        local = settings['retrieval']['local']
+        path = Path(settings['paths']['cache']) / local['dirname']
+        return cls(path=path, dimension=settings['modelling']['embedding_dimension'], capacity=local['capacity'],
+                   ann=local['ann'], ann_ef_construction=local['ann_ef_construction'], ann_m=local['ann_m'],
+                   ann_ef=local['ann_ef'])
+
+    def __repr__(self):
+        return f'{type(self).__name__}(path={str(self._path)!r}, dimension={self._dimension}, nvectors={len(self)})'
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def nrows(self) -> int:
+        return len(self._ids)
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True) -> Iterator[None]:
+        """Lock the index for the threads of this process and (with `fcntl`) for other processes."""
+        with (self._lock.exclusive() if exclusive else self._lock.shared()):
+            yield
+
+    def _open_matrix(self, capacity: int) -> np.memmap:
+        filename = self._path / self._matrix_filename
+        nbytes = capacity * self._dimension * np.dtype(self._dtype).itemsize
+        with open(filename, 'ab') as bfile:
+            if bfile.tell() < nbytes:
+                bfile.truncate(nbytes)
+            # The matrix may have been grown by another process
+            capacity = max(capacity, bfile.tell() // (self._dimension * np.dtype(self._dtype).itemsize))
+        self._capacity = capacity
+        return np.memmap(filename, dtype=self._dtype, mode='r+', shape=(capacity, self._dimension))
+
+    def _grow(self, nrows: int):
+        if nrows <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < nrows:
+            capacity *= 2
+        self._matrix.flush()
+        del self._matrix
+        self._matrix = self._open_matrix(capacity=capacity)
+        if self._ann is not None:
+            self._ann.resize_index(self._capacity)
+
+    def _open_ann(self):
+        index = hnswlib.Index(space='ip', dim=self._dimension)
+        ann_path = self._path / self._ann_filename
+        if ann_path.exists():
+            index.load_index(str(ann_path), max_elements=self._capacity, allow_replace_deleted=True)
+        else:
+            index.init_index(max_elements=self._capacity, allow_replace_deleted=True, **self._ann_params)
+            if rows := sorted(self._rows.values()):
+                logging.info(f'build hnsw index of {len(rows)} vectors')
+                index.add_items(np.asarray(self._matrix[rows]), np.asarray(rows))
+        index.set_ef(self._ann_ef)
+        return index
+
+    def _load_snapshot(self):
+        """(Re)load the metadata snapshot written by the last `save` of any process."""
+        meta_path = self._path / self._meta_filename
+        data = {}
+        if meta_path.exists():
+            with open(meta_path) as mfile:
+                data = json.load(mfile)
+        self._ids, self._meta = data.get('ids', []), data.get('meta', [])
+        self._generation = data.get('generation', 0)
+        self._rows = {id_: i for i, id_ in enumerate(self._ids) if id_ is not None}
+        self._free = {i for i, id_ in enumerate(self._ids) if id_ is None}
+        self._grow(nrows=len(self._ids))
+        if self._ann_enabled:
+            self._ann = self._open_ann()
+
+    def _reset_journal(self, generation: int):
+        """Start an empty journal of the given snapshot generation."""
+        journal_path = self._path / self._journal_filename
+        tmp_path = journal_path.with_suffix('.tmp')
+        header = json.dumps({'generation': generation}).encode() + b'\n'
+        with open(tmp_path, 'wb') as jfile:
+            jfile.write(header)
+        os.replace(tmp_path, journal_path)
+        self._generation = generation
+        self._journal_offset = len(header)
+        self._journal_key = self._get_journal_key()
+
+    def _get_journal_key(self) -> tuple:
+        stat = os.stat(self._path / self._journal_filename)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _sync(self):
+        """Apply the changes of other processes: reload the snapshot if it was compacted, then replay the journal."""
+        if (key := self._get_journal_key()) == self._journal_key:
+            return
+        with open(self._path / self._journal_filename, 'rb') as jfile:
+            header = jfile.readline()
+            generation = json.loads(header)['generation']
+            if generation != self._generation:
+                self._load_snapshot()
+                self._generation, self._journal_offset = generation, len(header)
+            jfile.seek(self._journal_offset)
+            data = jfile.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            self._apply(json.loads(line))
+        self._journal_offset += end
+        self._journal_key = key
+
+    def _append(self, entry: dict):
+        with open(self._path / self._journal_filename, 'ab') as jfile:
+            line = json.dumps(entry).encode() + b'\n'
+            jfile.write(line)
+        self._journal_offset += len(line)
+        self._journal_key = self._get_journal_key()
+
+    def _clear_row(self, row: int):
+        if (id_ := self._ids[row]) is not None and self._rows.get(id_) == row:
+            del self._rows[id_]
+        self._ids[row] = None
+        self._meta[row] = None
+        self._free.add(row)
+
+    def _apply(self, entry: dict):
+        """Apply a journal entry of another process (the matrix is already written through the memory map)."""
+        rows = [r for r, _, _ in entry['rows']] if entry['op'] == 'add' else entry['rows']
+        while len(self._ids) <= max(rows, default=-1):
+            self._free.add(len(self._ids))
+            self._ids.append(None)
+            self._meta.append(None)
+        self._grow(nrows=len(self._ids))
+
+        if entry['op'] == 'add':
+            for row, id_, meta in entry['rows']:
+                if (previous := self._rows.get(id_)) is not None and previous != row:
+                    self._clear_row(previous)
+                self._clear_row(row)
+                self._ids[row], self._meta[row], self._rows[id_] = id_, meta, row
+                self._free.discard(row)
+            if self._ann is not None and rows:
+                self._ann.add_items(np.asarray(self._matrix[rows]), np.asarray(rows), replace_deleted=True)
+        else:
+            for row in rows:
+                if self._ids[row] is not None:
+                    self._clear_row(row)
+                    if self._ann is not None:
+                        self._ann.mark_deleted(row)
+
+    def add(self, entities: Iterable[EmbeddingEntity]):
+        """Add (or replace) embeddings, rows are assigned by text entity id (or embedding id if there is none)."""
+        entities = list(entities)
+        if not entities:
+            return
+        with self._locked():
+            self._sync()
+            rows = []
+            for entity in entities:
+                key = entity.txt_ent_id or entity.id
+                if (row := self._rows.get(key)) is None:
+                    row = self._free.pop() if self._free else len(self._ids)
+                    if row == len(self._ids):
+                        self._ids.append(None)
+                        self._meta.append(None)
+                self._ids[row] = key
+                self._meta[row] = {f: getattr(entity, f) for f in self._meta_fields}
+                self._rows[key] = row
+                rows.append(row)
+
+            self._grow(nrows=len(self._ids))
+            vectors = np.stack([e.vector for e in entities]).astype(self._dtype, copy=False)
+            self._matrix[rows] = vectors
+            if self._ann is not None:
+                self._ann.add_items(vectors, np.asarray(rows), replace_deleted=True)
+            self._append({'op': 'add', 'rows': [[r, self._ids[r], self._meta[r]] for r in rows]})
+
+    def remove(self, doc_id: str) -> int:
+        """Remove all embeddings of a document and return their number."""
+        with self._locked():
+            self._sync()
+            rows = [r for r in self._rows.values() if self._meta[r]['doc_id'] == doc_id]
+            for row in rows:
+                self._clear_row(row)
+                self._matrix[row] = 0
+                if self._ann is not None:
+                    self._ann.mark_deleted(row)
+            if rows:
+                self._append({'op': 'remove', 'rows': rows})
+        logging.info(f'removed {len(rows)} vectors of {doc_id} from {self}')
+        return len(rows)
+
+    def _search_exact(self, queries: np.ndarray, top_k: int) -> List[List[tuple]]:
+        nrows = self.nrows
+        scores = queries @ np.asarray(self._matrix[:nrows]).T
+        if self._free:
+            scores[:, sorted(self._free)] = -np.inf
+        k = min(top_k, len(self._rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        return [list(zip(r.tolist(), s.tolist())) for r, s in zip(top, top_scores)]
+
+    def _search_ann(self, queries: np.ndarray, top_k: int) -> List[List[tuple]]:
+        k = min(top_k, len(self._rows))
+        labels, distances = self._ann.knn_query(queries, k=k)
+        # hnswlib's inner product distance is 1 - dot
+        return [list(zip(r.tolist(), (1 - d).tolist())) for r, d in zip(labels, distances)]
+
+    def search(self, queries: np.ndarray, top_k: int) -> List[List[dict]]:
+        """Return the `top_k` nearest embeddings (metadata with `id` and `score`, i.e. the dot product) per query."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=self._dtype))
+        if self._get_journal_key() != self._journal_key:
+            with self._locked():
+                self._sync()
+        # Concurrent searches share the lock, changes of other processes are picked up by the next search
+        with self._locked(exclusive=False):
+            if not self._rows:
+                return [[] for _ in queries]
+            if self._ann is not None:
+                hits = self._search_ann(queries=queries, top_k=top_k)
+            else:
+                hits = self._search_exact(queries=queries, top_k=top_k)
+            return [[{'id': self._ids[r], **self._meta[r], 'score': s} for r, s in query_hits]
+                    for query_hits in hits]
+
+    def save(self):
+        """Compact the journal into the metadata snapshot (and persist the HNSW graph), the matrix is flushed to disk."""
+        with self._locked():
+            self._sync()
+            self._matrix.flush()
+            generation = self._generation + 1
+            meta_path = self._path / self._meta_filename
+            tmp_path = meta_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as mfile:
+                json.dump({'generation': generation, 'ids': self._ids, 'meta': self._meta}, mfile)
+            os.replace(tmp_path, meta_path)
+            if self._ann is not None:
+                self._ann.save_index(str(self._path / self._ann_filename))
+            self._reset_journal(generation=generation)
+        logging.info(f'saved {self}')
+
+    def rebuild_from_solr(self, solr_client: SolrClient, collection: str, batch_size: int = 1000):
+        """Load all embeddings of a Solr collection (e.g. to initialize the index of an existing corpus)."""
+        fl = ','.join(('vector',) + self._meta_fields)
+        params = {'fl': fl, 'rows': batch_size, 'sort': 'id asc', 'cursorMark': '*'}
+        nvectors = 0
+        while True:
+            response = solr_client.search_raw(query='*:*', collection=collection, params=params)
+            docs = response['response']['docs']
+            self.add(EmbeddingEntity(vector=np.asarray(d['vector'], dtype=self._dtype),
+                                     **{f: d.get(f) for f in self._meta_fields}) for d in docs)
+            nvectors += len(docs)
+            if response['nextCursorMark'] == params['cursorMark']:
+                break
+            params['cursorMark'] = response['nextCursorMark']
+        self.save()
+        logging.info(f'loaded {nvectors} vectors from collection "{collection}" into {self}')
+
+
+_SHARED_INDEX: LocalVectorIndex | None = None
+_SHARED_INDEX_LOCK = threading.Lock()
+
+
+def get_vector_index(settings: dict) -> LocalVectorIndex | None:
+    """Return the (process-wide shared) local vector index if it is the configured retrieval backend."""
+    global _SHARED_INDEX
+    if settings['retrieval']['backend'] != 'local':
+        return None
+    with _SHARED_INDEX_LOCK:
+        if _SHARED_INDEX is None:
+            _SHARED_INDEX = LocalVectorIndex.from_settings(settings=settings)
+            logging.info(f'open {_SHARED_INDEX}')
+        return _SHARED_INDEX
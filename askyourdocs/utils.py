@@ -1,3 +1,4 @@
+from hashlib import sha256
 import logging
 import os
 from pathlib import Path
@@ -32,3 +33,17 @@ def load_environment() -> Environment:
     }
     return Environment(**kwargs)
 
+
+def get_file_hash(filename: str | Path, chunk_size: int = 1 << 20) -> str:
+    """Compute the sha256 hex digest of a file's content without loading the whole file into memory."""
+    hash_ = sha256()
+    with open(filename, 'rb') as bfile:
+        while chunk := bfile.read(chunk_size):
+            hash_.update(chunk)
+    return hash_.hexdigest()
+
+
+def get_manifest_path(source: str) -> Path:
+    """Default location of the ingestion manifest for a given source directory."""
+    key = sha256(str(Path(source).resolve()).encode()).hexdigest()[:16]
+    return SETTINGS['paths']['cache'] / 'manifests' / f'{key}.json'
@@ -0,0 +1,98 @@
+"""Benchmark of assisted generation (`SETTINGS['modelling']['assisted_generation']`).
+
+Answers the same questions with the summarizer once without and once with the draft model and reports the generated
+tokens per second, the speedup, and whether the (greedy) answers are identical. Every configuration runs in a separate
+process, such that the second one does not profit from the memory and caches warmed up by the first one.
+
+    python -m benchmarks.bench_assisted
+    python -m benchmarks.bench_assisted --draft_model google/flan-t5-small --num_assistant_tokens 8 --repeats 5
+"""
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from askyourdocs.settings import SETTINGS
+from benchmarks.bench_inference import _SAMPLES
+
+
+_CONFIGS = ('plain', 'assisted')
+
+
+def _worker(config: str, model: str, draft_model: str, num_assistant_tokens: int, backend: str, repeats: int,
+            out: str):
+    from transformers import AutoTokenizer
+    from askyourdocs.modelling.llm import Summarizer
+
+    settings = copy.deepcopy(SETTINGS)
+    settings['modelling']['model_name'] = model
+    settings['modelling']['inference']['summarizer'] = backend
+    settings['modelling']['assisted_generation'].update(enabled=config == 'assisted', draft_model_name=draft_model,
+                                                        num_assistant_tokens=num_assistant_tokens)
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    summarizer = Summarizer(settings=settings)
+    summarizer.get_answer(query=_SAMPLES[0][0], context=_SAMPLES[0][1])  # warm-up
+
+    seconds, tokens = 0.0, 0
+    for _ in range(repeats):
+        answers = []
+        for query, context in _SAMPLES:
+            start = time.perf_counter()
+            answers.append(summarizer.get_answer(query=query, context=context))
+            seconds += time.perf_counter() - start
+            # including the eos token
+            tokens += len(tokenizer(answers[-1], add_special_tokens=False)['input_ids']) + 1
+
+    with open(out, 'w') as rfile:
+        json.dump({'answers': answers, 'seconds': seconds, 'tokens': tokens}, rfile)
+
+
+def main():
+    assisted = SETTINGS['modelling']['assisted_generation']
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=SETTINGS['modelling']['model_name'])
+    parser.add_argument('--draft_model', default=assisted['draft_model_name'])
+    parser.add_argument('--num_assistant_tokens', type=int, default=assisted['num_assistant_tokens'])
+    parser.add_argument('--backend', default=SETTINGS['modelling']['inference']['summarizer'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--worker', choices=_CONFIGS, help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(config=args.worker, model=args.model, draft_model=args.draft_model,
+                num_assistant_tokens=args.num_assistant_tokens, backend=args.backend, repeats=args.repeats,
+                out=args.out)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for config in _CONFIGS:
+            out = os.path.join(tmpdir, f'{config}.json')
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_assisted', '--model', args.model,
+                            '--draft_model', args.draft_model, '--num_assistant_tokens', str(args.num_assistant_tokens),
+                            '--backend', args.backend, '--repeats', str(args.repeats), '--worker', config,
+                            '--out', out], check=True)
+            with open(out) as rfile:
+                results[config] = json.load(rfile)
+
+    for config, result in results.items():
+        name = f'{args.model} ({args.backend})'
+        if config == 'assisted':
+            name += f' assisted by {args.draft_model} ({args.num_assistant_tokens} tokens)'
+        print(f'{name}:')
+        print(f'  {result["tokens"] / result["seconds"]:7.1f} tokens/s '
+              f'({result["tokens"]} tokens in {result["seconds"]:.1f}s)')
+
+    plain, assisted = results['plain'], results['assisted']
+    identical = sum(a == b for a, b in zip(plain['answers'], assisted['answers']))
+    print(f'speedup: {plain["seconds"] / assisted["seconds"]:.2f}x, '
+          f'identical answers: {identical}/{len(plain["answers"])}')
+
+
+if __name__ == '__main__':
+    main()
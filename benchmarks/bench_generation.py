@@ -0,0 +1,90 @@
+"""Benchmark of the generation of answers for concurrent questions.
+
+Runs `--nrequests` questions from `--concurrency` threads (as the workers of the query executor do) once with every
+thread calling `Summarizer.get_answer` on its own, and once through a `GenerationBatcher`, and reports the throughput,
+the latencies, the batch sizes, and the fraction of answers that are identical in both runs.
+
+    python -m benchmarks.bench_generation --concurrency 4 --nrequests 32
+    python -m benchmarks.bench_generation --model google/flan-t5-small --max_batch_size 8 --concurrency 8
+    python -m benchmarks.bench_generation --concurrency 4 --torch_threads 2   # as with `cpus // nworkers`
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import time
+
+import numpy as np
+
+from askyourdocs.settings import SETTINGS
+from askyourdocs.modelling.batching import GenerationBatcher
+from askyourdocs.modelling.llm import Summarizer, set_torch_threads
+from askyourdocs.pipeline.executor import get_torch_threads
+
+
+_CONTEXT = ('Aspirin is used to reduce fever and relieve mild to moderate pain from conditions such as muscle aches, '
+            'toothaches, common cold, and headaches. It may also be used to reduce pain and swelling in conditions '
+            'such as arthritis. Aspirin is known as a salicylate and a nonsteroidal anti-inflammatory drug. It works '
+            'by blocking a certain natural substance in your body to reduce pain and swelling. Consult your doctor '
+            'before treating a child younger than 12 years. Do not take more than 4 grams per day. ')
+_QUESTIONS = ['What is aspirin used for?', 'How does aspirin work?', 'Can children take aspirin?',
+              'What is the maximal daily dose?', 'Which class of drugs does aspirin belong to?',
+              'Does aspirin help against swelling?', 'Is aspirin a salicylate?', 'When should I consult a doctor?']
+
+
+def _requests(nrequests: int) -> list:
+    return [(_QUESTIONS[i % len(_QUESTIONS)], _CONTEXT * (1 + i % 3)) for i in range(nrequests)]
+
+
+def _run(get_answer, requests: list, concurrency: int) -> tuple:
+    latencies = []
+
+    def _answer(request):
+        start = time.perf_counter()
+        answer = get_answer(query=request[0], context=request[1])
+        latencies.append(time.perf_counter() - start)
+        return answer
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        answers = list(executor.map(_answer, requests))
+    seconds = time.perf_counter() - start
+    ms = np.asarray(latencies) * 1e3
+    print(f'  {len(requests) / seconds:6.2f} answers/s, latency p50={np.percentile(ms, 50):7.0f} ms, '
+          f'p95={np.percentile(ms, 95):7.0f} ms')
+    return answers, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=SETTINGS['modelling']['model_name'])
+    parser.add_argument('--nrequests', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max_batch_size', type=int, default=SETTINGS['modelling']['generation_batching']['max_batch_size'])
+    parser.add_argument('--max_wait_ms', type=float, default=SETTINGS['modelling']['generation_batching']['max_wait_ms'])
+    parser.add_argument('--torch_threads', type=int, help='torch intra-op threads (default: as the backend with batching)')
+    args = parser.parse_args()
+    set_torch_threads(get_torch_threads(nworkers=args.concurrency, torch_threads=args.torch_threads, batching=True,
+                                        streaming=SETTINGS['query']['streaming']['enabled']))
+
+    settings = copy.deepcopy(SETTINGS)
+    settings['modelling']['model_name'] = args.model
+    summarizer = Summarizer(settings=settings)
+    requests = _requests(nrequests=args.nrequests)
+    summarizer.get_answer(query=requests[0][0], context=requests[0][1])  # warm-up
+
+    print(f'one at a time ({args.concurrency} threads):')
+    single, single_seconds = _run(summarizer.get_answer, requests=requests, concurrency=args.concurrency)
+
+    print(f'batched (max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms}, {args.concurrency} threads):')
+    batcher = GenerationBatcher(summarizer=summarizer, max_batch_size=args.max_batch_size,
+                                max_wait=args.max_wait_ms / 1000)
+    batched, batched_seconds = _run(batcher.get_answer, requests=requests, concurrency=args.concurrency)
+    batcher.close()
+
+    print(f'  {batcher.stats.nbatches} batches, mean size {batcher.stats.mean_batch_size:.1f}')
+    print(f'speedup: {single_seconds / batched_seconds:.2f}x, '
+          f'identical answers: {np.mean([a == b for a, b in zip(single, batched)]):.2f}')
+
+
+if __name__ == '__main__':
+    main()
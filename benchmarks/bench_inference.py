@@ -0,0 +1,164 @@
+"""Comparison of the inference backends (`SETTINGS['modelling']['inference']`) against the fp32 models.
+
+Every backend is loaded in a separate process, such that its resident memory is measured in isolation. For the
+summarizer, the answers of all backends are compared with the fp32 answers (exact match and token F1); for the
+embedder, the embeddings are compared with the fp32 embeddings (cosine similarity) as well as the nearest context of
+every question (retrieval agreement).
+
+    python -m benchmarks.bench_inference --component summarizer --backends fp32 int8 onnx
+    python -m benchmarks.bench_inference --component embedder --backends fp32 int8
+"""
+import argparse
+from collections import Counter
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from askyourdocs.settings import SETTINGS
+
+
+_SAMPLES = [
+    ('What is aspirin used for?',
+     'Aspirin is used to reduce fever and relieve mild to moderate pain from conditions such as muscle aches, '
+     'toothaches, common cold, and headaches. It may also be used to reduce pain and swelling in arthritis.'),
+    ('How should the tablets be stored?',
+     'Store the tablets at room temperature between 20 and 25 degrees Celsius in the original package in order to '
+     'protect them from light and moisture. Keep out of reach of children.'),
+    ('What are common side effects?',
+     'The most common side effects are nausea, headache, dizziness and diarrhea. Contact your doctor if you notice '
+     'a rash, swelling of the face or difficulty breathing, as these may be signs of an allergic reaction.'),
+    ('Can the medicine be taken during pregnancy?',
+     'There are no adequate studies in pregnant women. The medicine should only be used during pregnancy if the '
+     'potential benefit justifies the potential risk to the fetus. Breastfeeding should be discontinued.'),
+    ('What is the recommended dose for adults?',
+     'The recommended dose for adults is 500 mg twice daily with food. The maximal daily dose of 2000 mg must not be '
+     'exceeded. Patients with impaired renal function should receive half of the dose.'),
+    ('Which batch numbers are affected by the recall?',
+     'The recall affects the batch numbers AB1234 and AB1240 that were distributed between March and May. Other '
+     'batches are not affected and can still be dispensed to patients.'),
+]
+
+
+def _rss_mb() -> float:
+    """Resident memory of the current process."""
+    try:
+        with open('/proc/self/status') as sfile:
+            for line in sfile:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker(component: str, backend: str, model: str, repeats: int, out: str):
+    settings = copy.deepcopy(SETTINGS)
+    settings['modelling']['model_name'] = model
+    settings['modelling']['inference'][component] = backend
+    rss_start = _rss_mb()
+    start = time.perf_counter()
+
+    result = {'backend': backend}
+    if component == 'summarizer':
+        from askyourdocs.modelling.llm import Summarizer
+        summarizer = Summarizer(settings=settings)
+        result['load_seconds'] = time.perf_counter() - start
+        summarizer.get_answer(query=_SAMPLES[0][0], context=_SAMPLES[0][1])  # warm-up
+
+        latencies = []
+        for _ in range(repeats):
+            answers = []
+            for query, context in _SAMPLES:
+                start = time.perf_counter()
+                answers.append(summarizer.get_answer(query=query, context=context))
+                latencies.append(time.perf_counter() - start)
+        result['outputs'] = answers
+
+    else:
+        from askyourdocs.modelling.llm import TextEmbedder
+        embedder = TextEmbedder(model_name=model, cache_folder=settings['paths']['models'], backend=backend)
+        result['load_seconds'] = time.perf_counter() - start
+        texts = [q for q, _ in _SAMPLES] + [c for _, c in _SAMPLES]
+        embedder.apply(texts=texts[:1])  # warm-up
+
+        latencies = []
+        for _ in range(repeats):
+            for text in texts:
+                start = time.perf_counter()
+                embedder.apply(texts=[text])
+                latencies.append(time.perf_counter() - start)
+        result['outputs'] = embedder.apply(texts=texts).tolist()
+
+    result['rss_mb'] = _rss_mb() - rss_start
+    result['latency_ms'] = float(np.median(latencies) * 1e3)
+    with open(out, 'w') as rfile:
+        json.dump(result, rfile)
+
+
+def _token_f1(a: str, b: str) -> float:
+    ta, tb = a.lower().split(), b.lower().split()
+    common = sum((Counter(ta) & Counter(tb)).values())
+    if not ta or not tb or not common:
+        return float(ta == tb)
+    precision, recall = common / len(ta), common / len(tb)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _accuracy(component: str, outputs, reference) -> str:
+    if component == 'summarizer':
+        exact = np.mean([a == r for a, r in zip(outputs, reference)])
+        f1 = np.mean([_token_f1(a, r) for a, r in zip(outputs, reference)])
+        return f'exact={exact:.2f}, token_f1={f1:.2f}'
+
+    vectors, ref_vectors = np.asarray(outputs), np.asarray(reference)
+    cosine = np.sum(vectors * ref_vectors, axis=1) / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(ref_vectors, axis=1))
+    n = len(_SAMPLES)
+    nearest = np.argmax(vectors[:n] @ vectors[n:].T, axis=1)
+    ref_nearest = np.argmax(ref_vectors[:n] @ ref_vectors[n:].T, axis=1)
+    return (f'cosine min={cosine.min():.4f} mean={cosine.mean():.4f}, '
+            f'retrieval agreement={np.mean(nearest == ref_nearest):.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--component', choices=['summarizer', 'embedder'], default='summarizer')
+    parser.add_argument('--backends', nargs='+', default=['fp32', 'int8'])
+    parser.add_argument('--model', default=SETTINGS['modelling']['model_name'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(component=args.component, backend=args.worker, model=args.model, repeats=args.repeats, out=args.out)
+        return
+
+    backends = ['fp32'] + [b for b in args.backends if b != 'fp32']
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for backend in backends:
+            out = os.path.join(tmpdir, f'{backend}.json')
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_inference', '--component', args.component,
+                            '--model', args.model, '--repeats', str(args.repeats), '--worker', backend, '--out', out],
+                           check=True)
+            with open(out) as rfile:
+                results[backend] = json.load(rfile)
+
+    reference = results['fp32']
+    print(f'{args.component} {args.model}:')
+    for backend, result in results.items():
+        print(f'  {backend:5s} load={result["load_seconds"]:6.1f}s, rss=+{result["rss_mb"]:7.0f} MB, '
+              f'latency p50={result["latency_ms"]:8.1f} ms '
+              f'({reference["latency_ms"] / result["latency_ms"]:.2f}x), '
+              f'{_accuracy(args.component, result["outputs"], reference["outputs"])}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark of the kNN retrieval backends.
+
+Synthetic mode (default) measures the in-process `LocalVectorIndex` (exact and, if hnswlib is installed, approximate)
+on random unit vectors. With `--solr`, the embeddings of the vecs collection are loaded into a local index and the same
+queries (perturbed stored vectors) are run against both the Solr kNN query (as sent by `QueryPipeline`) and the local
+index, reporting latencies and the overlap of the top-k results.
+
+    python -m benchmarks.bench_retrieval --nvectors 100000 --dim 1024
+    python -m benchmarks.bench_retrieval --solr --nqueries 100
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from askyourdocs import EmbeddingEntity
+from askyourdocs.settings import SETTINGS
+from askyourdocs.storage.vectors import LocalVectorIndex, hnswlib
+from askyourdocs import utils as utl
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _percentiles(times: list) -> str:
+    ms = np.asarray(times) * 1e3
+    return f'p50={np.percentile(ms, 50):7.2f} ms, p95={np.percentile(ms, 95):7.2f} ms'
+
+
+def _bench_local(index: LocalVectorIndex, queries: np.ndarray, top_k: int, batch_size: int) -> list:
+    times, hits = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits.append(index.search(queries=q, top_k=top_k)[0])
+        times.append(time.perf_counter() - start)
+    print(f'  single query:  {_percentiles(times)}')
+
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        index.search(queries=queries[i:i + batch_size], top_k=top_k)
+    seconds = time.perf_counter() - start
+    print(f'  batches of {batch_size}: {len(queries) / seconds:9.1f} queries/s')
+    return [[h['id'] for h in query_hits] for query_hits in hits]
+
+
+def _synthetic(args):
+    rng = np.random.default_rng(0)
+    vectors = _unit(rng.standard_normal((args.nvectors, args.dim)))
+    queries = _unit(vectors[rng.integers(0, args.nvectors, args.nqueries)] + 0.1 * rng.standard_normal((args.nqueries, args.dim)))
+
+    results = {}
+    for ann in [False, True] if hnswlib is not None else [False]:
+        with tempfile.TemporaryDirectory() as path:
+            start = time.perf_counter()
+            index = LocalVectorIndex(path=path, dimension=args.dim, capacity=args.nvectors, ann=ann)
+            index.add(EmbeddingEntity(id=f'emb_ent_{i}', vector=v, doc_id=f'doc_{i // 100}') for i, v in enumerate(vectors))
+            print(f'local {"ann" if ann else "exact"}: added {len(index)} vectors in {time.perf_counter() - start:.2f}s')
+            results[ann] = _bench_local(index=index, queries=queries, top_k=args.top_k, batch_size=args.batch_size)
+
+    if True in results:
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(results[True], results[False])])
+        print(f'ann recall@{args.top_k} w.r.t. exact search: {recall:.3f}')
+
+
+def _solr(args):
+    environment = utl.load_environment()
+    from askyourdocs.storage.client import SolrClient
+    solr_client = SolrClient(environment=environment, settings=SETTINGS)
+    collection = SETTINGS['solr']['collections']['map']['vecs']
+
+    with tempfile.TemporaryDirectory() as path:
+        index = LocalVectorIndex(path=path, dimension=SETTINGS['modelling']['embedding_dimension'])
+        start = time.perf_counter()
+        index.rebuild_from_solr(solr_client=solr_client, collection=collection)
+        print(f'loaded {len(index)} vectors from "{collection}" in {time.perf_counter() - start:.2f}s')
+
+        rng = np.random.default_rng(0)
+        rows = rng.choice(index.nrows, size=min(args.nqueries, len(index)), replace=False)
+        stored = np.asarray(index._matrix[rows])
+        queries = _unit(stored + 0.1 * rng.standard_normal(stored.shape))
+
+        times, solr_ids = [], []
+        for q in queries:
+            start = time.perf_counter()
+            docs = solr_client.knn_search(vector=q, collection=collection, top_k=args.top_k)
+            times.append(time.perf_counter() - start)
+            solr_ids.append([d['id'] for d in docs])
+        print(f'solr knn:\n  single query:  {_percentiles(times)}')
+
+        print('local exact:')
+        local_ids = _bench_local(index=index, queries=queries, top_k=args.top_k, batch_size=args.batch_size)
+        overlap = np.mean([len(set(s) & set(l)) / max(len(s), 1) for s, l in zip(solr_ids, local_ids)])
+        print(f'top-{args.top_k} overlap of solr and local results: {overlap:.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--solr', action='store_true', help='Compare with the Solr kNN query on the vecs collection')
+    parser.add_argument('--nvectors', type=int, default=50_000)
+    parser.add_argument('--dim', type=int, default=SETTINGS['modelling']['embedding_dimension'])
+    parser.add_argument('--nqueries', type=int, default=200)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--top_k', type=int, default=SETTINGS['solr']['top_k'])
+    args = parser.parse_args()
+
+    if args.solr:
+        if not os.getenv('SOLR_URL'):
+            parser.error('--solr requires SOLR_URL to be set')
+        _solr(args)
+    else:
+        _synthetic(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Micro-benchmark of the serialization of embedding entities for solr.
+
+Compares the former path (vectors converted to lists of np.float32, normalized a second time, and written as JSON
+strings) with the current one (contiguous float32 arrays written as JSON numbers by `dumps_documents`).
+
+    python -m benchmarks.bench_serialization --nvectors 1000 --dim 1024
+"""
+import argparse
+from dataclasses import asdict
+import json
+import time
+
+import numpy as np
+
+from askyourdocs import EmbeddingEntity, dumps_documents
+
+
+class _LegacyEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, EmbeddingEntity):
+            return asdict(obj)
+        if isinstance(obj, np.float32):
+            return str(obj)
+        return super().default(obj)
+
+
+def _legacy_entities(vectors: np.ndarray) -> list:
+    entities = []
+    for i, v in enumerate(vectors):
+        entity = EmbeddingEntity(id=f'text {i}', vector=v, doc_id='doc_0', txt_ent_id=f'txt_ent_{i}')
+        vector = np.array(v)
+        entity.vector = list(vector / np.linalg.norm(vector))
+        entities.append(entity)
+    return entities
+
+
+def _legacy_path(vectors: np.ndarray) -> bytes:
+    return json.dumps(_legacy_entities(vectors), cls=_LegacyEncoder).encode()
+
+
+def _current_path(vectors: np.ndarray) -> bytes:
+    entities = [EmbeddingEntity(id=f'text {i}', vector=v, doc_id='doc_0', txt_ent_id=f'txt_ent_{i}')
+                for i, v in enumerate(vectors)]
+    return dumps_documents(documents=entities)
+
+
+def _measure(func, vectors: np.ndarray, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = func(vectors)
+        times.append(time.perf_counter() - start)
+    return len(data), min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nvectors', type=int, default=1000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.nvectors, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    per_1k = 1000 / args.nvectors
+    for name, func in [('legacy', _legacy_path), ('current', _current_path)]:
+        nbytes, seconds = _measure(func, vectors=vectors, repeat=args.repeat)
+        print(f'{name:>8}: {nbytes * per_1k / 1e6:8.2f} MB and {seconds * per_1k * 1e3:8.1f} ms per 1k vectors')
+
+
+if __name__ == '__main__':
+    main()
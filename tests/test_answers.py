@@ -0,0 +1,84 @@
+import numpy as np
+
+from askyourdocs.pipeline.answers import AnswerCache, CorpusVersion, get_context_fingerprint
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def get_cache() -> AnswerCache:
+    cache = AnswerCache(max_entries=2, ttl=3600.0, similarity_threshold=0.95)
+    cache.put(question='What is the dose?', vector=unit(1, 0), fingerprint=get_context_fingerprint('context'),
+              doc_ids=['doc_a'], result={'answer': 'one tablet'})
+    return cache
+
+
+def test_answer_cache_serves_normalized_exact_questions():
+    cache = get_cache()
+    assert cache.get(question='  what is the DOSE ') == {'answer': 'one tablet'}
+    assert cache.get(question='What is the price?') is None
+    assert cache.stats.exact == 1
+
+
+def test_answer_cache_serves_similar_questions_only_for_the_same_context():
+    cache = get_cache()
+    fingerprint = get_context_fingerprint('context')
+    assert cache.get(question='Which dose?', vector=unit(1, 0.1), fingerprint=fingerprint) == {'answer': 'one tablet'}
+    assert cache.get(question='Which dose?', vector=unit(1, 0.1), fingerprint=get_context_fingerprint('other')) is None
+    assert cache.get(question='Which dose?', vector=unit(0, 1), fingerprint=fingerprint) is None
+    assert cache.stats.similar == 1
+
+
+def test_answer_cache_drops_entries_of_changed_documents():
+    cache = get_cache()
+    cache.invalidate(doc_ids=['doc_a'])
+    assert len(cache) == 0
+    assert cache.get(question='What is the dose?', fingerprint=get_context_fingerprint('context')) is None
+
+
+def test_answer_cache_revalidates_entries_of_earlier_versions():
+    cache = get_cache()
+    cache.invalidate(doc_ids=['doc_b'])
+    assert len(cache) == 1
+    assert cache.get(question='What is the dose?') is None
+    assert cache.get(question='What is the dose?', fingerprint=get_context_fingerprint('changed')) is None
+    assert cache.get(question='What is the dose?', fingerprint=get_context_fingerprint('context')) is not None
+    assert cache.stats.revalidated == 1
+    # Revalidated entries belong to the current version again
+    assert cache.get(question='What is the dose?') is not None
+
+
+def test_answer_cache_evicts_least_recently_used_entries():
+    cache = get_cache()
+    cache.put(question='b', vector=unit(0, 1), fingerprint='f', doc_ids=[], result={})
+    cache.get(question='What is the dose?')
+    cache.put(question='c', vector=unit(1, 1), fingerprint='f', doc_ids=[], result={})
+    assert cache.get(question='b') is None
+    assert cache.get(question='What is the dose?') is not None
+    assert cache.stats.evicted == 1
+
+
+def test_answer_cache_serves_the_most_similar_question_with_the_same_context():
+    cache = get_cache()
+    cache.put(question='Which dose for children?', vector=unit(1, 0.05), fingerprint=get_context_fingerprint('other'),
+              doc_ids=['doc_a'], result={'answer': 'half a tablet'})
+    # The closest question was answered from another context
+    assert cache.get(question='Which dose?', vector=unit(1, 0.05), fingerprint=get_context_fingerprint('context')) == \
+        {'answer': 'one tablet'}
+
+
+def test_answer_cache_revalidates_entries_after_changes_of_other_processes(tmp_path):
+    cache = AnswerCache(corpus_version=CorpusVersion(path=tmp_path / 'version.json'))
+    cache.put(question='What is the dose?', vector=unit(1, 0), fingerprint=get_context_fingerprint('context'),
+              doc_ids=['doc_a'], result={'answer': 'one tablet'})
+    # E.g. an ingestion from the cli, which becomes visible later
+    other = CorpusVersion(path=tmp_path / 'version.json')
+    other.bump(delay=3600.0)
+    assert cache.get(question='What is the dose?') is None
+    assert cache.get(question='What is the dose?', fingerprint=get_context_fingerprint('context')) is not None
+    assert cache.get(question='What is the dose?') is not None
+
+    other.bump()
+    assert cache.get(question='What is the dose?') is None
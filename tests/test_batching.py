@@ -0,0 +1,56 @@
+from typing import List
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+
+from askyourdocs.modelling.batching import EmbeddingBatcher, EmbeddingBatchError  # noqa: E402
+
+
+class FakeEmbedder:
+    """Embeds a text as [len(text), 1] and fails for batches containing a text starting with 'bad'."""
+
+    def __init__(self):
+        self.batches: List[List[str]] = []
+
+    def apply(self, texts: List[str], batch_size: int, normalize_embeddings: bool = True) -> np.ndarray:
+        self.batches.append(list(texts))
+        if any(t.startswith('bad') for t in texts):
+            raise RuntimeError('bad text')
+        return np.asarray([[len(t), 1] for t in texts], dtype=np.float32)
+
+
+def test_embedding_batcher_combines_owners_into_full_batches():
+    embedder = FakeEmbedder()
+    batcher = EmbeddingBatcher(embedder=embedder, batch_size=2, nbatches=2, normalize_embeddings=False)
+    assert batcher.add(owner='a', texts=['a', 'aaa']) == []
+    completed = batcher.add(owner='b', texts=['bb', 'bbbb'])
+
+    assert [owner for owner, _ in completed] == ['a', 'b']
+    assert all(len(batch) == 2 for batch in embedder.batches)
+    # Batches are length-sorted, the vectors are routed back in the order of the owner's texts
+    assert embedder.batches == [['a', 'bb'], ['aaa', 'bbbb']]
+    np.testing.assert_array_equal(completed[0][1][:, 0], [1, 3])
+    np.testing.assert_array_equal(completed[1][1][:, 0], [2, 4])
+
+
+def test_embedding_batcher_flushes_pending_texts():
+    batcher = EmbeddingBatcher(embedder=FakeEmbedder(), batch_size=4, nbatches=2, normalize_embeddings=False)
+    assert batcher.add(owner='a', texts=['a']) == []
+    # Owners without texts are complete right away
+    assert [owner for owner, _ in batcher.add(owner='empty', texts=[])] == ['empty']
+    completed = batcher.flush()
+    assert [owner for owner, _ in completed] == ['a']
+    assert completed[0][1].shape == (1, 2)
+
+
+def test_embedding_batcher_fails_only_the_owner_of_a_failing_text():
+    batcher = EmbeddingBatcher(embedder=FakeEmbedder(), batch_size=4, nbatches=1, normalize_embeddings=False)
+    batcher.add(owner='a', texts=['a1', 'a2'])
+    with pytest.raises(EmbeddingBatchError) as exc_info:
+        batcher.add(owner='b', texts=['bad1', 'b2'])
+
+    assert exc_info.value.owners == ['b']
+    assert [owner for owner, _ in exc_info.value.completed] == ['a']
+    assert batcher.flush() == []
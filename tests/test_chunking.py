@@ -0,0 +1,58 @@
+from typing import List
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('nltk')
+
+from askyourdocs.modelling.chunking import RegexSplitter, SlidingWindowChunker  # noqa: E402
+
+
+def count_words(texts: List[str]) -> List[int]:
+    return [len(t.split()) for t in texts]
+
+
+def get_chunker(chunk_size: int = 12, chunk_overlap: int = 4) -> SlidingWindowChunker:
+    return SlidingWindowChunker(splitter=RegexSplitter(), token_counter=count_words, chunk_size=chunk_size,
+                                chunk_overlap=chunk_overlap)
+
+
+TEXT = ' '.join(f'Sentence {i} is short.' for i in range(20))
+
+
+def test_sliding_window_chunks_fit_the_chunk_size():
+    chunks = get_chunker().apply(text=TEXT)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.ntokens == count_words([chunk.text])[0]
+        assert chunk.ntokens <= 12
+
+
+def test_sliding_window_overlap_repeats_the_previous_chunk():
+    chunks = get_chunker().apply(text=TEXT)
+    assert chunks[0].overlap == 0
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.overlap > 0
+        assert previous.text.endswith(chunk.text[:chunk.overlap].rstrip())
+
+
+def test_sliding_window_chunks_reconstruct_the_text():
+    chunks = get_chunker().apply(text=TEXT)
+    assert ' '.join(c.text[c.overlap:] for c in chunks) == TEXT
+
+
+def test_sliding_window_splits_long_sentences_and_words():
+    def count_word_pieces(texts: List[str]) -> List[int]:
+        return [sum(-(-len(w) // 4) for w in t.split()) for t in texts]
+
+    long_sentence = ' '.join(['word'] * 30) + ' ' + 'x' * 40 + '.'
+    chunker = SlidingWindowChunker(splitter=RegexSplitter(), token_counter=count_word_pieces, chunk_size=8,
+                                   chunk_overlap=2)
+    chunks = chunker.apply(text=long_sentence)
+    assert all(c.ntokens == count_word_pieces([c.text])[0] <= 8 for c in chunks)
+    assert ''.join(c.text[c.overlap:] for c in chunks).replace(' ', '') == long_sentence.replace(' ', '')
+
+
+def test_sliding_window_rejects_overlap_exceeding_chunk_size():
+    with pytest.raises(ValueError):
+        get_chunker(chunk_size=4, chunk_overlap=4)
@@ -0,0 +1,69 @@
+import threading
+from typing import List
+
+import requests
+
+from askyourdocs import TextDocument, TextEntity
+from askyourdocs.storage.indexing import BulkIndexer
+
+
+class FakeSolrClient:
+    """Records the posted batches, where the first `nfailures` posts fail with the given exception."""
+
+    def __init__(self, nfailures: int = 0, exc: Exception | None = None):
+        self.nfailures = nfailures
+        self.exc = exc
+        self.posted: List[str] = []
+        self._lock = threading.Lock()
+
+    def post_update(self, collection: str, data: str | bytes, commit: bool = False, params: dict | None = None,
+                    timeout: float | None = None):
+        with self._lock:
+            if self.nfailures > 0:
+                self.nfailures -= 1
+                raise self.exc
+            self.posted.append(data)
+
+
+def get_entities(n: int) -> List[TextEntity]:
+    """Text entities of a document, with the ids assigned by the ingestion pipeline."""
+    document = TextDocument(id='docs/leaflet.pdf', name='leaflet.pdf', source='docs', text=None)
+    return [TextEntity(id=f'{document.id}{i}text {i}', text=f'text {i}', doc_id=document.id, index=i) for i in range(n)]
+
+
+def get_http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+def test_bulk_indexer_sends_batches():
+    solr_client = FakeSolrClient()
+    indexer = BulkIndexer(solr_client=solr_client, batch_size=2, nworkers=2)
+    report = indexer.apply(documents=get_entities(5), collection='texts')
+    assert report.ok and report.ndocs == 5
+    assert len(report.batches) == len(solr_client.posted) == 3
+
+
+def test_bulk_indexer_retries_transient_failures():
+    solr_client = FakeSolrClient(nfailures=2, exc=get_http_error(503))
+    indexer = BulkIndexer(solr_client=solr_client, batch_size=10, nworkers=1, max_retries=3, backoff=0.001)
+    report = indexer.apply(documents=get_entities(3), collection='texts')
+    assert report.ok
+    assert report.batches[0].attempts == 3
+    assert len(solr_client.posted) == 1
+
+
+def test_bulk_indexer_reports_failures_without_raising():
+    solr_client = FakeSolrClient(nfailures=10, exc=requests.ConnectionError())
+    indexer = BulkIndexer(solr_client=solr_client, batch_size=10, nworkers=1, max_retries=2, backoff=0.001)
+    report = indexer.apply(documents=get_entities(3), collection='texts')
+    assert not report.ok
+    assert report.failed[0].attempts == 3 and 'ConnectionError' in report.failed[0].error
+
+
+def test_bulk_indexer_does_not_retry_permanent_failures():
+    solr_client = FakeSolrClient(nfailures=1, exc=get_http_error(400))
+    indexer = BulkIndexer(solr_client=solr_client, batch_size=10, nworkers=1, backoff=0.001)
+    report = indexer.apply(documents=get_entities(3), collection='texts')
+    assert not report.ok and report.batches[0].attempts == 1
@@ -0,0 +1,106 @@
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from askyourdocs.pipeline.manifest import Manifest, ManifestEntry
+
+
+def test_manifest_persists_entries(tmp_path):
+    path = tmp_path / 'manifest.json'
+    manifest = Manifest(path=path)
+    manifest.set(ManifestEntry(filename='a.pdf', content_hash='h1', size=1, mtime=1.0))
+    manifest.set_status(filename='a.pdf', status=Manifest.DONE, doc_id='doc_a')
+
+    entry = Manifest(path=path).get('a.pdf')
+    assert entry.status == Manifest.DONE and entry.doc_id == 'doc_a'
+    assert entry.is_unchanged(size=1, mtime=1.0)
+    assert not entry.is_unchanged(size=2, mtime=1.0)
+
+
+def test_manifest_batch_saves_once_at_the_end(tmp_path):
+    path = tmp_path / 'manifest.json'
+    manifest = Manifest(path=path)
+    with manifest.batch():
+        manifest.set(ManifestEntry(filename='a.pdf', content_hash='h1', size=1, mtime=1.0))
+        manifest.set(ManifestEntry(filename='b.pdf', content_hash='h2', size=2, mtime=2.0))
+        manifest.remove('a.pdf')
+        assert not path.exists()
+    assert [e['filename'] for e in json.loads(path.read_text())['entries']] == ['b.pdf']
+
+
+@pytest.fixture
+def pipeline():
+    pytest.importorskip('torch')
+    from askyourdocs.pipeline.pipeline import IngestionPipeline
+
+    class _Pipeline(IngestionPipeline):
+        """Ingestion pipeline recording the ingested and removed documents instead of talking to solr."""
+
+        def __init__(self):
+            self.ingested, self.removed = [], []
+            self._removal_pipeline = SimpleNamespace(apply=lambda id_: self.removed.append(id_))
+
+        def _add_document(self, filename: str, on_stage=None, content_hash: str | None = None):
+            self.ingested.append(Path(filename).name)
+            return self.get_document_id(filename=filename)
+
+        def _save_vector_index(self):
+            pass
+
+        def _log_cache_stats(self):
+            pass
+
+    return _Pipeline()
+
+
+def test_sync_plans_new_changed_unchanged_and_deleted_files(tmp_path, pipeline):
+    source, manifest_path = tmp_path / 'docs', tmp_path / 'manifest.json'
+    source.mkdir()
+    for name in ('a.pdf', 'b.pdf', 'c.pdf'):
+        (source / name).write_text(name)
+
+    pipeline.sync(source=str(source), manifest_path=manifest_path)
+    assert sorted(pipeline.ingested) == ['a.pdf', 'b.pdf', 'c.pdf']
+
+    # a.pdf is unchanged, b.pdf is changed, c.pdf is deleted, and d.pdf is new
+    pipeline.ingested.clear()
+    (source / 'b.pdf').write_text('b.pdf changed')
+    (source / 'c.pdf').unlink()
+    (source / 'd.pdf').write_text('d.pdf')
+    pipeline.sync(source=str(source), manifest_path=manifest_path)
+    assert sorted(pipeline.ingested) == ['b.pdf', 'd.pdf']
+    removed = [pipeline.get_document_id(filename=str(source / f)) for f in ('b.pdf', 'c.pdf')]
+    assert sorted(pipeline.removed) == sorted(removed)
+
+    manifest = Manifest(path=manifest_path)
+    assert sorted(Path(f).name for f in manifest.filenames) == ['a.pdf', 'b.pdf', 'd.pdf']
+    assert all(manifest.get(f).status == Manifest.DONE for f in manifest.filenames)
+
+
+def test_sync_skips_touched_files_with_the_same_content(tmp_path, pipeline):
+    source, manifest_path = tmp_path / 'docs', tmp_path / 'manifest.json'
+    source.mkdir()
+    (source / 'a.pdf').write_text('a.pdf')
+    pipeline.sync(source=str(source), manifest_path=manifest_path)
+
+    pipeline.ingested.clear()
+    stat = (source / 'a.pdf').stat()
+    os.utime(source / 'a.pdf', (stat.st_atime, stat.st_mtime + 10))
+    pipeline.sync(source=str(source), manifest_path=manifest_path)
+    assert pipeline.ingested == [] and pipeline.removed == []
+
+
+def test_sync_reingests_pending_files_of_an_interrupted_run(tmp_path, pipeline):
+    source, manifest_path = tmp_path / 'docs', tmp_path / 'manifest.json'
+    source.mkdir()
+    (source / 'a.pdf').write_text('a.pdf')
+    filename, stat = str(source / 'a.pdf'), (source / 'a.pdf').stat()
+    doc_id = pipeline.get_document_id(filename=filename)
+    Manifest(path=manifest_path).set(ManifestEntry(filename=filename, content_hash='h', size=stat.st_size,
+                                                   mtime=stat.st_mtime, doc_id=doc_id, status=Manifest.PENDING))
+
+    pipeline.sync(source=str(source), manifest_path=manifest_path)
+    assert pipeline.ingested == ['a.pdf'] and pipeline.removed == [doc_id]
@@ -0,0 +1,22 @@
+import pytest
+
+from askyourdocs.pipeline.retrieval import reciprocal_rank_fusion
+
+
+def test_reciprocal_rank_fusion_scores_hits_by_their_ranks():
+    keyword = [{'txt_ent_id': 'a', 'score': 12.0}, {'txt_ent_id': 'b', 'score': 7.0}]
+    vector = [{'txt_ent_id': 'b', 'score': 0.9, 'text': 'B'}, {'txt_ent_id': 'c', 'score': 0.8}]
+    hits = reciprocal_rank_fusion(rankings=[keyword, vector], k=60)
+
+    assert [h['txt_ent_id'] for h in hits] == ['b', 'a', 'c']
+    assert hits[0]['score'] == pytest.approx(1 / 62 + 1 / 61)
+    assert hits[1]['score'] == pytest.approx(1 / 61)
+    # Missing fields are filled by later lists
+    assert hits[0]['text'] == 'B'
+
+
+def test_reciprocal_rank_fusion_returns_the_top_k_hits():
+    ranking = [{'txt_ent_id': str(i), 'score': 1.0} for i in range(5)]
+    hits = reciprocal_rank_fusion(rankings=[ranking], top_k=2)
+    assert [h['txt_ent_id'] for h in hits] == ['0', '1']
+    assert reciprocal_rank_fusion(rankings=[[], []]) == []
@@ -0,0 +1,89 @@
+import threading
+from typing import List
+
+import numpy as np
+
+from askyourdocs import EmbeddingEntity, TextDocument, TextEntity
+from askyourdocs.storage.vectors import LocalVectorIndex
+
+
+def get_entities(name: str, texts: List[str], vectors) -> List[EmbeddingEntity]:
+    """Embedding entities of a document, with the ids assigned by the ingestion pipeline."""
+    document = TextDocument(id=name, name=name, source='', text=' '.join(texts))
+    text_entities = [TextEntity(id=f'{document.id}{i}{text}', text=text, doc_id=document.id, index=i)
+                     for i, text in enumerate(texts)]
+    return [EmbeddingEntity(id=te.text, vector=np.asarray(v, dtype=np.float32), doc_id=te.doc_id, txt_ent_id=te.id,
+                            passage_id=te.passage_id, index=te.index)
+            for te, v in zip(text_entities, vectors)]
+
+
+def doc_id(name: str) -> str:
+    return TextDocument(id=name, name=name, source='', text=None).id
+
+
+def search(index: LocalVectorIndex, query, top_k: int = 5) -> List[dict]:
+    return index.search(queries=np.asarray(query, dtype=np.float32), top_k=top_k)[0]
+
+
+def test_local_vector_index_searches_by_dot_product(tmp_path):
+    index = LocalVectorIndex(path=tmp_path, dimension=2, capacity=2)
+    index.add(entities=get_entities('a', ['first', 'second'], [[1, 0], [0, 1]]) + get_entities('b', ['third'], [[1, 1]]))
+    assert len(index) == 3
+
+    hits = search(index, [1, 0], top_k=2)
+    assert [(h['doc_id'], h['index']) for h in hits] == [(doc_id('a'), 0), (doc_id('b'), 0)]
+    assert hits[0]['score'] > hits[1]['score']
+
+
+def test_local_vector_index_keeps_identical_texts_of_other_documents(tmp_path):
+    index = LocalVectorIndex(path=tmp_path, dimension=2)
+    index.add(entities=get_entities('a', ['Keep out of reach of children.', 'a only'], [[1, 0], [0, 1]]))
+    index.add(entities=get_entities('b', ['Keep out of reach of children.'], [[1, 0]]))
+    assert len(index) == 3
+
+    assert index.remove(doc_id=doc_id('a')) == 2
+    assert [h['doc_id'] for h in search(index, [1, 0])] == [doc_id('b')]
+
+
+def test_local_vector_index_removes_documents_and_reuses_rows(tmp_path):
+    index = LocalVectorIndex(path=tmp_path, dimension=2)
+    index.add(entities=get_entities('a', ['first'], [[1, 0]]) + get_entities('b', ['second'], [[0, 1]]))
+    assert index.remove(doc_id=doc_id('a')) == 1
+    assert [h['doc_id'] for h in search(index, [1, 0])] == [doc_id('b')]
+
+    index.add(entities=get_entities('c', ['third'], [[1, 0]]))
+    assert index.nrows == 2
+    assert search(index, [1, 0], top_k=1)[0]['doc_id'] == doc_id('c')
+
+
+def test_local_vector_index_reloads_saved_and_journaled_changes(tmp_path):
+    index = LocalVectorIndex(path=tmp_path, dimension=2)
+    index.add(entities=get_entities('a', ['first'], [[1, 0]]) + get_entities('b', ['second'], [[0, 1]]))
+    index.save()
+    # Changes after the last save are replayed from the journal
+    index.remove(doc_id=doc_id('b'))
+    index.add(entities=get_entities('c', ['third'], [[1, 1]]))
+
+    reloaded = LocalVectorIndex(path=tmp_path, dimension=2)
+    assert len(reloaded) == 2
+    assert [h['doc_id'] for h in search(reloaded, [0, 1])] == [doc_id('c'), doc_id('a')]
+
+
+def test_local_vector_index_syncs_changes_of_other_instances(tmp_path):
+    writer, reader = LocalVectorIndex(path=tmp_path, dimension=2), LocalVectorIndex(path=tmp_path, dimension=2)
+    writer.add(entities=get_entities('a', ['first'], [[1, 0]]))
+    assert [h['doc_id'] for h in search(reader, [1, 0])] == [doc_id('a')]
+    writer.remove(doc_id=doc_id('a'))
+    assert search(reader, [1, 0]) == []
+
+
+def test_local_vector_index_serves_concurrent_searches(tmp_path):
+    index = LocalVectorIndex(path=tmp_path, dimension=2)
+    index.add(entities=get_entities('a', [f'text {i}' for i in range(100)], np.random.rand(100, 2)))
+    # Searches share the lock: a search blocked by a slow one would not finish while the other one holds it
+    done = threading.Event()
+    with index._locked(exclusive=False):
+        thread = threading.Thread(target=lambda: (search(index, [1, 0]), done.set()))
+        thread.start()
+        assert done.wait(timeout=5)
+    thread.join()